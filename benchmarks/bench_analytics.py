@@ -0,0 +1,96 @@
+"""Compare the per-metric loops in analytics.py with the vectorized analytics_engine.
+
+    python benchmarks/bench_analytics.py --sizes 100000 1000000 10000000
+
+"frame_seconds" is the one-off conversion to the columnar frame and
+"compute_seconds" the KPI pass on it. Sizes above --max-legacy-rows are only run through the engine, fed with
+columns instead of record dicts (10^7 dicts do not fit in memory).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dashboard"))
+
+import analytics  # noqa: E402
+from analytics_engine import compute_all, to_frame  # noqa: E402
+
+LEGACY_FUNCTIONS = [
+    "occupancy_frequency", "fan_usage_time", "led_usage_time", "occupancy_duration",
+    "peak_usage_time", "automation_efficiency", "system_response_time",
+]
+
+
+def synthetic_columns(n, seed=0):
+    """Telemetry shaped like the firmware's publishStatus, one row per state change"""
+    rng = np.random.default_rng(seed)
+    gaps = rng.integers(1, 900, size=n).cumsum()
+    start = datetime(2026, 1, 1)
+    return {
+        "timestamp": [(start + timedelta(seconds=int(g), microseconds=int(g) % 997)).isoformat()
+                      for g in gaps],
+        "occupied": rng.integers(0, 2, size=n).tolist(),
+        "fan": rng.integers(0, 2, size=n).tolist(),
+        "led": rng.integers(0, 2, size=n).tolist(),
+        "fan_override": (rng.random(n) < 0.1).astype(int).tolist(),
+        "led_override": (rng.random(n) < 0.1).astype(int).tolist(),
+    }
+
+
+def to_records(columns):
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+def run(sizes, max_legacy_rows):
+    results = []
+    for n in sizes:
+        columns = synthetic_columns(n)
+        row = {"rows": n}
+
+        if n <= max_legacy_rows:
+            records = to_records(columns)
+            started = time.perf_counter()
+            legacy = {name: getattr(analytics, name)(records) for name in LEGACY_FUNCTIONS}
+            row["legacy_seconds"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            frame = to_frame(records)
+            row["frame_seconds"] = time.perf_counter() - started
+        else:
+            started = time.perf_counter()
+            frame = to_frame(columns)
+            row["frame_seconds"] = time.perf_counter() - started
+
+        # KPIs on an already-built frame (the frame is parsed once and reused)
+        started = time.perf_counter()
+        engine = compute_all(frame)
+        row["compute_seconds"] = time.perf_counter() - started
+        row["engine_seconds"] = row["frame_seconds"] + row["compute_seconds"]
+
+        if "legacy_seconds" in row:
+            row["speedup"] = row["legacy_seconds"] / row["engine_seconds"]
+            row["compute_speedup"] = row["legacy_seconds"] / row["compute_seconds"]
+            row["identical"] = legacy == engine
+
+        results.append(row)
+        print(json.dumps(row), flush=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--max-legacy-rows", type=int, default=1000000)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.max_legacy_rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "analytics", "results": results}, f, indent=2)
@@ -0,0 +1,119 @@
+"""Archive a year of telemetry to Parquet and run the year-long report on it.
+
+    python benchmarks/bench_archive.py --rooms 5 --days 365
+
+Fills a fake Firestore with --days of telemetry per room, times the report
+(firestore_client.get_history + analytics_engine.compute_all) for one room
+over the whole period while everything is in Firestore, runs archive.py
+into a temporary directory, and times the same report again on the Parquet
+archive plus the remaining hot days. "identical" checks the KPIs match.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "pythonSubscriber"))
+sys.path.insert(0, os.path.join(HERE, "..", "dashboard"))
+
+# The dashboard modules read these at import time
+os.environ["FAKE_FIRESTORE"] = "1"
+os.environ.setdefault("LOG_LEVEL", "WARNING")   # keep stdout for the JSON results
+
+from archive import Archiver  # noqa: E402
+from fake_firestore import FakeClient  # noqa: E402
+from router import document_id  # noqa: E402
+
+import cold_store  # noqa: E402
+import firestore_client  # noqa: E402
+from analytics_engine import compute_all, STATE_COLUMNS  # noqa: E402
+
+START = datetime(2025, 1, 1)
+
+
+def synthetic_rows(device_id, days, seed):
+    """One row per state change, every 1-600 s"""
+    rng = np.random.default_rng(seed)
+    n = int(days * 86400 / 300)
+    gaps = rng.integers(1, 600, size=n).cumsum()
+    gaps = gaps[gaps < days * 86400]
+    states = rng.integers(0, 2, size=(len(gaps), len(STATE_COLUMNS)))
+    for g, state in zip(gaps, states):
+        row = dict(zip(STATE_COLUMNS, state.tolist()))
+        row["device_id"] = device_id
+        row["timestamp"] = (START + timedelta(seconds=int(g))).isoformat()
+        yield row
+
+
+def load(db, rooms, days):
+    rows = 0
+    batch = db.batch()
+    for number in range(1, rooms + 1):
+        for data in synthetic_rows(f"room_{number:02d}", days, seed=number):
+            batch.set(db.collection("room_telemetry").document(document_id("room_telemetry", data)), data)
+            rows += 1
+            if rows % 500 == 0:
+                batch.commit()
+                batch = db.batch()
+    batch.commit()
+    return rows
+
+
+def report(device_id, days):
+    started = time.perf_counter()
+    columns = firestore_client.get_history("room_telemetry", device_id, START,
+                                           START + timedelta(days=days), columns=STATE_COLUMNS)
+    kpis = compute_all(columns)
+    return kpis, len(columns["timestamp"]), time.perf_counter() - started
+
+
+def run(rooms, days, after_days):
+    db = FakeClient()
+    firestore_client._db = db
+    rows = load(db, rooms, days)
+    result = {"benchmark": "archive", "rooms": rooms, "days": days, "rows": rows}
+
+    hot_kpis, result["report_rows"], result["firestore_report_seconds"] = report("room_01", days)
+
+    directory = tempfile.mkdtemp(prefix="bench-archive-")
+    try:
+        archiver = Archiver(db, uri=directory, after_days=after_days)
+        started = time.perf_counter()
+        archiver.run(collections=["room_telemetry"], now=START + timedelta(days=days))
+        result["archive_seconds"] = time.perf_counter() - started
+        result["archived"] = archiver.archived
+        result["partitions"] = archiver.partitions
+        result["hot_documents_left"] = len(db.collection("room_telemetry"))
+        result["archive_mb"] = sum(os.path.getsize(os.path.join(d, f))
+                                   for d, _, files in os.walk(directory) for f in files) / 2**20
+
+        cold_store.ARCHIVE_URI = directory
+        cold_store._filesystem = None
+        cold_store._watermarks.clear()
+        cold_kpis, cold_rows, result["archive_report_seconds"] = report("room_01", days)
+        result["identical"] = cold_kpis == hot_kpis and cold_rows == result["report_rows"]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--after-days", type=int, default=30, help="archive documents older than this")
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    result = run(args.rooms, args.days, args.after_days)
+    print(json.dumps(result))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
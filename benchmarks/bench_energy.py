@@ -0,0 +1,107 @@
+"""Building-wide energy and anomaly report: one batch pass vs a loop over rooms.
+
+    python benchmarks/bench_energy.py --rooms 100 300 --days 30
+
+Generates --days of telemetry for each room as one columnar table with a
+device_id column (the shape of firestore_client.get_history across rooms)
+and times energy.compute_energy on all rooms at once ("batch_seconds") and
+room by room ("per_room_seconds"). "matches_reference" checks the fan/lamp
+hours of a few rooms against a plain loop over the rows that closes the
+last open interval at the end of the range.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dashboard"))
+
+from energy import compute_energy, DEVICE_WATTS  # noqa: E402
+
+START = datetime(2025, 1, 1)
+
+
+def synthetic_columns(rooms, days, seed=0):
+    """State changes every 1-600 s; devices follow occupancy, with some manual presses"""
+    rng = np.random.default_rng(seed)
+    columns = {k: [] for k in ("device_id", "timestamp", "occupied", "fan", "led",
+                               "fan_override", "led_override")}
+    for number in range(rooms):
+        gaps = rng.integers(1, 600, size=int(days * 86400 / 300)).cumsum()
+        gaps = gaps[gaps < days * 86400]
+        n = len(gaps)
+        occupied = (rng.random(n) < 0.05).cumsum() % 2
+        manual = rng.random(n) < 0.02
+        fan = np.where(manual, 1, occupied)
+        override = (manual & (rng.random(n) < 0.5)).astype(int)
+        columns["device_id"] += [f"room_{number:03d}"] * n
+        columns["timestamp"] += [(START + timedelta(seconds=int(g))).isoformat() for g in gaps]
+        columns["occupied"] += occupied.tolist()
+        columns["fan"] += fan.tolist()
+        columns["led"] += occupied.tolist()
+        columns["fan_override"] += override.tolist()
+        columns["led_override"] += [0] * n
+    return columns
+
+
+def reference_hours(columns, device_id, field, until):
+    """On-time of one device in one room, closing an interval still open at until"""
+    total, last_on = 0.0, None
+    for room, ts, value in zip(columns["device_id"], columns["timestamp"], columns[field]):
+        if room != device_id:
+            continue
+        ts = datetime.fromisoformat(ts)
+        if value == 1 and last_on is None:
+            last_on = ts
+        elif value == 0 and last_on is not None:
+            total += (ts - last_on).total_seconds()
+            last_on = None
+    if last_on is not None:
+        total += (until - last_on).total_seconds()
+    return total / 3600
+
+
+def run(rooms, days):
+    columns = synthetic_columns(rooms, days)
+    until = START + timedelta(days=days)
+    result = {"benchmark": "energy", "rooms": rooms, "days": days, "rows": len(columns["timestamp"])}
+
+    started = time.perf_counter()
+    report = compute_energy(columns, until=until)
+    result["batch_seconds"] = time.perf_counter() - started
+    result["kwh"] = float(report["rooms"]["kwh"].sum())
+    result["anomalies"] = len(report["anomalies"])
+
+    bounds = np.flatnonzero(np.r_[True, np.asarray(columns["device_id"][1:]) != np.asarray(columns["device_id"][:-1])])
+    bounds = np.append(bounds, len(columns["device_id"]))
+    started = time.perf_counter()
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        compute_energy({columns["device_id"][lo]: {k: v[lo:hi] for k, v in columns.items()}}, until=until)
+    result["per_room_seconds"] = time.perf_counter() - started
+    result["speedup"] = result["per_room_seconds"] / result["batch_seconds"]
+
+    checked = report["rooms"].index[:3]
+    result["matches_reference"] = all(
+        abs(report["rooms"].loc[room, f"{field}_hours"] - reference_hours(columns, room, field, until)) < 1e-6
+        for room in checked for field in DEVICE_WATTS
+    )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, nargs="+", default=[100, 300])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    for rooms in args.rooms:
+        result = run(rooms, args.days)
+        print(json.dumps(result))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,161 @@
+"""Fleet overview of every room: one grouped pass and incremental refreshes vs a loop over rooms.
+
+    python benchmarks/bench_fleet.py --rooms 100 500 --days 7
+
+Writes --days of telemetry for each room (a state change every 1-600 s) to a
+fake Firestore, fills the all-rooms cache ("cache_load_seconds") and times
+fleet.FleetView: the first refresh, which computes every room in one grouped
+pass ("cold_seconds"), against grouping the cached rows by room and running
+analytics_engine.compute_all on each ("per_room_seconds"). Then new rows
+arrive for --changed rooms and for every room; "read_seconds" is the cache
+reading them and "refresh_seconds" the fleet refresh that recomputes only
+those rooms; "late" rows are stamped an hour back, as a spool replaying a
+backlog would commit them, and must still be counted. "idle_refresh_seconds"
+is a refresh with nothing new. Rows carry a commit time as the ingesters
+write them, so the cache reads only what was committed since. Reads are
+timed apart because the fake Firestore scans the whole collection for every
+query. "identical" checks every room against compute_all afterwards and
+"complete" that the cache holds every row written.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "pythonSubscriber"))
+sys.path.insert(0, os.path.join(HERE, "..", "dashboard"))
+
+# The dashboard modules read this at import time
+os.environ["FAKE_FIRESTORE"] = "1"
+
+from batch_writer import stamped  # noqa: E402
+from fake_firestore import FakeClient  # noqa: E402
+
+import firestore_client  # noqa: E402
+from analytics_engine import compute_all  # noqa: E402
+from fleet import FleetView  # noqa: E402
+
+
+def room_name(number):
+    return f"room_{number:03d}"
+
+
+def write_rows(db, rows):
+    batch = db.batch()
+    for i, (doc_id, data) in enumerate(rows):
+        batch.set(db.collection("room_telemetry").document(doc_id), stamped(db, data))
+        if i % 500 == 499:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+
+
+def synthetic_rows(rooms, days, start, seed=0):
+    """State changes every 1-600 s per room, interleaved in ingest order like the live collection"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for number in range(rooms):
+        offsets = rng.integers(1, 600, size=int(days * 86400 / 300)).cumsum()
+        offsets = offsets[offsets < days * 86400]
+        occupied = (rng.random(len(offsets)) < 0.1).cumsum() % 2
+        manual = rng.random(len(offsets)) < 0.02
+        for i, (offset, occ, man) in enumerate(zip(offsets.tolist(), occupied.tolist(), manual.tolist())):
+            rows.append((offset, number, i, {
+                "device_id": room_name(number),
+                "occupied": occ,
+                "fan": 1 if man else occ,
+                "led": occ,
+                "fan_override": int(man),
+                "led_override": 0
+            }))
+    rows.sort(key=lambda r: r[0])
+    return [(f"{room_name(number)}-{i}", dict(data, timestamp=(start + timedelta(seconds=offset)).isoformat()))
+            for offset, number, i, data in rows]
+
+
+def new_rows(rooms, at, tag):
+    """One occupancy change per room, stamped at `at`"""
+    return [(f"{room}-new-{tag}", {"device_id": room, "timestamp": at.isoformat(), "occupied": 1, "fan": 1,
+                              "led": 1, "fan_override": 0, "led_override": 0}) for room in rooms]
+
+
+def per_room_records(cache):
+    records = defaultdict(list)
+    for r in cache.records():
+        records[r["device_id"]].append(r)
+    return records
+
+
+def run(rooms, days, changed):
+    db = FakeClient()
+    firestore_client._db = db
+    firestore_client._caches.clear()
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=days)
+    write_rows(db, synthetic_rows(rooms, days, start))
+    result = {"benchmark": "fleet", "rooms": rooms, "days": days, "rows": len(db.collection("room_telemetry"))}
+
+    cache = firestore_client.get_cache("room_telemetry")
+    cache.min_refresh_seconds = float("inf")   # reads only happen where timed below
+    started = time.perf_counter()
+    cache.refresh(force=True)
+    result["cache_load_seconds"] = time.perf_counter() - started
+
+    fleet = FleetView(start, now + timedelta(days=1), min_refresh_seconds=0)
+    started = time.perf_counter()
+    fleet.refresh()
+    result["cold_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    records = per_room_records(cache)
+    for rows in records.values():
+        compute_all(rows)
+    result["per_room_seconds"] = time.perf_counter() - started
+    result["speedup"] = result["per_room_seconds"] / result["cold_seconds"]
+
+    names = sorted(records)
+    for key in ("read_seconds", "refresh_seconds", "rooms_recomputed"):
+        result[key] = {}
+    late = datetime.utcnow() - timedelta(hours=1)
+    for label, subset, at in ((str(changed), names[:changed], None), ("all", names, None),
+                              ("late", names[:changed], late)):
+        write_rows(db, new_rows(subset, at or datetime.utcnow(), label))
+        started = time.perf_counter()
+        cache.refresh(force=True)
+        result["read_seconds"][label] = time.perf_counter() - started
+        started = time.perf_counter()
+        result["rooms_recomputed"][label] = fleet.refresh()
+        result["refresh_seconds"][label] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    fleet.refresh()
+    result["idle_refresh_seconds"] = time.perf_counter() - started
+
+    result["complete"] = len(cache.records()) == len(db.collection("room_telemetry"))
+    records = per_room_records(cache)
+    result["identical"] = len(fleet.kpis) == len(records) and all(
+        fleet.kpis[room] == compute_all(rows) for room, rows in records.items()
+    )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--changed", type=int, default=10, help="rooms with new rows in the first refresh")
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    for rooms in args.rooms:
+        result = run(rooms, args.days, args.changed)
+        print(json.dumps(result))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,164 @@
+"""End-to-end ingest: virtual rooms -> broker stand-in -> Ingester -> fake Firestore.
+
+    python benchmarks/bench_ingest.py --rooms 200 --rate 5 --duration 20
+
+Latency runs from the device timestamp in each message to the commit of its
+document, so it includes routing, the spool or batch writer and the fake
+Firestore round-trip (--firestore-latency). CPU and RSS are those of this
+process, which also runs the virtual rooms. --record writes the committed
+documents as a trace for bench_replay.py. Unchanged telemetry states are
+not stored unless --no-dedup; writes_avoided counts them. --reboot restarts
+every room halfway through, so their seqs start again at 1; "complete" then
+checks that no reading after the reboot was dropped as a duplicate.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pythonSubscriber"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")   # keep stdout for the JSON results
+
+from loadgen import VirtualRoom, FakeBroker, publish_load, write_trace  # noqa: E402
+from batch_writer import COMMITTED  # noqa: E402
+from fake_firestore import FakeClient, Increment  # noqa: E402
+from mqtt_to_firestore import Ingester  # noqa: E402
+from pipeline_stats import iso_to_epoch  # noqa: E402
+from router import SUBSCRIBE_TOPIC  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def rss_mb():
+    """Current resident set size (Linux); peak RSS elsewhere"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def avoided(ingester):
+    return ingester.changes.suppressed if ingester.changes is not None else 0
+
+
+def run(rooms, rate, duration, binary=False, writer="spool", workers=4,
+        firestore_latency=0.0, drain_timeout=30, record=None, dedup=True, reboot=False):
+    db = FakeClient(latency=firestore_latency)
+    spool_dir = tempfile.mkdtemp(prefix="bench-spool-") if writer == "spool" else ""
+    ingester = Ingester(db, Increment, spool_dir=spool_dir, num_workers=workers,
+                        overflow_policy="block", dedup=dedup)
+
+    # Exact per-document latency next to the ingester's own histograms
+    latencies = []
+    lock = threading.Lock()
+    committed_hook = ingester.writer.on_commit
+
+    def on_commit(docs):
+        now = time.time()
+        with lock:
+            latencies.extend(now - iso_to_epoch(d["device_timestamp"])
+                             for d in docs if d.get("device_timestamp"))
+        committed_hook(docs)
+
+    ingester.writer.on_commit = on_commit
+    broker = FakeBroker().start()
+    broker.subscribe(SUBSCRIBE_TOPIC, ingester.on_message)
+    devices = [VirtualRoom(i + 1, binary=binary) for i in range(rooms)]
+
+    rss_before = rss_mb()
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    if reboot:
+        published = publish_load(broker, devices, rate, duration / 2)
+        for device in devices:
+            device.reboot()
+        published += publish_load(broker, devices, rate, duration / 2)
+    else:
+        published = publish_load(broker, devices, rate, duration)
+    publish_seconds = time.monotonic() - started
+
+    # A binary frame carries both documents; JSON sends one message per document
+    expected = published * 2 if binary else published
+    deadline = time.monotonic() + drain_timeout
+    while ingester.committed() + avoided(ingester) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - started
+    cpu_seconds = time.process_time() - cpu_started
+    committed = ingester.committed()
+    handled = committed + avoided(ingester)
+
+    broker.stop()
+    ingester.stop()
+    if spool_dir:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    if record:
+        # The commit time is the fake's, not part of the trace
+        docs = [(name, {k: v for k, v in d.to_dict().items() if k != COMMITTED})
+                for name in ("room_telemetry", "room_events") for d in db.collection(name).stream()]
+        docs.sort(key=lambda item: item[1]["timestamp"])
+        write_trace(record, docs)
+
+    sequences = ingester.stats.sequences.snapshot()
+    return {
+        "benchmark": "ingest",
+        "rooms": rooms,
+        "rate_per_room": rate,
+        "encoding": "binary" if binary else "json",
+        "writer": writer,
+        "workers": workers,
+        "firestore_latency_ms": firestore_latency * 1000,
+        "published": published,
+        "published_per_second": published / publish_seconds,
+        "documents_committed": committed,
+        "complete": handled >= expected,
+        "writes_avoided": avoided(ingester),
+        "msgs_per_second": (handled / 2 if binary else handled) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "cpu_seconds": cpu_seconds,
+        "cpu_percent": 100 * cpu_seconds / elapsed,
+        "rss_mb": rss_mb(),
+        "rss_growth_mb": rss_mb() - rss_before,
+        "firestore_round_trips": db.round_trips,
+        "decode_errors": ingester.dispatcher.decode_errors,
+        "dropped": ingester.dispatcher.dropped,
+        "duplicates": sequences["duplicates"],
+        "gaps": sequences["gaps"],
+        "resets": sequences["resets"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--rate", type=float, default=5, help="state changes per room per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--binary", action="store_true", help="publish USE_BINARY_FRAMES frames")
+    parser.add_argument("--writer", choices=["spool", "batch"], default="spool")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--firestore-latency", type=float, default=0.02,
+                        help="seconds per fake Firestore round-trip")
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    parser.add_argument("--no-dedup", action="store_true", help="store unchanged telemetry states too")
+    parser.add_argument("--reboot", action="store_true", help="restart every room halfway through")
+    parser.add_argument("--record", help="write the committed documents of the last run as a trace")
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    for n in args.rooms:
+        result = run(n, args.rate, args.duration, args.binary, args.writer, args.workers,
+                     args.firestore_latency, args.drain_timeout, args.record, not args.no_dedup,
+                     args.reboot)
+        print(json.dumps(result))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,60 @@
+"""Login burst against the local auth stub: p50/p99 latency of auth.login_admin after warm-up.
+
+    python benchmarks/bench_login.py --logins 2000 --concurrency 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dashboard"))
+
+from auth_stub import AuthStub, parse_user  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(logins, concurrency):
+    stub = AuthStub(dict([parse_user("admin@example.com:secret:admin")]), "gcp-project-id").start()
+    os.environ.update(
+        IDENTITY_TOOLKIT_URL=f"{stub.url}/v1",
+        AUTH_CERTS_URL=f"{stub.url}/certs",
+        AUTH_ISSUER=stub.url,
+        FIREBASE_PROJECT_ID="gcp-project-id",
+    )
+    import auth  # reads the URLs above at import time
+
+    def one_login(_):
+        started = time.perf_counter()
+        auth.login_admin("admin@example.com", "secret", "local-key")
+        return time.perf_counter() - started
+
+    one_login(0)  # warm-up: connection pool and signing keys
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(one_login, range(logins)))
+    elapsed = time.perf_counter() - started
+    stub.stop()
+
+    return {
+        "benchmark": "login",
+        "logins": logins,
+        "concurrency": concurrency,
+        "logins_per_second": logins / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "stub_requests": stub.requests,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(run(args.logins, args.concurrency)))
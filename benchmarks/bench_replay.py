@@ -0,0 +1,195 @@
+"""Replay a recorded trace into analytics.py and the dashboard's data-loading path.
+
+    python benchmarks/bench_ingest.py --rooms 50 --record trace.jsonl
+    python benchmarks/bench_replay.py --trace trace.jsonl --sizes 1000 100000 1000000
+
+The trace is stretched to each size by laying its rooms one after another as
+a single room's history. Per size it times the legacy analytics.py loops
+(up to --max-legacy-rows), analytics_engine on the columns, and the
+dashboard path against a fake Firestore: the cold CollectionCache load, an
+incremental refresh with 1% new rows and a cold and warm DataService
+snapshot. Without --trace a trace is generated by virtual rooms and decoded
+by the ingester's router. Sizes above --max-path-rows skip the Firestore path.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "pythonSubscriber"))
+sys.path.insert(0, os.path.join(HERE, "..", "dashboard"))
+
+# The dashboard modules read these at import time
+os.environ["FAKE_FIRESTORE"] = "1"
+os.environ["CACHE_RETENTION_DAYS"] = "0"        # replayed history is older than the window
+os.environ["CACHE_MIN_REFRESH_SECONDS"] = "0"
+
+from loadgen import VirtualRoom, read_trace  # noqa: E402
+from fake_firestore import FakeClient  # noqa: E402
+from pipeline_stats import iso_to_epoch  # noqa: E402
+from router import decode, document_id  # noqa: E402
+
+import analytics  # noqa: E402
+import firestore_client  # noqa: E402
+from analytics_engine import compute_all  # noqa: E402
+from data_service import DataService  # noqa: E402
+
+REPLAY_DEVICE = "room_replay"
+REPLAY_START = datetime(2026, 1, 1)
+EPOCH = datetime(1970, 1, 1)
+STATE_FIELDS = ["occupied", "fan", "led", "fan_override", "led_override"]
+
+LEGACY_FUNCTIONS = [
+    "occupancy_frequency", "fan_usage_time", "led_usage_time", "occupancy_duration",
+    "peak_usage_time", "automation_efficiency", "system_response_time",
+]
+
+
+# ================= TRACES =================
+def synthetic_trace(rooms=20, changes=2000, seed=0):
+    """Virtual rooms decoded by the ingester's router, one state change every 1-900 s"""
+    docs = []
+    for number in range(1, rooms + 1):
+        room = VirtualRoom(number, seed=seed + number)
+        now_ms = int((REPLAY_START - EPOCH).total_seconds() * 1000)
+        for _ in range(changes):
+            now_ms += room.rng.randint(1000, 900000)
+            ingest = (EPOCH + timedelta(milliseconds=now_ms + 40)).isoformat()
+            for topic, payload in room.step(now_ms):
+                _, segment, kind = topic.split("/")
+                docs.extend((r.collection, r.to_dict()) for r in decode(segment, kind, payload, ingest))
+    return docs
+
+
+def split_by_device(docs):
+    """device -> (telemetry, events), each ordered by event time, with times relative to its start"""
+    streams = defaultdict(lambda: ([], []))
+    for collection, data in docs:
+        if collection in ("room_telemetry", "room_events") and data.get("device_id"):
+            streams[data["device_id"]][collection == "room_events"].append(data)
+    segments = []
+    for telemetry, events in streams.values():
+        if not telemetry:
+            continue
+        when = lambda d: iso_to_epoch(d.get("device_timestamp") or d["timestamp"])  # noqa: E731
+        telemetry.sort(key=when)
+        events.sort(key=when)
+        base = when(telemetry[0])
+        segments.append(([(when(d) - base, d) for d in telemetry],
+                         [(when(d) - base, d) for d in events]))
+    return segments
+
+
+def stretch(segments, n):
+    """Columns of n telemetry rows (and the events alongside them) for REPLAY_DEVICE"""
+    if not segments:
+        raise ValueError("The trace has no telemetry")
+    telemetry = defaultdict(list)
+    events = defaultdict(list)
+    offset = 0.0
+    while len(telemetry["timestamp"]) < n:
+        for rows, event_rows in segments:
+            take = rows[:n - len(telemetry["timestamp"])]
+            for t, data in take:
+                telemetry["timestamp"].append((REPLAY_START + timedelta(seconds=offset + t)).isoformat())
+                for field in STATE_FIELDS:
+                    telemetry[field].append(data.get(field, 0))
+            last = take[-1][0]
+            for t, data in event_rows:
+                if t <= last:
+                    events["timestamp"].append((REPLAY_START + timedelta(seconds=offset + t)).isoformat())
+                    events["event"].append(data["event"])
+            offset += last + 1
+            if len(telemetry["timestamp"]) >= n:
+                break
+    return dict(telemetry), dict(events)
+
+
+def to_records(columns):
+    keys = list(columns)
+    return [dict(zip(keys, row), device_id=REPLAY_DEVICE) for row in zip(*columns.values())]
+
+
+def load(db, collection, records):
+    batch = db.batch()
+    for i, data in enumerate(records, 1):
+        batch.set(db.collection(collection).document(document_id(collection, data)), data)
+        if i % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+
+
+# ================= RUN =================
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def run_size(segments, n, max_legacy_rows, max_path_rows, firestore_latency):
+    telemetry, events = stretch(segments, n)
+    result = {"rows": n, "events": len(events.get("timestamp", []))}
+
+    engine_kpis, result["engine_seconds"] = timed(compute_all, telemetry)
+    if n <= max_legacy_rows:
+        records = to_records(telemetry)
+        started = time.perf_counter()
+        legacy = {name: getattr(analytics, name)(records) for name in LEGACY_FUNCTIONS}
+        result["legacy_seconds"] = time.perf_counter() - started
+        result["identical"] = legacy == engine_kpis
+
+    if n <= max_path_rows:
+        records = to_records(telemetry)
+        event_records = to_records(events) if events else []
+        extra = max(1, n // 100)
+        db = FakeClient()
+        load(db, "room_telemetry", records[:-extra])
+        load(db, "room_events", event_records)
+
+        db.latency = firestore_latency
+        firestore_client._db = db
+        firestore_client._caches.clear()
+        _, result["cache_load_seconds"] = timed(firestore_client.get_telemetry, REPLAY_DEVICE)
+        db.latency = 0
+        load(db, "room_telemetry", records[-extra:])
+        db.latency = firestore_latency
+        _, result["cache_refresh_seconds"] = timed(firestore_client.get_telemetry, REPLAY_DEVICE)
+        result["docs_read"] = firestore_client.get_cache("room_telemetry", REPLAY_DEVICE).docs_read
+
+        service = DataService()
+        _, result["snapshot_cold_seconds"] = timed(service.snapshot, REPLAY_DEVICE)
+        _, result["snapshot_warm_seconds"] = timed(service.snapshot, REPLAY_DEVICE)
+        result["firestore_round_trips"] = db.round_trips
+    return result
+
+
+def run(trace, sizes, max_legacy_rows, max_path_rows, firestore_latency):
+    docs = list(read_trace(trace)) if trace else synthetic_trace()
+    segments = split_by_device(docs)
+    for n in sizes:
+        yield dict(benchmark="replay", trace=trace or "synthetic",
+                   **run_size(segments, n, max_legacy_rows, max_path_rows, firestore_latency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trace", help="JSON lines trace (bench_ingest.py --record or a spill file)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--max-legacy-rows", type=int, default=1000000)
+    parser.add_argument("--max-path-rows", type=int, default=1000000)
+    parser.add_argument("--firestore-latency", type=float, default=0.0,
+                        help="seconds per fake Firestore round-trip")
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    for result in run(args.trace, args.sizes, args.max_legacy_rows, args.max_path_rows,
+                      args.firestore_latency):
+        print(json.dumps(result))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,228 @@
+"""Scale-out of the async ingester over an MQTT v5 shared subscription.
+
+    python benchmarks/bench_scaleout.py --replicas 1 2 4 --kill
+
+Per replica count it starts mqtt_broker.py and N async_ingester.py replicas
+in one $share group, publishes the virtual rooms' messages with QoS 1 and
+waits until every reading is committed. Each replica commits to a fake
+Firestore taking --firestore-latency per round-trip with --max-inflight
+batches, which gives one replica a fixed ceiling, so the speed-up shows how
+evenly the group splits the load. --kill crashes one replica halfway, right
+after a commit and before its acks go out: those messages are redelivered
+to the others and, with deterministic document ids, must not add documents. Replicas append every committed write
+to a log that survives the kill; the runner unions them and counts readings
+stored under more than one id (duplicates) and readings never stored.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "pythonSubscriber"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")   # keep stdout for the JSON results
+
+import paho.mqtt.client as mqtt  # noqa: E402
+from paho.mqtt.enums import CallbackAPIVersion  # noqa: E402
+
+from loadgen import VirtualRoom  # noqa: E402
+from router import decode, subscription  # noqa: E402
+
+SHARE_GROUP = "ingest"
+
+
+# ================= REPLICA =================
+def run_replica(index, port, log_path, firestore_latency, max_inflight, batch_size):
+    from async_ingester import AsyncIngester
+    from batch_writer import COMMITTED
+    from fake_firestore import FakeAsyncClient, FakeAsyncWriteBatch
+
+    class RecordingBatch(FakeAsyncWriteBatch):
+        async def commit(self):
+            writes = [(op.__self__.name, args[0], {k: v for k, v in args[1].items() if k != COMMITTED})
+                      for op, args in self._ops]
+            await super().commit()
+            log.write("".join(json.dumps(w) + "\n" for w in writes))
+            log.flush()
+            if os.path.exists(log_path + ".kill"):
+                os.kill(os.getpid(), signal.SIGKILL)    # committed, never acked
+
+    class RecordingClient(FakeAsyncClient):
+        def batch(self):
+            return RecordingBatch(self)
+
+    log = open(log_path, "a")
+    ingester = AsyncIngester(RecordingClient(latency=firestore_latency), "127.0.0.1", port,
+                             client_id=f"replica-{index}", topic=subscription(SHARE_GROUP),
+                             max_inflight=max_inflight, batch_size=batch_size)
+    asyncio.run(ingester.run())
+
+
+# ================= RUNNER =================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_messages(rooms, changes):
+    """All rooms' messages in device-time order, and the readings they decode to"""
+    messages = []
+    for number in range(1, rooms + 1):
+        room = VirtualRoom(number)
+        now_ms = 1767225600000
+        for _ in range(changes):
+            now_ms += room.rng.randint(1000, 60000)
+            messages.extend((now_ms, topic, payload) for topic, payload in room.step(now_ms))
+    messages.sort(key=lambda m: m[0])
+
+    readings = set()
+    for _, topic, payload in messages:
+        _, segment, kind = topic.split("/")
+        readings.update(reading_key(r.collection, r.to_dict()) for r in decode(segment, kind, payload, ""))
+    return [(topic, payload) for _, topic, payload in messages], readings
+
+
+def reading_key(collection, data):
+    return collection, data["device_id"], data["seq"], data["device_timestamp"]
+
+
+class CommitLogs:
+    """Follows the replicas' commit logs"""
+
+    def __init__(self, paths):
+        self.offsets = dict.fromkeys(paths, 0)
+        self.writes = 0
+        self.ids = {}           # (collection, doc id) -> reading key
+
+    def poll(self):
+        for path in self.offsets:
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                f.seek(self.offsets[path])
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    self.offsets[path] += len(line)
+                    collection, doc_id, data = json.loads(line)
+                    self.writes += 1
+                    self.ids[(collection, doc_id)] = reading_key(collection, data)
+        return len(self.ids)
+
+
+def publish(port, messages):
+    client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id="bench-publisher")
+    client.max_inflight_messages_set(1000)
+    client.max_queued_messages_set(0)
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    infos = [client.publish(topic, payload, qos=1) for topic, payload in messages]
+    for info in infos:
+        info.wait_for_publish()
+    client.loop_stop()
+    client.disconnect()
+
+
+def run(replicas, messages, readings, firestore_latency, max_inflight, batch_size,
+        kill=False, warmup=2.0, timeout=120):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="bench-scaleout-")
+    broker = subprocess.Popen([sys.executable, os.path.join(HERE, "mqtt_broker.py"), "--port", str(port)],
+                              stdout=subprocess.PIPE, text=True)
+    broker.stdout.readline()    # listening
+
+    logs = [os.path.join(workdir, f"replica-{i}.jsonl") for i in range(replicas)]
+    procs = [subprocess.Popen([sys.executable, __file__, "--replica", str(i), "--port", str(port),
+                               "--log", logs[i], "--firestore-latency", str(firestore_latency),
+                               "--max-inflight", str(max_inflight), "--batch-size", str(batch_size)])
+             for i in range(replicas)]
+    time.sleep(warmup)          # every replica connected and subscribed
+
+    commits = CommitLogs(logs)
+    killed = None
+    started = time.monotonic()
+    publish(port, messages)
+    publish_seconds = time.monotonic() - started
+    deadline = started + timeout
+    while commits.poll() < len(readings) and time.monotonic() < deadline:
+        if kill and killed is None and replicas > 1 and len(commits.ids) >= len(readings) // 2:
+            killed = procs[0]
+            open(logs[0] + ".kill", "w").close()
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    for proc in procs:
+        if proc is not killed:
+            proc.send_signal(signal.SIGTERM)
+    for proc in procs:
+        proc.wait(30)
+    broker.terminate()
+    broker.wait()
+    commits.poll()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    stored = {}
+    for key in commits.ids.values():
+        stored[key] = stored.get(key, 0) + 1
+    return {
+        "benchmark": "scaleout",
+        "replicas": replicas,
+        "messages": len(messages),
+        "firestore_latency_ms": firestore_latency * 1000,
+        "max_inflight": max_inflight,
+        "batch_size": batch_size,
+        "killed_replica": killed is not None,
+        "publish_seconds": publish_seconds,
+        "elapsed_seconds": elapsed,
+        "msgs_per_second": len(messages) / elapsed,
+        "writes": commits.writes,
+        "documents": len(commits.ids),
+        "duplicate_documents": sum(n - 1 for n in stored.values()),
+        "missing_readings": len(readings - set(stored)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--changes", type=int, default=200, help="state changes per room")
+    parser.add_argument("--firestore-latency", type=float, default=0.1,
+                        help="seconds per fake Firestore round-trip")
+    parser.add_argument("--max-inflight", type=int, default=1, help="concurrent commits per replica")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--kill", action="store_true",
+                        help="crash one replica between a commit and its acks halfway through")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    # Internal: run one replica
+    parser.add_argument("--replica", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--log", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.replica is not None:
+        run_replica(args.replica, args.port, args.log, args.firestore_latency,
+                    args.max_inflight, args.batch_size)
+        sys.exit(0)
+
+    messages, readings = build_messages(args.rooms, args.changes)
+    baseline = None
+    for n in args.replicas:
+        result = run(n, messages, readings, args.firestore_latency, args.max_inflight,
+                     args.batch_size, args.kill, args.warmup, args.timeout)
+        baseline = baseline or result["msgs_per_second"] / n
+        result["scaling_efficiency"] = result["msgs_per_second"] / baseline / n
+        print(json.dumps(result))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,169 @@
+"""Time from a fresh dashboard process to its first painted overview.
+
+    python benchmarks/bench_startup.py --rows 20000 --latency 0.05
+
+Each run is a new interpreter doing what app.py does before it paints:
+import the modules, create the data service and look up the saved KPI
+snapshot (kpi_store, here a local KPI_SNAPSHOT_DIR). "cold" has no saved
+snapshot, so the overview waits for the first read of the room (a fake
+Firestore with --latency seconds per round trip) and saves one; "warm" is
+the next new instance, which paints from that snapshot. "eager" is "cold"
+with the module-level imports app.py used to have (pandas, altair, the
+Firestore library, requests). "cold_firestore" and "warm_firestore" repeat
+cold and warm with the snapshots kept in the (fake) Firestore collection,
+the production default: the fake rejects what Firestore rejects, and when
+google-cloud-firestore is installed the saved document is also run through
+its encoder ("firestore_encodes"). Streamlit itself is imported before the
+clock starts, as the server has loaded it by then.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEVICE = "room_01"
+HEAVY_MODULES = ["pandas", "altair", "google.cloud.firestore", "requests"]
+
+
+def firestore_encodes(doc):
+    """True if the real client would encode doc; None without google-cloud-firestore"""
+    try:
+        from google.cloud.firestore_v1._helpers import encode_dict
+    except ImportError:
+        return None
+    try:
+        encode_dict(doc)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def child(rows, latency, now, eager=False, snapshot_file=None):
+    sys.path.insert(0, os.path.join(HERE, "..", "pythonSubscriber"))
+    sys.path.insert(0, os.path.join(HERE, "..", "dashboard"))
+    import streamlit  # noqa: F401
+    from fake_firestore import FakeClient
+
+    db = FakeClient()
+    # Every phase writes the same rows, so a saved snapshot matches the next instance's read
+    now = datetime.fromisoformat(now)
+    batch = db.batch()
+    for i in range(rows):
+        ts = (now - timedelta(days=29) + timedelta(seconds=i * 29 * 86400 // rows)).isoformat()
+        batch.set(db.collection("room_telemetry").document(f"t{i}"),
+                  {"device_id": DEVICE, "timestamp": ts, "occupied": i % 2, "fan": i % 2,
+                   "led": (i // 2) % 2, "fan_override": 0, "led_override": 0})
+        if i % 500 == 499:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    if snapshot_file and os.path.exists(snapshot_file):
+        # The previous instance's snapshots, as if read from the shared Firestore
+        with open(snapshot_file) as f:
+            for doc_id, data in json.load(f).items():
+                db.collection("dashboard_snapshots").document(doc_id).set(data)
+    db.latency = latency
+
+    started = time.perf_counter()
+    if eager:
+        import importlib
+        for name in HEAVY_MODULES:
+            importlib.import_module(name)
+    # app.py's imports up to the first paint
+    import firestore_client
+    firestore_client._db = db
+    import analytics  # noqa: F401
+    import kpi_store
+    import live  # noqa: F401
+    import timeutils  # noqa: F401
+    from data_service import get_data_service
+    imported = time.perf_counter() - started
+
+    today = datetime.now(timezone.utc).date()
+    start = datetime.combine(today - timedelta(days=30), datetime.min.time(), tzinfo=timezone.utc)
+    end = datetime.combine(today + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    service = get_data_service()
+    saved = None
+    if not eager and service.cached(DEVICE, start, end) is None:
+        saved = kpi_store.load(DEVICE, start, end)
+    preview = time.perf_counter() - started if saved else None
+    heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    snapshot = service.snapshot(DEVICE, start, end)
+    live_ready = time.perf_counter() - started
+    stored = saved
+    if saved is None and not eager:
+        # Let the background save land before the process exits
+        deadline = time.monotonic() + 10
+        while stored is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+            stored = kpi_store.load(DEVICE, start, end)
+    if snapshot_file:
+        docs = {d.id: d.to_dict() for d in db.collection("dashboard_snapshots").stream()}
+        with open(snapshot_file, "w") as f:
+            json.dump(docs, f)
+
+    return {
+        "imports_seconds": imported,
+        "first_paint_seconds": preview if preview is not None else live_ready,
+        "painted_from": "snapshot" if saved else "firestore",
+        "live_data_seconds": live_ready,
+        "heavy_modules_at_first_paint": heavy,
+        "rows": len(snapshot.telemetry),
+        "kpis_match": saved is None or (saved["kpis"]["occupancy_frequency"] == snapshot.kpis["occupancy_frequency"]
+                                        and saved["kpis"]["peak_usage_time"] == snapshot.kpis["peak_usage_time"]),
+        "snapshot_saved": stored is not None if not eager else None,
+        # What kpi_store.save writes for this snapshot
+        "firestore_encodes": firestore_encodes(
+            {"kpis": kpi_store.encode_kpis(snapshot.kpis), "latest": snapshot.telemetry[-1]}),
+    }
+
+
+def run(rows, latency):
+    directory = tempfile.mkdtemp(prefix="bench-startup-")
+    result = {"benchmark": "startup", "rows": rows, "latency": latency}
+    now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    try:
+        for phase in ("eager", "cold", "warm", "cold_firestore", "warm_firestore"):
+            # cold and warm share the snapshot directory; eager gets its own
+            snapshots = os.path.join(directory, "eager" if phase == "eager" else "shared")
+            env = dict(os.environ, KPI_SNAPSHOT_DIR=snapshots, FAKE_FIRESTORE="1", LOG_LEVEL="WARNING")
+            extra = ["--eager"] if phase == "eager" else []
+            if phase.endswith("_firestore"):
+                env["KPI_SNAPSHOT_DIR"] = ""
+                extra = ["--snapshot-file", os.path.join(directory, "firestore.json")]
+            out = subprocess.run([sys.executable, __file__, "--child", "--rows", str(rows),
+                                  "--latency", str(latency), "--now", now, *extra],
+                                 env=env, capture_output=True, text=True, check=True).stdout
+            result[phase] = json.loads(out.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Firestore round trip")
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--eager", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--snapshot-file", help=argparse.SUPPRESS)
+    parser.add_argument("--now", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.rows, args.latency, args.now, args.eager, args.snapshot_file)))
+        sys.exit(0)
+
+    result = run(args.rows, args.latency)
+    print(json.dumps(result))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
@@ -0,0 +1,88 @@
+"""Downsample a year of telemetry into the dashboard's state timeline.
+
+    python benchmarks/bench_timeline.py --days 365 --width 1000
+
+"raw_points" / "raw_json_mb" is what charting the rows directly would send
+to the browser, "points" / "json_mb" what the dashboard sends after
+timeline.build_timeline (drawn rows of the state chart plus points of the
+occupancy-rate line), and "build_seconds" the server-side downsampling
+from record dicts.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dashboard"))
+
+from timeline import build_timeline, TIMELINE_SERIES  # noqa: E402
+from timeutils import to_epoch_ns  # noqa: E402
+
+START = datetime(2025, 1, 1)
+
+
+def synthetic_records(days, seed=0):
+    """One row per state change, every 1-600 s, with occupancy in longer spells"""
+    rng = np.random.default_rng(seed)
+    n = int(days * 86400 / 300)
+    gaps = rng.integers(1, 600, size=n).cumsum()
+    occupied = (rng.random(n) < 0.02).cumsum() % 2
+    records = []
+    for g, occ, fan, led in zip(gaps.tolist(), occupied.tolist(),
+                                rng.integers(0, 2, size=n).tolist(), rng.integers(0, 2, size=n).tolist()):
+        records.append({
+            "device_id": "room_01",
+            "timestamp": (START + timedelta(seconds=g)).isoformat(),
+            "occupied": occ, "fan": fan & occ, "led": led & occ,
+            "fan_override": 0, "led_override": 0,
+        })
+    return records
+
+
+def json_mb(frame):
+    return len(frame.to_json(orient="records", date_format="iso")) / 2**20
+
+
+def run(days, width):
+    records = synthetic_records(days)
+    start_ns, end_ns = to_epoch_ns([START.isoformat(), (START + timedelta(days=days)).isoformat()])
+
+    started = time.perf_counter()
+    timeline = build_timeline(records, int(start_ns), int(end_ns), width)
+    build = time.perf_counter() - started
+
+    raw = json.dumps([{k: r[k] for k in ("timestamp", *TIMELINE_SERIES)} for r in records])
+    states = timeline["states"]
+    states = states[states["max"] > 0]      # off intervals are not drawn
+    per_series = states.groupby("series").size()
+    return {
+        "benchmark": "timeline",
+        "days": days,
+        "width": width,
+        "rows": len(records),
+        "raw_points": len(records) * len(TIMELINE_SERIES),
+        "raw_json_mb": len(raw) / 2**20,
+        "build_seconds": build,
+        "points": len(states) + len(timeline["occupancy"]),
+        "max_rows_per_series": int(per_series.max()),
+        "json_mb": json_mb(states) + json_mb(timeline["occupancy"]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 30, 365])
+    parser.add_argument("--width", type=int, default=1000)
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    for days in args.days:
+        result = run(days, args.width)
+        print(json.dumps(result))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,181 @@
+"""Virtual ESP32 rooms, an in-process broker stand-in and trace files for the benchmarks.
+
+A VirtualRoom follows the firmware's loop() (PIR motion, buttons, override
+and idle timeouts) and publishes exactly what publishStatus() sends: the
+status JSON and the event JSON, or one binary frame with USE_BINARY_FRAMES.
+"""
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pythonSubscriber"))
+
+from router import FRAME, FRAME_MAGIC, FRAME_VERSION, STATE_BITS, TIME_SYNCED_BIT  # noqa: E402
+
+OVERRIDE_DURATION_MS = 15000    # firmware overrideDuration
+EVENT_CODES = {"AUTO_ON": 1, "AUTO_OFF": 2, "MANUAL_FAN": 3, "MANUAL_LED": 4}
+
+STATUS_FORMAT = ('{{"occupied":{occupied},"fan":{fan},"led":{led},"fan_override":{fan_override},'
+                 '"led_override":{led_override},"seq":{seq},"ts":{ts},"synced":1}}')
+EVENT_FORMAT = '{{"event":"{event}","seq":{seq},"ts":{ts},"synced":1}}'
+
+
+# ================= VIRTUAL ROOMS =================
+class VirtualRoom:
+    """One simulated ESP32; step() returns the (topic, payload) messages of one state change"""
+
+    def __init__(self, number, binary=False, seed=None):
+        self.number = number
+        self.topic = f"building/room{number:02d}"
+        self.binary = binary
+        self.rng = random.Random(seed if seed is not None else number)
+        self.seq = 0
+        self.occupied = self.fan = self.led = 0
+        self.fan_override = self.led_override = 0
+        self.fan_override_at = self.led_override_at = 0
+
+    def step(self, now_ms):
+        self._expire_overrides(now_ms)
+        roll = self.rng.random()
+        if roll < 0.1:
+            self.fan = 1 - self.fan
+            self.fan_override, self.fan_override_at = 1, now_ms
+            event = "MANUAL_FAN"
+        elif roll < 0.2:
+            self.led = 1 - self.led
+            self.led_override, self.led_override_at = 1, now_ms
+            event = "MANUAL_LED"
+        elif not self.occupied or roll < 0.6:
+            self.occupied = 1
+            if not self.fan_override:
+                self.fan = 1
+            if not self.led_override:
+                self.led = 1
+            event = "AUTO_ON"
+        elif not (self.fan_override or self.led_override):
+            self.occupied = self.fan = self.led = 0
+            event = "AUTO_OFF"
+        else:
+            # Idle timeout is blocked while an override is active
+            self.occupied = 1
+            event = "AUTO_ON"
+        return self.publish(event, now_ms)
+
+    def reboot(self):
+        """Restart like the firmware: publishSeq starts again at 1, the state is lost"""
+        self.seq = 0
+        self.occupied = self.fan = self.led = 0
+        self.fan_override = self.led_override = 0
+
+    def publish(self, event, now_ms):
+        self.seq += 1
+        if self.binary:
+            state = TIME_SYNCED_BIT
+            for field, bit in STATE_BITS.items():
+                if getattr(self, field):
+                    state |= bit
+            frame = FRAME.pack(FRAME_MAGIC, FRAME_VERSION, self.number, self.seq, now_ms,
+                               state, EVENT_CODES[event])
+            return [(f"{self.topic}/frame", frame)]
+        status = STATUS_FORMAT.format(
+            occupied=self.occupied, fan=self.fan, led=self.led,
+            fan_override=self.fan_override, led_override=self.led_override,
+            seq=self.seq, ts=now_ms
+        )
+        return [
+            (f"{self.topic}/status", status.encode()),
+            (f"{self.topic}/event", EVENT_FORMAT.format(event=event, seq=self.seq, ts=now_ms).encode()),
+        ]
+
+    def _expire_overrides(self, now_ms):
+        if self.fan_override and now_ms - self.fan_override_at > OVERRIDE_DURATION_MS:
+            self.fan_override = 0
+        if self.led_override and now_ms - self.led_override_at > OVERRIDE_DURATION_MS:
+            self.led_override = 0
+
+
+# ================= BROKER STAND-IN =================
+Message = namedtuple("Message", ["topic", "payload"])
+
+
+class FakeBroker:
+    """Delivers published messages to subscribers on one thread, like paho's network loop"""
+
+    def __init__(self, queue_size=100000):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._subscribers = []
+        self._thread = None
+        self.delivered = 0
+
+    def subscribe(self, topic_filter, callback):
+        """callback(client, userdata, msg), the paho on_message signature"""
+        self._subscribers.append((topic_filter, callback))
+
+    def publish(self, topic, payload):
+        self._queue.put(Message(topic, payload))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fake-broker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            for topic_filter, callback in self._subscribers:
+                if mqtt.topic_matches_sub(topic_filter, msg.topic):
+                    callback(None, None, msg)
+            self.delivered += 1
+
+
+def publish_load(broker, rooms, rate_per_room, duration, stop=None):
+    """Open-loop publisher: each room changes state rate_per_room times a second.
+
+    Returns the number of messages published; stays on schedule unless the
+    broker queue is full, which then shows up as a lower achieved rate.
+    """
+    interval = 1.0 / (rate_per_room * len(rooms))
+    started = time.monotonic()
+    published = 0
+    i = 0
+    while time.monotonic() - started < duration and not (stop and stop.is_set()):
+        due = started + i * interval
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        room = rooms[i % len(rooms)]
+        for topic, payload in room.step(int(time.time() * 1000)):
+            broker.publish(topic, payload)
+            published += 1
+        i += 1
+    return published
+
+
+# ================= TRACES =================
+# One {"collection", "data"} object per line, the same format as the
+# ingester's spill file, so spill files can be replayed as traces too.
+def write_trace(path, docs):
+    with open(path, "w") as f:
+        for collection, data in docs:
+            f.write(json.dumps({"collection": collection, "data": data}) + "\n")
+
+
+def read_trace(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                yield item["collection"], item["data"]
@@ -0,0 +1,351 @@
+"""Minimal MQTT 3.1.1/5 broker for local multi-process runs; not for production.
+
+    python benchmarks/mqtt_broker.py --port 1883
+
+Supports what the ingesters need: QoS 0/1, persistent sessions with
+redelivery of unacked messages, the Receive Maximum of v5 clients and
+shared subscriptions ($share/<group>/<filter>). A shared message goes to
+the least-loaded connected member of its group; when a member drops, its
+unacked and queued shared messages move to the others, which is the
+rebalancing that idempotent writes have to absorb. No TLS, auth, retained
+messages, wills or QoS 2.
+"""
+import argparse
+import asyncio
+import itertools
+import struct
+from collections import deque
+
+from paho.mqtt.client import topic_matches_sub
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+DEFAULT_RECEIVE_MAXIMUM = 65535
+
+# MQTT v5 property id -> wire type (spec table 2-4)
+PROPERTY_TYPES = {
+    0x01: "byte", 0x02: "int4", 0x03: "str", 0x08: "str", 0x09: "bin", 0x0B: "varint",
+    0x11: "int4", 0x12: "str", 0x13: "int2", 0x15: "str", 0x16: "bin", 0x17: "byte",
+    0x18: "int4", 0x19: "byte", 0x1A: "str", 0x1C: "str", 0x1F: "str", 0x21: "int2",
+    0x22: "int2", 0x23: "int2", 0x24: "byte", 0x25: "byte", 0x26: "pair", 0x27: "int4",
+    0x28: "byte", 0x29: "byte", 0x2A: "byte",
+}
+RECEIVE_MAXIMUM_PROPERTY = 0x21
+
+
+# ================= WIRE FORMAT =================
+def encode_varint(n):
+    out = bytearray()
+    while True:
+        n, digit = divmod(n, 128)
+        out.append(digit | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def decode_varint(buf, pos):
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_str(s):
+    data = s.encode() if isinstance(s, str) else s
+    return struct.pack("!H", len(data)) + data
+
+
+def decode_str(buf, pos):
+    (n,) = struct.unpack_from("!H", buf, pos)
+    return buf[pos + 2:pos + 2 + n], pos + 2 + n
+
+
+def decode_properties(buf, pos):
+    length, pos = decode_varint(buf, pos)
+    end = pos + length
+    props = {}
+    while pos < end:
+        prop = buf[pos]
+        pos += 1
+        kind = PROPERTY_TYPES[prop]
+        if kind == "byte":
+            value, pos = buf[pos], pos + 1
+        elif kind == "int2":
+            (value,), pos = struct.unpack_from("!H", buf, pos), pos + 2
+        elif kind == "int4":
+            (value,), pos = struct.unpack_from("!I", buf, pos), pos + 4
+        elif kind == "varint":
+            value, pos = decode_varint(buf, pos)
+        elif kind == "pair":
+            key, pos = decode_str(buf, pos)
+            value, pos = decode_str(buf, pos)
+            value = (key, value)
+        else:
+            value, pos = decode_str(buf, pos)
+        props[prop] = value
+    return props, end
+
+
+def packet(kind, body, flags=0):
+    return bytes([kind << 4 | flags]) + encode_varint(len(body)) + body
+
+
+# ================= BROKER =================
+class Message:
+    __slots__ = ("topic", "payload", "qos", "group")
+
+    def __init__(self, topic, payload, qos, group=None):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.group = group      # (share group, filter) for shared deliveries
+
+
+class Session:
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.subscriptions = {}    # filter -> max qos
+        self.shared = set()        # (group, filter)
+        self.inflight = {}         # packet id -> Message
+        self.queue = deque()
+        self.writer = None
+        self.version = 4
+        self.receive_maximum = DEFAULT_RECEIVE_MAXIMUM
+        self.persistent = False
+        self._ids = itertools.cycle(range(1, 65536))
+
+    @property
+    def load(self):
+        return len(self.inflight) + len(self.queue)
+
+    def next_id(self):
+        while True:
+            pid = next(self._ids)
+            if pid not in self.inflight:
+                return pid
+
+
+class Broker:
+    def __init__(self):
+        self.sessions = {}
+        self.groups = {}          # (group, filter) -> {client_id: max qos}
+        self.backlog = {}         # (group, filter) -> messages with no member connected
+        self.received = 0
+        self.delivered = 0
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle, host, port)
+
+    # ================= CONNECTION =================
+    async def handle(self, reader, writer):
+        session = None
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b""
+                kind, flags = header[0] >> 4, header[0] & 0x0F
+                if kind == CONNECT:
+                    session = self.on_connect(body, writer)
+                elif session is None:
+                    break
+                elif kind == PUBLISH:
+                    self.on_publish(session, flags, body)
+                elif kind == PUBACK:
+                    self.on_puback(session, body)
+                elif kind == SUBSCRIBE:
+                    self.on_subscribe(session, body)
+                elif kind == UNSUBSCRIBE:
+                    (pid,) = struct.unpack_from("!H", body)
+                    writer.write(packet(UNSUBACK, struct.pack("!H", pid)))
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP, b""))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if session is not None and session.writer is writer:
+                self.on_disconnect(session)
+            writer.close()
+
+    def on_connect(self, body, writer):
+        _, pos = decode_str(body, 0)
+        version, flags = body[pos], body[pos + 1]
+        pos += 4                                   # level, flags, keepalive
+        receive_maximum = DEFAULT_RECEIVE_MAXIMUM
+        if version == 5:
+            props, pos = decode_properties(body, pos)
+            receive_maximum = props.get(RECEIVE_MAXIMUM_PROPERTY, DEFAULT_RECEIVE_MAXIMUM)
+        client_id, pos = decode_str(body, pos)
+        client_id = client_id.decode() or f"auto-{id(writer)}"
+        clean = bool(flags & 0x02)
+
+        session = self.sessions.get(client_id)
+        present = session is not None and not clean
+        if session is not None and session.writer is not None:
+            session.writer.close()                 # takeover by the same client id
+            self.on_disconnect(session)
+        if not present:
+            if session is not None:
+                self._drop(session)
+            session = self.sessions[client_id] = Session(client_id)
+        session.writer = writer
+        session.version = version
+        session.receive_maximum = receive_maximum
+        session.persistent = not clean
+
+        ack = bytes([1 if present else 0, 0])
+        writer.write(packet(CONNACK, ack + (b"\x00" if version == 5 else b"")))
+        # Unacked messages first (with DUP), then whatever queued while away
+        for pid, message in session.inflight.items():
+            self._send(session, pid, message, dup=True)
+        for key in session.shared:
+            self._drain_backlog(key)
+        self._pump(session)
+        return session
+
+    def on_disconnect(self, session):
+        session.writer = None
+        # Shared messages held by this member go to the rest of its group
+        moved = [m for m in list(session.inflight.values()) + list(session.queue) if m.group]
+        session.inflight = {pid: m for pid, m in session.inflight.items() if not m.group}
+        session.queue = deque(m for m in session.queue if not m.group)
+        for message in moved:
+            self._route_shared(message.group, message)
+        if not session.persistent:
+            self._drop(session)
+
+    def _drop(self, session):
+        for key in session.shared:
+            self.groups.get(key, {}).pop(session.client_id, None)
+        self.sessions.pop(session.client_id, None)
+
+    # ================= PACKETS =================
+    def on_subscribe(self, session, body):
+        (pid,) = struct.unpack_from("!H", body)
+        pos = 2
+        if session.version == 5:
+            _, pos = decode_properties(body, pos)
+        codes = bytearray()
+        while pos < len(body):
+            topic_filter, pos = decode_str(body, pos)
+            qos = min(body[pos] & 0x03, 1)
+            pos += 1
+            topic_filter = topic_filter.decode()
+            if topic_filter.startswith("$share/"):
+                _, group, shared_filter = topic_filter.split("/", 2)
+                key = (group, shared_filter)
+                self.groups.setdefault(key, {})[session.client_id] = qos
+                session.shared.add(key)
+                self._drain_backlog(key)
+            else:
+                session.subscriptions[topic_filter] = qos
+            codes.append(qos)
+        props = b"\x00" if session.version == 5 else b""
+        session.writer.write(packet(SUBACK, struct.pack("!H", pid) + props + bytes(codes)))
+
+    def on_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic, pos = decode_str(body, 0)
+        pid = None
+        if qos:
+            (pid,) = struct.unpack_from("!H", body, pos)
+            pos += 2
+        if session.version == 5:
+            _, pos = decode_properties(body, pos)
+        self.received += 1
+        self.route(topic.decode(), body[pos:], qos)
+        if qos:
+            ack = struct.pack("!H", pid)
+            session.writer.write(packet(PUBACK, ack))
+
+    def on_puback(self, session, body):
+        (pid,) = struct.unpack_from("!H", body)
+        if session.inflight.pop(pid, None) is not None:
+            self._pump(session)
+
+    # ================= ROUTING =================
+    def route(self, topic, payload, qos):
+        for session in list(self.sessions.values()):
+            granted = max((q for f, q in session.subscriptions.items() if topic_matches_sub(f, topic)),
+                          default=None)
+            if granted is not None:
+                self._enqueue(session, Message(topic, payload, min(qos, granted)))
+        for key, members in self.groups.items():
+            if members and topic_matches_sub(key[1], topic):
+                self._route_shared(key, Message(topic, payload, qos, key))
+
+    def _route_shared(self, key, message):
+        members = [self.sessions[c] for c in self.groups.get(key, {})
+                   if c in self.sessions and self.sessions[c].writer is not None]
+        if not members:
+            self.backlog.setdefault(key, deque()).append(message)
+            return
+        member = min(members, key=lambda s: s.load)
+        message.qos = min(message.qos, self.groups[key][member.client_id])
+        self._enqueue(member, message)
+
+    def _drain_backlog(self, key):
+        backlog = self.backlog.pop(key, None)
+        while backlog:
+            self._route_shared(key, backlog.popleft())
+
+    def _enqueue(self, session, message):
+        session.queue.append(message)
+        if session.writer is not None:
+            self._pump(session)
+
+    def _pump(self, session):
+        while session.queue and session.writer is not None:
+            message = session.queue[0]
+            if message.qos and len(session.inflight) >= session.receive_maximum:
+                return
+            session.queue.popleft()
+            pid = None
+            if message.qos:
+                pid = session.next_id()
+                session.inflight[pid] = message
+            self._send(session, pid, message)
+
+    def _send(self, session, pid, message, dup=False):
+        body = encode_str(message.topic)
+        if message.qos:
+            body += struct.pack("!H", pid)
+        if session.version == 5:
+            body += b"\x00"
+        flags = (0x08 if dup else 0) | message.qos << 1
+        session.writer.write(packet(PUBLISH, body + message.payload, flags))
+        self.delivered += 1
+
+
+async def main(host, port):
+    broker = Broker()
+    server = await broker.serve(host, port)
+    print(f"MQTT broker listening on {host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
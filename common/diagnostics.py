@@ -0,0 +1,162 @@
+"""Structured logging and profiling shared by the ingester and the dashboard.
+
+pythonSubscriber/observability.py and dashboard/monitoring.py import this
+module and add their own metrics; each puts this directory on sys.path.
+"""
+import atexit
+import cProfile
+import json
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+# ================= CONFIG =================
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")              # json | text
+LOG_SAMPLE_SECONDS = float(os.environ.get("LOG_SAMPLE_SECONDS", 10))
+
+# PROFILE=1 profiles every thread with cProfile; the merged stats are written
+# to the component's PROFILE_OUTPUT on exit and on SIGUSR1 (open with snakeviz
+# or pstats). py-spy needs no hook: py-spy top --pid <pid>.
+PROFILE = os.environ.get("PROFILE") == "1"
+
+
+# ================= LOGGING =================
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the record's fields merged in"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        return f"{super().format(record)} {fields}".rstrip()
+
+
+_configured = set()
+_configure_lock = threading.Lock()
+
+def configure_logging(name="", propagate=True):
+    """Write the records of logger `name` ("" = root) to stdout in LOG_FORMAT, once per name"""
+    with _configure_lock:
+        if name in _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger = logging.getLogger(name)
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = propagate
+        _configured.add(name)
+
+
+class StructuredLogger:
+    """Logger taking fields as keyword arguments.
+
+    With sample=<key>, at most one record per key is written every
+    LOG_SAMPLE_SECONDS; the next one carries how many were suppressed.
+    """
+
+    def __init__(self, logger, sample_seconds=LOG_SAMPLE_SECONDS):
+        self.logger = logger
+        self.sample_seconds = sample_seconds
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def log(self, level, msg, sample=None, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample is not None:
+            now = time.monotonic()
+            with self._lock:
+                last, suppressed = self._samples.get(sample, (None, 0))
+                if last is not None and now - last < self.sample_seconds:
+                    self._samples[sample] = (last, suppressed + 1)
+                    return
+                self._samples[sample] = (now, 0)
+            if suppressed:
+                fields["suppressed"] = suppressed
+        self.logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self.log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg, **fields):
+        self.log(logging.INFO, msg, **fields)
+
+    def warning(self, msg, **fields):
+        self.log(logging.WARNING, msg, **fields)
+
+    def error(self, msg, **fields):
+        self.log(logging.ERROR, msg, **fields)
+
+
+# ================= PROFILING =================
+_profiles = {}       # thread id -> cProfile.Profile
+_profile_output = None
+_profile_log = None
+
+def _profile_thread(*_):
+    # Runs once as the profile hook of each new thread, then hands over to cProfile
+    sys.setprofile(None)
+    profile = cProfile.Profile()
+    _profiles[threading.get_ident()] = profile
+    profile.enable()
+
+
+class _Snapshot:
+    """A running profile as a pstats.Stats source.
+
+    pstats calls create_stats(), which on a cProfile.Profile also disables
+    it, and a profile can only be re-enabled from its own thread.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def create_stats(self):
+        self.profile.snapshot_stats()
+        self.stats = self.profile.stats
+
+
+def dump_profile(*_):
+    """Merge the per-thread profiles into the profile output; profiling carries on"""
+    stats = None
+    for profile in list(_profiles.values()):
+        snapshot = _Snapshot(profile)
+        stats = pstats.Stats(snapshot) if stats is None else stats.add(snapshot)
+    if stats is not None:
+        stats.dump_stats(_profile_output)
+        _profile_log.info("Profile written", path=_profile_output, threads=len(_profiles))
+
+
+def enable_profiling(output, log):
+    """Profile this thread and every thread started after it into output, if PROFILE=1"""
+    global _profile_output, _profile_log
+    if not PROFILE:
+        return
+    _profile_output, _profile_log = output, log
+    threading.setprofile(_profile_thread)
+    _profile_thread()
+    atexit.register(dump_profile)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, dump_profile)
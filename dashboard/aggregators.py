@@ -0,0 +1,355 @@
+import copy
+import json
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+from firestore_client import overlap_start
+from timeutils import event_time, parse_epoch_us
+
+ONE_SECOND_US = 1_000_000
+ONE_HOUR_US = 3600 * ONE_SECOND_US
+
+# Resumable versions of the analytics.py functions. Each aggregator keeps the
+# running totals and open intervals of its batch function, so feeding records
+# in several update() calls gives exactly the same snapshot() as one batch call.
+
+
+class Aggregator:
+    name = None
+
+    def update(self, records):
+        for r in records:
+            self.add(r)
+        return self
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, state):
+        agg = cls.__new__(cls)
+        agg.__dict__.update(state)
+        return agg
+
+
+class OccupancyFrequency(Aggregator):
+    name = "occupancy_frequency"
+
+    def __init__(self):
+        self.count = 0
+        self.prev = 0
+
+    def add(self, r):
+        if self.prev == 0 and r.get("occupied", 0) == 1:
+            self.count += 1
+        self.prev = r.get("occupied", 0)
+
+    def snapshot(self):
+        return self.count
+
+
+class UsageTime(Aggregator):
+    """Total on-time of one device field (fan_usage_time / led_usage_time)"""
+
+    def __init__(self, field):
+        self.field = field
+        self.total = 0
+        self.last_on = None
+
+    def add(self, r):
+        if r.get(self.field, 0) == 1 and self.last_on is None:
+            self.last_on = event_time(r)
+        elif r.get(self.field, 0) == 0 and self.last_on:
+            self.total += (parse_epoch_us(event_time(r)) - parse_epoch_us(self.last_on)) // ONE_SECOND_US
+            self.last_on = None
+
+    def snapshot(self):
+        return self.total
+
+
+class FanUsageTime(UsageTime):
+    name = "fan_usage_time"
+
+    def __init__(self):
+        super().__init__("fan")
+
+
+class LedUsageTime(UsageTime):
+    name = "led_usage_time"
+
+    def __init__(self):
+        super().__init__("led")
+
+
+class OccupancyDuration(Aggregator):
+    name = "occupancy_duration"
+
+    def __init__(self):
+        self.durations = []
+        self.last_on = None
+
+    def add(self, r):
+        if r.get("occupied", 0) == 1 and self.last_on is None:
+            self.last_on = event_time(r)
+        elif r.get("occupied", 0) == 0 and self.last_on:
+            self.durations.append((parse_epoch_us(event_time(r)) - parse_epoch_us(self.last_on)) // ONE_SECOND_US)
+            self.last_on = None
+
+    def snapshot(self):
+        durations = list(self.durations)
+        if not durations:
+            return {"total_seconds": 0, "short_visits": 0, "long_stays": 0, "durations": []}
+        return {
+            "total_seconds": sum(durations),
+            "short_visits": len([d for d in durations if d < 300]),
+            "long_stays": len([d for d in durations if d > 1800]),
+            "durations": durations
+        }
+
+
+class ManualOverrideStats(Aggregator):
+    name = "manual_override_stats"
+    EVENTS = {"MANUAL_LED": "manual_led", "MANUAL_FAN": "manual_fan",
+              "AUTO_ON": "auto_on", "AUTO_OFF": "auto_off"}
+
+    def __init__(self):
+        self.counts = {key: 0 for key in self.EVENTS.values()}
+
+    def add(self, e):
+        key = self.EVENTS.get(e.get("event", ""))
+        if key:
+            self.counts[key] += 1
+
+    def snapshot(self):
+        c = self.counts
+        return {
+            "manual_led": c["manual_led"],
+            "manual_fan": c["manual_fan"],
+            "manual_total": c["manual_led"] + c["manual_fan"],
+            "auto_on": c["auto_on"],
+            "auto_off": c["auto_off"],
+            "total_auto": c["auto_on"] + c["auto_off"]
+        }
+
+
+class PeakUsageTime(Aggregator):
+    name = "peak_usage_time"
+
+    def __init__(self):
+        self.hours = Counter()
+        self.prev = 0
+
+    def add(self, r):
+        if self.prev == 0 and r.get("occupied", 0) == 1:
+            self.hours[parse_epoch_us(event_time(r)) // ONE_HOUR_US % 24] += 1
+        self.prev = r.get("occupied", 0)
+
+    def snapshot(self):
+        return Counter(self.hours)
+
+    def to_dict(self):
+        return {"hours": {str(h): n for h, n in self.hours.items()}, "prev": self.prev}
+
+    @classmethod
+    def from_dict(cls, state):
+        agg = cls()
+        agg.hours = Counter({int(h): n for h, n in state["hours"].items()})
+        agg.prev = state["prev"]
+        return agg
+
+
+class AutomationEfficiency(Aggregator):
+    name = "automation_efficiency"
+
+    def __init__(self):
+        self.auto_mode = 0
+        self.manual_mode = 0
+
+    def add(self, r):
+        if r.get("fan_override", 0) == 1 or r.get("led_override", 0) == 1:
+            self.manual_mode += 1 + (r.get("repeats") or 0)
+        else:
+            self.auto_mode += 1 + (r.get("repeats") or 0)
+
+    def snapshot(self):
+        total = self.auto_mode + self.manual_mode
+        return {
+            "auto_pct": (self.auto_mode / total * 100) if total > 0 else 0,
+            "auto_count": self.auto_mode,
+            "manual_count": self.manual_mode
+        }
+
+
+class SystemResponseTime(Aggregator):
+    name = "system_response_time"
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.prev = None
+
+    def add(self, curr):
+        prev = self.prev
+        if prev is not None and prev["occupied"] != curr.get("occupied", 0):
+            if (prev["fan"] != curr.get("fan", 0) or prev["led"] != curr.get("led", 0)):
+                response_sec = (parse_epoch_us(event_time(curr)) -
+                                parse_epoch_us(prev["timestamp"])) / ONE_SECOND_US
+                if response_sec < 60:
+                    self.total += response_sec
+                    self.count += 1
+        self.prev = {
+            "occupied": curr.get("occupied", 0),
+            "fan": curr.get("fan", 0),
+            "led": curr.get("led", 0),
+            "timestamp": event_time(curr)
+        }
+
+    def snapshot(self):
+        return {
+            "avg_seconds": self.total / self.count if self.count else 0,
+            "count": self.count
+        }
+
+
+TELEMETRY_AGGREGATORS = [OccupancyFrequency, FanUsageTime, LedUsageTime, OccupancyDuration,
+                         PeakUsageTime, AutomationEfficiency, SystemResponseTime]
+EVENT_AGGREGATORS = [ManualOverrideStats]
+
+
+class KpiState:
+    """All aggregators for one room, resumable from the rows it has seen.
+
+    Rows can commit slightly out of timestamp order, so each group keeps a
+    settled state of every row older than the overlap window before its
+    newest row (firestore_client.overlap_start) and the rows inside the
+    window by id. Every update merges the new rows into the window, folds
+    the ones that left it into the settled state and replays the rest on a
+    copy of it: a late row is counted in order and a row seen twice once.
+    A row that commits behind the window, e.g. from a spool replaying a
+    backlog, is not in the settled state; the group is then counted again
+    from the rows given.
+    """
+
+    GROUPS = {"telemetry": TELEMETRY_AGGREGATORS, "events": EVENT_AGGREGATORS}
+
+    def __init__(self):
+        self.settled = {group: {cls.name: cls() for cls in classes} for group, classes in self.GROUPS.items()}
+        self.cursors = dict.fromkeys(self.GROUPS)   # group -> start of the window
+        self.windows = {group: {} for group in self.GROUPS}   # group -> {row key: row}
+        self.folded = {group: set() for group in self.GROUPS}   # group -> keys of the settled rows
+        self._oldest = dict.fromkeys(self.GROUPS)   # group -> key of the oldest settled row given
+        self.telemetry = copy.deepcopy(self.settled["telemetry"])
+        self.events = copy.deepcopy(self.settled["events"])
+        self._lock = threading.Lock()
+
+    def update(self, telemetry=(), events=()):
+        """Feed every row of the range, ordered by timestamp, each time it is re-read"""
+        with self._lock:
+            self.telemetry = self._update("telemetry", telemetry)
+            self.events = self._update("events", events)
+        return self
+
+    def _update(self, group, records):
+        if not records:
+            return getattr(self, group)
+        cursor = self.cursors[group]
+        # Rows older than the window were already folded in, unless one committed late
+        start = bisect_left(records, cursor, key=lambda r: r["timestamp"]) if cursor else 0
+        if self._late(group, records[:start]):
+            self._reset(group)
+            start = 0
+        settled, window = self.settled[group], self.windows[group]
+        for r in records[start:]:
+            window.setdefault(_key(r), r)
+        rows = sorted(window.values(), key=lambda r: r["timestamp"])
+        if not rows:
+            return getattr(self, group)
+
+        lower = overlap_start(rows[-1]["timestamp"])
+        split = bisect_left(rows, lower, key=lambda r: r["timestamp"])
+        if split:
+            for agg in settled.values():
+                agg.update(rows[:split])
+            for r in rows[:split]:
+                del window[_key(r)]
+                self.folded[group].add(_key(r))
+            self.cursors[group] = lower
+
+        live = copy.deepcopy(settled)
+        for agg in live.values():
+            agg.update(rows[split:])
+        return live
+
+    def _late(self, group, older):
+        """True if a row older than the window was never folded into the settled state"""
+        folded = self.folded[group]
+        if not older:
+            return False
+        first = _key(older[0])
+        # Same count and oldest row as last time: the rows are the settled ones
+        if len(older) == len(folded) and first == self._oldest[group]:
+            return False
+        keys = [_key(r) for r in older]
+        if any(key not in folded for key in keys):
+            return True
+        # The oldest rows left the range (cache retention); their counts stay
+        self.folded[group] = set(keys)
+        self._oldest[group] = first
+        return False
+
+    def _reset(self, group):
+        self.settled[group] = {cls.name: cls() for cls in self.GROUPS[group]}
+        self.cursors[group] = None
+        self.windows[group] = {}
+        self.folded[group] = set()
+        self._oldest[group] = None
+
+    def snapshot(self):
+        with self._lock:
+            result = {name: agg.snapshot() for name, agg in self.telemetry.items()}
+            result.update({name: agg.snapshot() for name, agg in self.events.items()})
+            return result
+
+    # ================= SERIALIZATION =================
+    def to_dict(self):
+        with self._lock:
+            return {
+                "settled": {group: {name: agg.to_dict() for name, agg in aggs.items()}
+                            for group, aggs in self.settled.items()},
+                "cursors": dict(self.cursors),
+                "windows": {group: list(window.values()) for group, window in self.windows.items()},
+                "folded": {group: sorted(keys) for group, keys in self.folded.items()}
+            }
+
+    @classmethod
+    def from_dict(cls, state):
+        kpi = cls()
+        for group, classes in cls.GROUPS.items():
+            aggs = kpi.settled[group]
+            for agg_cls in classes:
+                if agg_cls.name in state["settled"][group]:
+                    aggs[agg_cls.name] = agg_cls.from_dict(state["settled"][group][agg_cls.name])
+            kpi.cursors[group] = state["cursors"][group]
+            kpi.folded[group] = set(state.get("folded", {}).get(group, ()))
+            rows = sorted(state["windows"][group], key=lambda r: r["timestamp"])
+            kpi.windows[group] = {_key(r): r for r in rows}
+            live = copy.deepcopy(aggs)
+            for agg in live.values():
+                agg.update(rows)
+            setattr(kpi, group, live)
+        return kpi
+
+    def dumps(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def loads(cls, text):
+        return cls.from_dict(json.loads(text))
+
+
+def _key(record):
+    """Document id of a row, or its content when it has none"""
+    if record.get("id") is not None:
+        return record["id"]
+    return json.dumps(record, sort_keys=True, default=str)
@@ -1,6 +1,10 @@
-from datetime import datetime
 from collections import Counter
 
+from timeutils import event_time, parse_epoch_us
+
+ONE_SECOND_US = 1_000_000
+ONE_HOUR_US = 3600 * ONE_SECOND_US
+
 def occupancy_frequency(records):
     count = 0
     prev = 0
@@ -15,11 +19,11 @@ def fan_usage_time(records):
     last_on = None
 
     for r in records:
-        ts = datetime.fromisoformat(r["timestamp"])
+        ts = parse_epoch_us(event_time(r))
         if r.get("fan", 0) == 1 and last_on is None:
             last_on = ts
-        elif r.get("fan", 0) == 0 and last_on:
-            total += (ts - last_on).seconds
+        elif r.get("fan", 0) == 0 and last_on is not None:
+            total += (ts - last_on) // ONE_SECOND_US
             last_on = None
 
     return total
@@ -29,11 +33,11 @@ def led_usage_time(records):
     last_on = None
 
     for r in records:
-        ts = datetime.fromisoformat(r["timestamp"])
+        ts = parse_epoch_us(event_time(r))
         if r.get("led", 0) == 1 and last_on is None:
             last_on = ts
-        elif r.get("led", 0) == 0 and last_on:
-            total += (ts - last_on).seconds
+        elif r.get("led", 0) == 0 and last_on is not None:
+            total += (ts - last_on) // ONE_SECOND_US
             last_on = None
 
     return total
@@ -44,11 +48,11 @@ def occupancy_duration(records):
     last_on = None
     
     for r in records:
-        ts = datetime.fromisoformat(r["timestamp"])
+        ts = parse_epoch_us(event_time(r))
         if r.get("occupied", 0) == 1 and last_on is None:
             last_on = ts
-        elif r.get("occupied", 0) == 0 and last_on:
-            duration_seconds = (ts - last_on).seconds
+        elif r.get("occupied", 0) == 0 and last_on is not None:
+            duration_seconds = (ts - last_on) // ONE_SECOND_US
             durations.append(duration_seconds)
             last_on = None
     
@@ -100,8 +104,8 @@ def peak_usage_time(records):
     
     for r in records:
         if prev == 0 and r.get("occupied", 0) == 1:
-            ts = datetime.fromisoformat(r["timestamp"])
-            hours.append(ts.hour)
+            ts = parse_epoch_us(event_time(r))
+            hours.append(ts // ONE_HOUR_US % 24)
         prev = r.get("occupied", 0)
     
     return Counter(hours)
@@ -112,11 +116,12 @@ def automation_efficiency(records):
     manual_mode = 0
     
     for r in records:
-        # If either fan_override or led_override is active, count as manual mode
+        # If either fan_override or led_override is active, count as manual mode;
+        # a heartbeat also counts the unchanged publishes it stands for
         if r.get("fan_override", 0) == 1 or r.get("led_override", 0) == 1:
-            manual_mode += 1
+            manual_mode += 1 + (r.get("repeats") or 0)
         else:
-            auto_mode += 1
+            auto_mode += 1 + (r.get("repeats") or 0)
     
     total = auto_mode + manual_mode
     auto_percentage = (auto_mode / total * 100) if total > 0 else 0
@@ -137,13 +142,13 @@ def system_response_time(records):
         
         # Detect occupancy change
         if prev.get("occupied", 0) != curr.get("occupied", 0):
-            prev_time = datetime.fromisoformat(prev["timestamp"])
-            curr_time = datetime.fromisoformat(curr["timestamp"])
+            prev_time = parse_epoch_us(event_time(prev))
+            curr_time = parse_epoch_us(event_time(curr))
             
             # Check if fan/led state changed in response
             if (prev.get("fan", 0) != curr.get("fan", 0) or 
                 prev.get("led", 0) != curr.get("led", 0)):
-                response_sec = (curr_time - prev_time).total_seconds()
+                response_sec = (curr_time - prev_time) / ONE_SECOND_US
                 if response_sec < 60:  # Only count reasonable response times (< 1 min)
                     response_times.append(response_sec)
     
@@ -153,3 +158,36 @@ def system_response_time(records):
         "avg_seconds": avg_response,
         "count": len(response_times)
     }
+
+# =========================================================
+# ROLLUP QUERIES
+# =========================================================
+# Rollup docs are written by the ingester (pythonSubscriber/rollups.py) per room
+# and minute/hour/day bucket, so long ranges read a few hundred docs instead of
+# every raw telemetry row.
+
+def rollup_totals(rollups):
+    """Sum the counters of a list of rollup documents"""
+    totals = {
+        "occupied_seconds": 0,
+        "fan_on_seconds": 0,
+        "led_on_seconds": 0,
+        "entries": 0,
+        "manual_overrides": 0
+    }
+    for r in rollups:
+        for key in totals:
+            totals[key] += r.get(key, 0)
+    return totals
+
+def rollup_peak_hours(rollups):
+    """Entries per hour of day, like peak_usage_time"""
+    hours = Counter()
+    for r in rollups:
+        for hour, count in r.get("hour_histogram", {}).items():
+            hours[int(hour)] += count
+    return hours
+
+def rollup_series(rollups, field):
+    """(bucket, value) pairs of one counter, in bucket order"""
+    return [(r["bucket"], r.get(field, 0)) for r in sorted(rollups, key=lambda r: r["bucket"])]
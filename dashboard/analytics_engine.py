@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+from collections import Counter
+from timeutils import to_epoch_ns, event_time, event_times
+
+# Columns used by the telemetry KPIs; missing values count as 0 like r.get(key, 0)
+STATE_COLUMNS = ["occupied", "fan", "led", "fan_override", "led_override"]
+# Publishes each row stands for: 1 + the repeats of a heartbeat (change_filter)
+WEIGHT = "publishes"
+
+NS_PER_SECOND = 1_000_000_000
+SECONDS_PER_DAY = 86400
+
+
+def to_frame(records):
+    """Convert telemetry into a columnar frame: int8 states, int64 epoch ns in "ts"
+    and the publishes each row stands for in WEIGHT.
+
+    Accepts a list of record dicts or a dict of column lists (e.g. the
+    columns of firestore_client.CollectionCache). Timestamps are the naive
+    UTC ISO strings written by the ingester; device time wins when present.
+    """
+    if isinstance(records, pd.DataFrame):
+        return records
+    columns = records if isinstance(records, dict) else None
+    n = len(columns["timestamp"]) if columns is not None else len(records)
+
+    frame = {}
+    for key in STATE_COLUMNS:
+        if columns is not None:
+            values = columns.get(key)
+            values = [0] * n if values is None else [0 if v is None else v for v in values]
+        else:
+            values = [r.get(key, 0) for r in records]
+        frame[key] = np.asarray(values, dtype=np.int8) if n else np.zeros(0, dtype=np.int8)
+
+    repeats = columns.get("repeats") if columns is not None else [r.get("repeats") for r in records]
+    repeats = [0] * n if repeats is None else [v or 0 for v in repeats]
+    frame[WEIGHT] = 1 + np.asarray(repeats, dtype=np.int64) if n else np.zeros(0, dtype=np.int64)
+
+    stamps = event_times(columns) if columns is not None else [event_time(r) for r in records]
+    frame["ts"] = to_epoch_ns(stamps) if n else np.zeros(0, dtype=np.int64)
+    return pd.DataFrame(frame)
+
+
+def _rising_edges(values):
+    """Indexes where the previous value was 0 and the current one is 1"""
+    prev = np.concatenate(([0], values[:-1]))
+    return np.flatnonzero((prev == 0) & (values == 1))
+
+
+def _on_off_pairs(values):
+    """Start/end indexes of completed on-periods (1 starts, 0 ends, anything else keeps state)"""
+    state = pd.Series(np.where(values == 1, 1.0, np.where(values == 0, 0.0, np.nan))) \
+              .ffill().fillna(0).to_numpy(dtype=np.int8)
+    prev = np.concatenate(([0], state[:-1]))
+    starts = np.flatnonzero((state == 1) & (prev == 0))
+    ends = np.flatnonzero((state == 0) & (prev == 1))
+    return starts[:len(ends)], ends
+
+
+def _interval_seconds(ts, starts, ends):
+    # Whole seconds, floored like timedelta // timedelta(seconds=1) in analytics.py
+    return (ts[ends] - ts[starts]) // NS_PER_SECOND
+
+
+def compute_all(records):
+    """All telemetry KPIs from analytics.py in one vectorized pass, same result shapes"""
+    df = to_frame(records)
+    ts = df["ts"].to_numpy()
+    occupied = df["occupied"].to_numpy()
+    fan = df["fan"].to_numpy()
+    led = df["led"].to_numpy()
+
+    entries = _rising_edges(occupied)
+    hours = (ts[entries] // (3600 * NS_PER_SECOND)) % 24
+    peak = Counter(dict(zip(*(a.tolist() for a in np.unique(hours, return_counts=True)))))
+
+    fan_seconds = _interval_seconds(ts, *_on_off_pairs(fan))
+    led_seconds = _interval_seconds(ts, *_on_off_pairs(led))
+
+    durations = _interval_seconds(ts, *_on_off_pairs(occupied))
+    if len(durations):
+        occ = {
+            "total_seconds": int(durations.sum()),
+            "short_visits": int((durations < 300).sum()),
+            "long_stays": int((durations > 1800).sum()),
+            "durations": durations.tolist()
+        }
+    else:
+        occ = {"total_seconds": 0, "short_visits": 0, "long_stays": 0, "durations": []}
+
+    manual = (df["fan_override"].to_numpy() == 1) | (df["led_override"].to_numpy() == 1)
+    weight = df[WEIGHT].to_numpy()
+    manual_count = int(weight[manual].sum())
+    total = int(weight.sum())
+    auto_count = total - manual_count
+
+    changed = np.flatnonzero(
+        (occupied[1:] != occupied[:-1]) & ((fan[1:] != fan[:-1]) | (led[1:] != led[:-1]))
+    ) + 1
+    response = ((ts[changed] - ts[changed - 1]) // 1000) / 1e6
+    response = response[response < 60].tolist()
+
+    return {
+        "occupancy_frequency": len(entries),
+        "fan_usage_time": int(fan_seconds.sum()),
+        "led_usage_time": int(led_seconds.sum()),
+        "occupancy_duration": occ,
+        "peak_usage_time": peak,
+        "automation_efficiency": {
+            "auto_pct": (auto_count / total * 100) if total > 0 else 0,
+            "auto_count": auto_count,
+            "manual_count": manual_count
+        },
+        "system_response_time": {
+            "avg_seconds": sum(response) / len(response) if response else 0,
+            "count": len(response)
+        }
+    }
+
+
+def grouped_entries(frame, first=None):
+    """Rows of a compute_grouped frame where a room becomes occupied (its occupancy_frequency entries)"""
+    room = frame["room"].to_numpy()
+    occupied = frame["occupied"].to_numpy()
+    if first is None:
+        first = np.r_[True, room[1:] != room[:-1]] if len(room) else np.zeros(0, dtype=bool)
+    prev = np.concatenate((occupied[:1] * 0, occupied[:-1]))
+    prev[first] = 0
+    return np.flatnonzero((prev == 0) & (occupied == 1))
+
+
+def compute_grouped(frame, rooms):
+    """compute_all for many rooms in one pass, one result per entry of rooms.
+
+    frame is a to_frame frame with an extra integer "room" column indexing
+    rooms; each room's rows must be contiguous, in room order, and in the
+    order compute_all would see them. Edges and on/off pairs never cross
+    from one room into the next, so every result equals compute_all on
+    that room's rows alone.
+    """
+    n = len(rooms)
+    room = frame["room"].to_numpy()
+    ts = frame["ts"].to_numpy()
+    occupied = frame["occupied"].to_numpy()
+    fan = frame["fan"].to_numpy()
+    led = frame["led"].to_numpy()
+    publishes = np.bincount(room, weights=frame[WEIGHT].to_numpy(), minlength=n).astype(np.int64)
+    first = np.r_[True, room[1:] != room[:-1]] if len(room) else np.zeros(0, dtype=bool)
+
+    def previous(values):
+        prev = np.concatenate((values[:1] * 0, values[:-1]))
+        prev[first] = 0
+        return prev
+
+    entries = grouped_entries(frame, first)
+    hours = (ts[entries] // (3600 * NS_PER_SECOND)) % 24
+    peak = np.bincount(room[entries] * 24 + hours, minlength=n * 24).reshape(n, 24)
+
+    last = np.flatnonzero(np.r_[room[1:] != room[:-1], True]) if len(room) else np.zeros(0, dtype=np.int64)
+    last_row = np.zeros(n, dtype=np.int64)
+    last_row[room[last]] = last
+
+    def pairs(values):
+        # Like _on_off_pairs per room: each room's first row falls back to 0
+        state = np.where(values == 1, 1.0, np.where(values == 0, 0.0, np.nan))
+        state[first & np.isnan(state)] = 0
+        state = pd.Series(state).ffill().to_numpy(dtype=np.int8)
+        prev = previous(state)
+        starts = np.flatnonzero((state == 1) & (prev == 0))
+        ends = np.flatnonzero((state == 0) & (prev == 1))
+        # Drop the on-period still open at the end of each room
+        last_start = np.r_[room[starts][1:] != room[starts][:-1], True] if len(starts) else starts.astype(bool)
+        starts = starts[~(last_start & (state[last_row[room[starts]]] == 1))]
+        return room[ends], _interval_seconds(ts, starts, ends)
+
+    def per_room(owner, values):
+        return np.bincount(owner, weights=values, minlength=n).astype(np.int64)
+
+    fan_owner, fan_seconds = pairs(fan)
+    led_owner, led_seconds = pairs(led)
+    occ_owner, durations = pairs(occupied)
+    durations_by_room = np.split(durations, np.searchsorted(occ_owner, np.arange(1, n)))
+
+    manual = (frame["fan_override"].to_numpy() == 1) | (frame["led_override"].to_numpy() == 1)
+    manual_count = np.bincount(room[manual], weights=frame[WEIGHT].to_numpy()[manual], minlength=n).astype(np.int64)
+
+    changed = np.flatnonzero(
+        (occupied[1:] != occupied[:-1]) & ((fan[1:] != fan[:-1]) | (led[1:] != led[:-1]))
+        & ~first[1:]
+    ) + 1
+    response = ((ts[changed] - ts[changed - 1]) // 1000) / 1e6
+    quick = response < 60
+    response_count = np.bincount(room[changed][quick], minlength=n)
+    response_sum = np.bincount(room[changed][quick], weights=response[quick], minlength=n)
+
+    results = {
+        "entries": np.bincount(room[entries], minlength=n),
+        "fan": per_room(fan_owner, fan_seconds),
+        "led": per_room(led_owner, led_seconds),
+        "occupied": per_room(occ_owner, durations),
+        "short": np.bincount(occ_owner[durations < 300], minlength=n),
+        "long": np.bincount(occ_owner[durations > 1800], minlength=n),
+    }
+    kpis = []
+    for i in range(n):
+        total = int(publishes[i])
+        manual_i = int(manual_count[i])
+        count = int(response_count[i])
+        kpis.append({
+            "occupancy_frequency": int(results["entries"][i]),
+            "fan_usage_time": int(results["fan"][i]),
+            "led_usage_time": int(results["led"][i]),
+            "occupancy_duration": {
+                "total_seconds": int(results["occupied"][i]),
+                "short_visits": int(results["short"][i]),
+                "long_stays": int(results["long"][i]),
+                "durations": durations_by_room[i].tolist()
+            },
+            "peak_usage_time": Counter({h: int(c) for h, c in enumerate(peak[i]) if c}),
+            "automation_efficiency": {
+                "auto_pct": ((total - manual_i) / total * 100) if total > 0 else 0,
+                "auto_count": total - manual_i,
+                "manual_count": manual_i
+            },
+            "system_response_time": {
+                "avg_seconds": float(response_sum[i]) / count if count else 0,
+                "count": count
+            }
+        })
+    return kpis
@@ -1,20 +1,21 @@
 import streamlit as st
-import pandas as pd
-import requests
 import time
 import os
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from firestore_client import get_telemetry, get_events, db
-from analytics import (
-    occupancy_frequency, 
-    fan_usage_time,
-    led_usage_time,
-    occupancy_duration,
-    manual_override_stats,
-    automation_efficiency,
-    system_response_time
+from firestore_client import (
+    get_events_page,
+    get_rollups,
+    list_rooms,
+    CACHE_RETENTION_DAYS
 )
+from analytics import rollup_totals, rollup_series
+from timeutils import DISPLAY_TZ, local_date_time, to_local
+from live import get_feed
+import kpi_store
+from monitoring import RENDER_SECONDS
+
+render_started = time.perf_counter()
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,7 +33,9 @@ if not FIREBASE_API_KEY:
     st.error("FIREBASE_API_KEY not found in environment variables")
     st.stop()
 
-REFRESH_INTERVAL_SECONDS = 3  # Auto-refresh every 3 seconds
+REFRESH_INTERVAL_SECONDS = 3  # Polling fallback when the live listener is unavailable
+LIVE_CHECK_SECONDS = 1        # How often sessions check the in-memory live feed
+DEFAULT_ROOM = "room_01"      # Selected first, and the only room until one is discovered
 
 # =========================================================
 # SESSION STATE
@@ -40,17 +43,13 @@ REFRESH_INTERVAL_SECONDS = 3  # Auto-refresh every 3 seconds
 if "user" not in st.session_state:
     st.session_state.user = None
 
-# =========================================================
-# ADMIN CHECK
-# =========================================================
-def is_admin(uid):
-    doc = db.collection("users").document(uid).get()
-    return doc.exists and doc.to_dict().get("role") == "admin"
-
 # =========================================================
 # LOGIN PAGE
 # =========================================================
 def login():
+    # requests and the JWT libraries are only needed to sign in
+    from auth import login_admin, AuthError
+
     st.title("Dashboard Login")
     st.caption("Smart Room Occupancy and Energy Efficient System")
     st.markdown("---")
@@ -63,36 +62,20 @@ def login():
             submit = st.form_submit_button("Login", width='stretch')
             
             if submit:
-                payload = {
-                    "email": email,
-                    "password": password,
-                    "returnSecureToken": True
-                }
-                
                 try:
-                    r = requests.post(
-                        f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_API_KEY}",
-                        json=payload
-                    )
+                    # Pooled HTTP sign-in; admin rights come from the verified
+                    # ID token or a cached role lookup (see auth.py)
+                    uid = login_admin(email, password, FIREBASE_API_KEY)
                     
-                    if r.status_code == 200:
-                        data = r.json()
-                        uid = data["localId"]
-                        
-                        # Check if user is admin
-                        if not is_admin(uid):
-                            st.error("Access denied. Admin privileges required.")
-                            st.stop()
-                        
-                        # Set user session
-                        st.session_state.user = {
-                            "email": email,
-                            "uid": uid
-                        }
-                        st.success("Login successful!")
-                        st.rerun()
-                    else:
-                        st.error("Invalid email or password")
+                    # Set user session
+                    st.session_state.user = {
+                        "email": email,
+                        "uid": uid
+                    }
+                    st.success("Login successful!")
+                    st.rerun()
+                except AuthError as e:
+                    st.error(str(e))
                 except Exception as e:
                     st.error(f"Login error: {str(e)}")
 
@@ -112,66 +95,41 @@ with st.sidebar:
     st.write(f"**Email:** {st.session_state.user['email']}")
     if st.button("🚪 Logout", width='stretch'):
         logout()
-    
-    st.divider()
-    st.markdown("### 🔄 Auto-Refresh")
-    st.info(f"Dashboard refreshes every {REFRESH_INTERVAL_SECONDS} seconds")
-
-# Timezone conversion helper for Malaysia time (UTC+8)
-def to_malaysia_time(timestamp_str):
-    """Convert UTC timestamp to Malaysia time (UTC+8)"""
-    try:
-        # Parse the timestamp
-        if "T" in timestamp_str:
-            dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        else:
-            dt = datetime.fromisoformat(timestamp_str)
-        
-        # If timezone-naive, assume UTC
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        
-        # Convert to Malaysia time (UTC+8)
-        malaysia_tz = timezone(timedelta(hours=8))
-        dt_malaysia = dt.astimezone(malaysia_tz)
-        
-        return dt_malaysia.strftime("%Y-%m-%d"), dt_malaysia.strftime("%H:%M:%S")
-    except:
-        return timestamp_str[:10], timestamp_str[11:19]
 
 st.title("🏠 Smart Room Energy Dashboard")
 
-# Room selector at the top
+# Room selector and date range at the top
 col1, col2 = st.columns([1, 3])
 with col1:
-    rooms = ["room_01"]
-    selected_room = st.selectbox("📍 Select Room", rooms, index=0)
-
-st.divider()
-
-telemetry = get_telemetry()
-events = get_events()
-
-if not telemetry:
-    st.warning("No telemetry data available yet.")
-    st.stop()
+    # Rooms seen in the shared cache; on a new instance, the list the fleet
+    # view saved last (kpi_store), so the first paint does not wait for a full read
+    rooms = list_rooms(load=False) or kpi_store.load_rooms() or list_rooms() or [DEFAULT_ROOM]
+    previous = st.session_state.get("selected_room", DEFAULT_ROOM)
+    index = rooms.index(previous) if previous in rooms else 0
+    selected_room = st.selectbox("📍 Select Room", rooms, index=index)
+    st.session_state.selected_room = selected_room
+with col2:
+    today = datetime.now(DISPLAY_TZ).date()
+    date_range = st.date_input(
+        "📅 Date Range",
+        value=(today - timedelta(days=int(CACHE_RETENTION_DAYS)), today),
+        max_value=today
+    )
 
-# Filter data by selected room
-telemetry = [t for t in telemetry if t.get("device_id") == selected_room]
-events = [e for e in events if e.get("device_id") == selected_room]
-
-if not telemetry:
-    st.warning(f"No data available for {selected_room}")
-    st.stop()
+# While the user is still picking, only the start date is set
+if isinstance(date_range, (tuple, list)):
+    start_date = date_range[0] if date_range else today
+    end_date = date_range[1] if len(date_range) > 1 else start_date
+else:
+    start_date = end_date = date_range
 
-latest = telemetry[-1]
+# Dates are picked in the display timezone; the end date is inclusive
+range_start = datetime.combine(start_date, datetime.min.time(), tzinfo=DISPLAY_TZ)
+range_end = datetime.combine(end_date + timedelta(days=1), datetime.min.time(), tzinfo=DISPLAY_TZ)
 
-# Create tabs for better organization
-tab1, tab2 = st.tabs(["📊 Overview", "📈 Analytics & History"])
+st.divider()
 
-# ===== TAB 1: OVERVIEW =====
-with tab1:
-    # Current Room Status
+def status_metrics(latest):
     st.subheader("Current Room Status")
     col1, col2, col3, col4, col5 = st.columns(5)
     
@@ -204,22 +162,20 @@ with tab1:
                  "Manual" if led_override else "Auto",
                  delta="Override" if led_override else "Automated",
                  delta_color="off" if led_override else "normal")
-    
-    st.divider()
-    
-    # Key Performance Indicators
+
+def kpi_metrics(kpis):
     st.subheader("Key Performance Indicators")
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        visits = occupancy_frequency(telemetry)
+        visits = kpis["occupancy_frequency"]
         st.metric("Times Entered", 
                  f"{visits}",
                  help="Number of times someone entered the room")
     
     with col2:
-        fan_time = fan_usage_time(telemetry)
+        fan_time = kpis["fan_usage_time"]
         hours = fan_time // 3600
         mins = (fan_time % 3600) // 60
         st.metric("Total Fan Runtime", 
@@ -227,7 +183,7 @@ with tab1:
                  help="Total time the fan was running")
     
     with col3:
-        led_time = led_usage_time(telemetry)
+        led_time = kpis["led_usage_time"]
         hours = led_time // 3600
         mins = (led_time % 3600) // 60
         st.metric("Total LED Runtime", 
@@ -235,12 +191,111 @@ with tab1:
                  help="Total time the LED was on")
     
     with col4:
-        auto_eff = automation_efficiency(telemetry)
+        auto_eff = kpis["automation_efficiency"]
         st.metric("Automation Efficiency", 
                  f"{auto_eff['auto_pct']:.1f}%",
                  delta=f"{auto_eff['auto_count']} auto vs {auto_eff['manual_count']} manual",
                  delta_color="normal",
                  help="% of time system runs in auto mode")
+
+# Data comes from the container-wide data service: room and date filters run
+# in Firestore / the shared cache, and concurrent sessions share one read
+@st.cache_resource(show_spinner=False)
+def data_service():
+    from data_service import get_data_service
+    return get_data_service()
+
+service = data_service()
+if service.cached(selected_room, range_start, range_end) is None:
+    # First view of this room and range on this instance: paint the last saved
+    # overview right away, then replace it once the first read is done
+    preview = st.empty()
+    saved = kpi_store.load(selected_room, range_start, range_end)
+    if saved:
+        with preview.container():
+            saved_date, saved_time = to_local(saved["saved_at"])
+            st.caption(f"⏳ Showing the overview saved at {saved_date} {saved_time}, loading live data...")
+            status_metrics(saved["latest"])
+            st.divider()
+            kpi_metrics(saved["kpis"])
+    snapshot = service.snapshot(selected_room, range_start, range_end)
+    preview.empty()
+else:
+    snapshot = service.snapshot(selected_room, range_start, range_end)
+telemetry = snapshot.telemetry
+events = snapshot.events
+
+# Live-feed version this render is based on (read before the snapshot's
+# fetch), so a document arriving mid-render triggers another update
+rendered_version = snapshot.feed_version
+rendered_at = time.monotonic()
+
+# Imported after the first paint
+import pandas as pd
+
+# Only while the room has no data: the page re-runs once some arrives (the
+# sections below refresh themselves)
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def watch_for_new_data(device_id, version, rendered_at):
+    if feed.healthy:
+        if feed.version(device_id) != version:
+            st.rerun()
+    elif time.monotonic() - rendered_at >= REFRESH_INTERVAL_SECONDS:
+        st.rerun()
+
+with st.sidebar:
+    st.divider()
+    st.markdown("### 🔄 Live Updates")
+    feed = get_feed()
+    if feed.healthy:
+        st.info("Dashboard updates as soon as new data arrives")
+    else:
+        st.info(f"Live listener unavailable, refreshing every {REFRESH_INTERVAL_SECONDS} seconds")
+
+    with st.expander("📡 Data Service"):
+        metrics = service.metrics()
+        st.write(f"**Cache hit rate:** {metrics['hit_rate'] * 100:.1f}%")
+        st.write(f"**Avg fetch:** {metrics['avg_fetch_seconds'] * 1000:.0f} ms")
+        st.write(f"**Snapshot version:** {snapshot.version}")
+
+if not telemetry:
+    st.warning(f"No data available for {selected_room} in the selected date range")
+    # Nothing to redraw yet: re-run the page once the room has data
+    watch_for_new_data(selected_room, rendered_version, rendered_at)
+    st.stop()
+
+latest = telemetry[-1]
+
+# =========================================================
+# LIVE SECTIONS
+# =========================================================
+# Each section is a fragment that re-runs on its own, on a timer or on its
+# own widgets, instead of the whole page re-running when data arrives. It
+# redraws from the data service's shared snapshot and the views cached per
+# snapshot version: Firestore is read and the KPIs are recomputed only when
+# the room's data changed, once for all sessions.
+LIVE_SECONDS = LIVE_CHECK_SECONDS if feed.healthy else REFRESH_INTERVAL_SECONDS
+
+def per_version(name, key, version, load):
+    """load() once per key and snapshot version in this session"""
+    cached = st.session_state.get(name)
+    if cached is None or cached[0] != (key, version):
+        cached = ((key, version), load())
+        st.session_state[name] = cached
+    return cached[1]
+
+# Current room status panel, refreshed on its own from the live feed
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def room_status_panel(device_id, fallback):
+    status_metrics(feed.latest_status(device_id) or fallback)
+
+@st.fragment(run_every=LIVE_SECONDS)
+def overview_panel(device_id, start, end):
+    snapshot = service.snapshot(device_id, start, end)
+    kpis, events = snapshot.kpis, snapshot.events
+
+    # Key Performance Indicators
+    kpi_metrics(kpis)
     
     st.divider()
     
@@ -250,7 +305,7 @@ with tab1:
     col1, col2 = st.columns(2)
     
     with col1:
-        response = system_response_time(telemetry)
+        response = kpis["system_response_time"]
         st.metric("Avg Response Time", 
                  f"{response['avg_seconds']:.2f}s",
                  delta=f"out of {response['count']} responses measured",
@@ -277,8 +332,8 @@ with tab1:
             return descriptions.get(event_type, event_type)
         
         events_data = []
-        for e in reversed(recent_events):
-            date_my, time_my = to_malaysia_time(e.get("timestamp", "N/A"))
+        recent_events = recent_events[::-1]
+        for e, (date_my, time_my) in zip(recent_events, local_date_time(recent_events)):
             events_data.append({
                 "Date": date_my,
                 "Time": time_my,
@@ -290,12 +345,13 @@ with tab1:
     else:
         st.info("No recent events")
 
-# ===== TAB 2: ANALYTICS & HISTORY =====
-with tab2:
-    
+@st.fragment(run_every=LIVE_SECONDS)
+def visit_panel(device_id, start, end):
+    snapshot = service.snapshot(device_id, start, end)
+
     # Occupancy Duration Analysis
     st.subheader("⏱️ Visit Duration Analysis (Completed Visits)")
-    occ_data = occupancy_duration(telemetry)
+    occ_data = snapshot.kpis["occupancy_duration"]
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -314,11 +370,123 @@ with tab2:
                  help="Completed visits longer than 30 minutes")
     
     st.divider()
-    
+
+    # State timelines, downsampled in the data service to about one mark per
+    # pixel (run-length intervals, min-max buckets, LTTB for the rate line)
+    st.subheader("🕒 State Timeline")
+    timeline = service.timeline(device_id, start, end)
+    states = timeline["states"]
+    states = states[states["max"] > 0].copy()
+    if not states.empty:
+        import altair as alt
+        from timeline import TIMELINE_SERIES
+        for column in ("start", "end"):
+            states[column] = states[column].dt.tz_convert(DISPLAY_TZ).dt.tz_localize(None)
+        occupancy = timeline["occupancy"].copy()
+        occupancy["time"] = occupancy["time"].dt.tz_convert(DISPLAY_TZ).dt.tz_localize(None)
+
+        bars = alt.Chart(states).mark_rect().encode(
+            x=alt.X('start:T', title=None),
+            x2='end:T',
+            y=alt.Y('series:N', title=None, sort=list(TIMELINE_SERIES.values())),
+            color=alt.Color('series:N', legend=None),
+            opacity=alt.Opacity('level:Q', scale=alt.Scale(domain=[0, 1], range=[0.35, 1]), legend=None),
+            tooltip=[alt.Tooltip('series:N'), alt.Tooltip('start:T', format='%Y-%m-%d %H:%M'),
+                     alt.Tooltip('end:T', format='%Y-%m-%d %H:%M'),
+                     alt.Tooltip('level:Q', title='Share on', format='.0%')]
+        ).properties(height=150)
+        rate = alt.Chart(occupancy).mark_line(color='steelblue').encode(
+            x=alt.X('time:T', title='Time'),
+            y=alt.Y('rate:Q', title='Occupied', axis=alt.Axis(format='%'))
+        ).properties(height=120)
+        st.altair_chart(alt.vconcat(bars, rate).resolve_scale(x='shared'), width='stretch')
+        st.caption("Faded bars: on for part of the interval at this zoom level.")
+    else:
+        st.info("No fan, lamp or occupancy activity in the selected range.")
+
+@st.fragment(run_every=LIVE_SECONDS)
+def long_range_usage(device_id, start, end):
+    # Long-range usage from the ingester's daily rollups
+    st.subheader("📆 Long-Range Usage")
+    period = st.radio("Period", ["Week", "Month", "Year"], horizontal=True)
+    period_days = {"Week": 7, "Month": 30, "Year": 365}[period]
+    def read_rollups():
+        return get_rollups(
+            device_id,
+            granularity="day",
+            start=datetime.now(timezone.utc) - timedelta(days=period_days)
+        )
+    # Re-read only when the room's data or the period changed
+    version = service.snapshot(device_id, start, end).version
+    rollups = per_version("rollups", (device_id, period), version, read_rollups)
+
+    if rollups:
+        totals = rollup_totals(rollups)
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Hours Occupied", f"{totals['occupied_seconds'] / 3600:.1f}h")
+        with col2:
+            st.metric("Fan Hours", f"{totals['fan_on_seconds'] / 3600:.1f}h")
+        with col3:
+            st.metric("Lamp Hours", f"{totals['led_on_seconds'] / 3600:.1f}h")
+        with col4:
+            st.metric("Entries", totals["entries"],
+                      delta=f"{totals['manual_overrides']} manual overrides",
+                      delta_color="off")
+
+        daily = pd.DataFrame(rollup_series(rollups, "occupied_seconds"), columns=["Day", "Seconds"])
+        daily["Hours"] = daily["Seconds"] / 3600
+        import altair as alt
+        chart = alt.Chart(daily).mark_bar(color='steelblue').encode(
+            x=alt.X('Day:T', title='Day'),
+            y=alt.Y('Hours:Q', title='Hours Occupied')
+        ).properties(height=250)
+        st.altair_chart(chart, width='stretch')
+    else:
+        st.info("No rollup data for this period yet.")
+
+@st.fragment(run_every=LIVE_SECONDS)
+def energy_panel(device_id, start, end):
+    # Energy use and anomalies for the selected range (energy.py)
+    st.subheader("⚡ Energy & Anomalies")
+    snapshot = service.snapshot(device_id, start, end)
+    kpis, events = snapshot.kpis, snapshot.events
+    energy = service.energy(device_id, start, end)
+    room_energy = energy["rooms"].iloc[0]
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Energy Used", f"{room_energy['kwh']:.2f} kWh")
+    with col2:
+        st.metric("Estimated Cost", f"{room_energy['cost']:.2f}")
+    with col3:
+        st.metric("Fan Energy", f"{room_energy['fan_kwh']:.2f} kWh",
+                  delta=f"{room_energy['fan_hours']:.1f}h on", delta_color="off")
+    with col4:
+        st.metric("Lamp Energy", f"{room_energy['led_kwh']:.2f} kWh",
+                  delta=f"{room_energy['led_hours']:.1f}h on", delta_color="off")
+
+    anomalies = energy["anomalies"]
+    if not anomalies.empty:
+        descriptions = {
+            "device_on_empty": "Left on in an empty room",
+            "override_timeout": "Override held past 15 s"
+        }
+        st.dataframe(pd.DataFrame({
+            "Started": anomalies["start"].dt.tz_convert(DISPLAY_TZ).dt.strftime("%Y-%m-%d %H:%M:%S"),
+            "Device": anomalies["device"].map({"fan": "Fan", "led": "Lamp"}).fillna(anomalies["device"]),
+            "Anomaly": anomalies["kind"].map(descriptions),
+            "Duration (min)": (anomalies["seconds"] / 60).round(1),
+            "Ongoing": anomalies["open"]
+        }), width='stretch', hide_index=True, height=min(250, 36 + 35 * len(anomalies)))
+    else:
+        st.success("No devices left on in an empty room and no stuck overrides in this range.")
+
+    st.divider()
+
     # Control Behavior Analysis
     st.subheader("🎛️ Control Behavior: Manual vs Automatic")
     if events:
-        override_stats = manual_override_stats(events)
+        override_stats = kpis["manual_override_stats"]
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -344,12 +512,14 @@ with tab2:
             st.altair_chart(chart, width='stretch')
     else:
         st.info("No event data available yet.")
-    
-    st.divider()
-    
+
+@st.fragment(run_every=LIVE_SECONDS)
+def event_log_panel(device_id, start, end):
+    snapshot = service.snapshot(device_id, start, end)
+
     # Full Event Log
     st.subheader("📋 Complete Event Log")
-    if events:
+    if snapshot.events:
         # Helper function to format event descriptions
         def format_event_detail(event_type):
             descriptions = {
@@ -359,24 +529,141 @@ with tab2:
                 "AUTO_OFF": "⏸️ Fan & Lamp Auto OFF"
             }
             return descriptions.get(event_type, event_type)
-        
+
+        col1, col2, col3 = st.columns([1, 1, 2])
+        with col1:
+            page_size = st.selectbox("Rows per page", [25, 50, 100], index=1)
+        with col2:
+            sort_order = st.selectbox("Sort", ["Newest first", "Oldest first"])
+        with col3:
+            event_types = st.multiselect("Event types", ["MANUAL_LED", "MANUAL_FAN", "AUTO_ON", "AUTO_OFF"],
+                                         format_func=format_event_detail)
+
+        # Cursors of the pages visited so far; reset whenever a filter changes
+        log_filters = (device_id, page_size, sort_order, tuple(event_types), start, end)
+        if st.session_state.get("event_log_filters") != log_filters:
+            st.session_state.event_log_filters = log_filters
+            st.session_state.event_log_cursors = [None]
+        cursors = st.session_state.event_log_cursors
+
+        # Only the visible page is read and materialized, and again only once the room has new data
+        def read_page():
+            return get_events_page(
+                device_id=device_id,
+                page_size=page_size,
+                cursor=cursors[-1],
+                descending=sort_order == "Newest first",
+                event_types=event_types,
+                start=start,
+                end=end
+            )
+        page_events, next_cursor = per_version("event_log_page", (log_filters, cursors[-1]), snapshot.version,
+                                               read_page)
+
         events_data = []
-        for e in reversed(events):
-            date_my, time_my = to_malaysia_time(e.get("timestamp", "N/A"))
+        for e, (date_my, time_my) in zip(page_events, local_date_time(page_events)):
             events_data.append({
                 "Device": e.get("device_id", "N/A"),
                 "Action": format_event_detail(e.get("event", "N/A")),
                 "Date": date_my,
                 "Time": time_my
             })
-        
-        events_df = pd.DataFrame(events_data)
-        st.dataframe(events_df, width='stretch', hide_index=True, height=400)
+
+        if events_data:
+            events_df = pd.DataFrame(events_data)
+            st.dataframe(events_df, width='stretch', hide_index=True, height=400)
+        else:
+            st.info("No events match the selected filters.")
+
+        # The callbacks move the cursor before the fragment re-runs
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("◀ Previous", disabled=len(cursors) == 1, width='stretch', on_click=cursors.pop)
+        with col2:
+            st.caption(f"Page {len(cursors)}")
+        with col3:
+            st.button("Next ▶", disabled=next_cursor is None, width='stretch',
+                      on_click=cursors.append, args=(next_cursor,))
     else:
         st.info("No events recorded yet.")
 
-# =========================================================
-# AUTO-REFRESH (at the end so dashboard loads first)
-# =========================================================
-time.sleep(REFRESH_INTERVAL_SECONDS)
-st.rerun()
+@st.fragment(run_every=LIVE_SECONDS)
+def fleet_panel(start, end):
+    # KPIs of every room in the range, computed in one grouped pass and kept
+    # per room by fleet.py: a refresh only recomputes rooms with new data
+    from fleet import get_fleet
+    fleet = get_fleet(start, end)
+    # Peak hours and the heatmap are in the display timezone
+    fleet_table, fleet_hours = fleet.tables()
+
+    if fleet_table.empty:
+        st.info("No room data in the selected date range")
+    else:
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Rooms", len(fleet_table))
+        with col2:
+            st.metric("Entries", int(fleet_table["entries"].sum()))
+        with col3:
+            st.metric("Hours Occupied", f"{fleet_table['occupied_hours'].sum():.1f}h")
+        with col4:
+            st.metric("Fleet Auto Mode", f"{fleet_table['auto_pct'].mean():.1f}%",
+                      help="Average of the rooms' % of records in auto mode")
+
+        st.subheader("🏢 Rooms")
+        st.dataframe(
+            fleet_table.rename(columns={
+                "room": "Room",
+                "entries": "Entries",
+                "occupied_hours": "Occupied (h)",
+                "fan_hours": "Fan (h)",
+                "led_hours": "Lamp (h)",
+                "short_visits": "Quick Visits",
+                "long_stays": "Extended Stays",
+                "auto_pct": "Auto %",
+                "manual_count": "Manual Records",
+                "avg_response_seconds": "Avg Response (s)",
+                "peak_hour": "Peak Hour"
+            }).round(2),
+            width='stretch', hide_index=True, height=min(400, 36 + 35 * len(fleet_table))
+        )
+
+        # Entries per room and local hour of day (fleet.entry_hours)
+        st.subheader("🔥 Entries by Hour")
+        import altair as alt
+        chart = alt.Chart(fleet_hours).mark_rect().encode(
+            x=alt.X('hour:O', title='Hour of Day'),
+            y=alt.Y('room:N', title=None),
+            color=alt.Color('entries:Q', title='Entries', scale=alt.Scale(scheme='orangered')),
+            tooltip=['room:N', 'hour:O', 'entries:Q']
+        ).properties(height=max(150, min(1200, 14 * len(fleet_table))))
+        st.altair_chart(chart, width='stretch')
+        st.caption(f"Fleet refreshed in {fleet.last_refresh_seconds * 1000:.0f} ms "
+                   f"({fleet.rooms_recomputed} rooms recomputed)")
+
+
+# Create tabs for better organization
+tab1, tab2, tab3 = st.tabs(["📊 Overview", "📈 Analytics & History", "🏢 Fleet"])
+
+# ===== TAB 1: OVERVIEW =====
+with tab1:
+    # Current Room Status (re-drawn from the in-memory live feed, no Firestore reads)
+    room_status_panel(selected_room, latest)
+    st.divider()
+    overview_panel(selected_room, range_start, range_end)
+
+# ===== TAB 2: ANALYTICS & HISTORY =====
+with tab2:
+    visit_panel(selected_room, range_start, range_end)
+    st.divider()
+    long_range_usage(selected_room, range_start, range_end)
+    st.divider()
+    energy_panel(selected_room, range_start, range_end)
+    st.divider()
+    event_log_panel(selected_room, range_start, range_end)
+
+# ===== TAB 3: FLEET =====
+with tab3:
+    fleet_panel(range_start, range_end)
+
+RENDER_SECONDS.observe(time.perf_counter() - render_started)
@@ -0,0 +1,144 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth import jwt
+
+# =========================================================
+# CONFIGURATION
+# =========================================================
+# Both URLs can point at auth_stub.py for local runs and tests
+IDENTITY_TOOLKIT_URL = os.environ.get("IDENTITY_TOOLKIT_URL", "https://identitytoolkit.googleapis.com/v1")
+AUTH_CERTS_URL = os.environ.get(
+    "AUTH_CERTS_URL",
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+)
+# Same placeholder as firestore_client.PROJECT_ID
+FIREBASE_PROJECT_ID = os.environ.get("FIREBASE_PROJECT_ID", "gcp-project-id")
+AUTH_ISSUER = os.environ.get("AUTH_ISSUER", f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}")
+
+HTTP_TIMEOUT = (3.05, 10)       # (connect, read) seconds
+ROLE_CACHE_TTL_SECONDS = 300
+ROLE_CACHE_SIZE = 1024
+DEFAULT_CERTS_MAX_AGE = 3600
+
+
+class AuthError(Exception):
+    pass
+
+
+# One pooled session per process: logins reuse TLS connections
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=1))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=1))
+
+# =========================================================
+# SIGN IN
+# =========================================================
+def sign_in(email, password, api_key):
+    """Password sign-in through Identity Toolkit; returns its JSON response"""
+    r = session.post(
+        f"{IDENTITY_TOOLKIT_URL}/accounts:signInWithPassword",
+        params={"key": api_key},
+        json={"email": email, "password": password, "returnSecureToken": True},
+        timeout=HTTP_TIMEOUT
+    )
+    if r.status_code != 200:
+        raise AuthError("Invalid email or password")
+    return r.json()
+
+# =========================================================
+# ID TOKEN VERIFICATION
+# =========================================================
+class PublicKeyCache:
+    """Signing certificates of the ID tokens, refreshed when Cache-Control says so"""
+
+    def __init__(self, url=AUTH_CERTS_URL):
+        self.url = url
+        self._certs = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._certs is None or time.monotonic() >= self._expires:
+                r = session.get(self.url, timeout=HTTP_TIMEOUT)
+                r.raise_for_status()
+                match = re.search(r"max-age=(\d+)", r.headers.get("Cache-Control", ""))
+                max_age = int(match.group(1)) if match else DEFAULT_CERTS_MAX_AGE
+                self._certs = r.json()
+                self._expires = time.monotonic() + max_age
+            return self._certs
+
+
+public_keys = PublicKeyCache()
+
+def verify_id_token(id_token):
+    """Check the token signature, audience and issuer locally; returns its claims"""
+    try:
+        claims = jwt.decode(id_token, certs=public_keys.get(), audience=FIREBASE_PROJECT_ID)
+    except ValueError as e:
+        raise AuthError(f"Invalid ID token: {e}")
+    if claims.get("iss") != AUTH_ISSUER:
+        raise AuthError("Invalid ID token issuer")
+    return claims
+
+# =========================================================
+# ADMIN CHECK
+# =========================================================
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl=ROLE_CACHE_TTL_SECONDS, max_size=ROLE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or time.monotonic() >= item[1]:
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+_roles = TTLCache()
+
+def is_admin(uid):
+    """Role lookup in users/<uid>, cached for ROLE_CACHE_TTL_SECONDS"""
+    cached = _roles.get(uid)
+    if cached is not None:
+        return cached
+    # Imported here so token-only logins never build a Firestore client
+    from firestore_client import db
+    doc = db.collection("users").document(uid).get()
+    admin = doc.exists and doc.to_dict().get("role") == "admin"
+    _roles.set(uid, admin)
+    return admin
+
+def login_admin(email, password, api_key):
+    """Sign in and check admin rights; returns the user's uid.
+
+    An admin custom claim in the verified ID token answers the check without
+    a Firestore read; otherwise the cached users/<uid> role is used.
+    """
+    data = sign_in(email, password, api_key)
+    claims = verify_id_token(data["idToken"])
+    uid = claims["sub"]
+    if claims.get("admin") is True or claims.get("role") == "admin" or is_admin(uid):
+        return uid
+    raise AuthError("Access denied. Admin privileges required.")
@@ -0,0 +1,133 @@
+"""Local stand-in for the Identity Toolkit sign-in endpoint and its signing keys.
+
+    python auth_stub.py --port 9099 --user admin@example.com:secret:admin
+
+then run the dashboard with
+    IDENTITY_TOOLKIT_URL=http://localhost:9099/v1
+    AUTH_CERTS_URL=http://localhost:9099/certs
+    AUTH_ISSUER=http://localhost:9099
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt, jwt
+
+TOKEN_LIFETIME_SECONDS = 3600
+
+
+class AuthStub:
+    """Serves POST /v1/accounts:signInWithPassword and GET /certs with RS256 tokens"""
+
+    def __init__(self, users, project_id, port=0):
+        self.users = users          # email -> {"password", "uid", "role"}
+        self.project_id = project_id
+        self.kid = uuid.uuid4().hex[:8]
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_pem = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+        self.public_pem = key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        self.signer = crypt.RSASigner.from_string(private_pem, key_id=self.kid)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.requests = 0
+
+    def id_token(self, user):
+        now = int(time.time())
+        claims = {
+            "iss": self.url,
+            "aud": self.project_id,
+            "sub": user["uid"],
+            "iat": now,
+            "exp": now + TOKEN_LIFETIME_SECONDS,
+        }
+        if user.get("role"):
+            claims["role"] = user["role"]
+        return jwt.encode(self.signer, claims).decode()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                stub.requests += 1
+                if urlparse(self.path).path == "/certs":
+                    self._reply(200, {stub.kid: stub.public_pem},
+                                {"Cache-Control": "public, max-age=3600"})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                stub.requests += 1
+                if urlparse(self.path).path != "/v1/accounts:signInWithPassword":
+                    self._reply(404, {"error": "not found"})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                user = stub.users.get(body.get("email"))
+                if user is None or user["password"] != body.get("password"):
+                    self._reply(400, {"error": {"message": "INVALID_LOGIN_CREDENTIALS"}})
+                    return
+                self._reply(200, {
+                    "localId": user["uid"],
+                    "email": body["email"],
+                    "idToken": stub.id_token(user),
+                    "refreshToken": uuid.uuid4().hex,
+                    "expiresIn": str(TOKEN_LIFETIME_SECONDS),
+                })
+
+        return Handler
+
+
+def parse_user(spec):
+    email, password, *role = spec.split(":")
+    return email, {"password": password, "uid": uuid.uuid5(uuid.NAMESPACE_DNS, email).hex,
+                   "role": role[0] if role else None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Identity Toolkit stub")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--project-id", default="gcp-project-id")
+    parser.add_argument("--user", action="append", default=[],
+                        help="email:password[:role], may be repeated")
+    args = parser.parse_args()
+
+    stub = AuthStub(dict(parse_user(u) for u in args.user), args.project_id, args.port)
+    print(f"Auth stub listening on {stub.url}")
+    stub.server.serve_forever()
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+
+from monitoring import record_read
+
+# Parquet archive written by pythonSubscriber/archive.py; empty = no cold tier
+ARCHIVE_URI = os.environ.get("ARCHIVE_URI", "")
+# How long a read watermark is trusted before the archive is checked again
+WATERMARK_TTL_SECONDS = 60
+
+WATERMARK_FILE = "_watermark.json"
+
+_filesystem = None
+_watermarks = {}      # collection -> (value, read at)
+_lock = threading.Lock()
+
+
+def _archive():
+    """(pyarrow FileSystem, root path), opened once"""
+    global _filesystem
+    import pyarrow.fs as pafs
+    with _lock:
+        if _filesystem is None:
+            uri = ARCHIVE_URI if "://" in ARCHIVE_URI else os.path.abspath(ARCHIVE_URI)
+            _filesystem = pafs.FileSystem.from_uri(uri)
+        return _filesystem
+
+
+def watermark(collection):
+    """Timestamp before which the collection lives in Parquet only (None = not archived)"""
+    if not ARCHIVE_URI:
+        return None
+    with _lock:
+        cached = _watermarks.get(collection)
+    if cached is not None and time.monotonic() - cached[1] < WATERMARK_TTL_SECONDS:
+        return cached[0]
+
+    import pyarrow.fs as pafs
+    fs, root = _archive()
+    path = f"{root}/{collection}/{WATERMARK_FILE}"
+    value = None
+    try:
+        if fs.get_file_info(path).type == pafs.FileType.File:
+            with fs.open_input_stream(path) as f:
+                value = json.loads(f.read())["archived_before"]
+    except (OSError, ValueError, KeyError):
+        # Being rewritten, or storage unreachable: keep what we had
+        value = cached[0] if cached is not None else None
+    with _lock:
+        _watermarks[collection] = (value, time.monotonic())
+    return value
+
+
+def read_table(collection, device_id=None, start=None, end=None, columns=None):
+    """Archived rows of [start, end) as a pyarrow Table sorted by timestamp.
+
+    Only the room's directory is listed, date partitions outside the range
+    are skipped and the timestamp filter is pushed down to the Parquet row
+    groups; columns limits what is decoded. Rows at or after the watermark
+    are left out, since Firestore still holds those.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    requested = columns or ()
+
+    cold_before = watermark(collection)
+    if cold_before is None:
+        return pa.table({"timestamp": pa.array([], pa.string())})
+    end = min(end, cold_before) if end else cold_before
+
+    fs, root = _archive()
+    base = f"{root}/{collection}"
+    partition_fields = [("device_id", pa.string()), ("date", pa.string())]
+    if device_id:
+        base = f"{base}/device_id={device_id}"
+        partition_fields = partition_fields[1:]
+
+    started = time.perf_counter()
+    try:
+        dataset = ds.dataset(base, filesystem=fs, format="parquet",
+                             partitioning=ds.partitioning(pa.schema(partition_fields), flavor="hive"))
+    except FileNotFoundError:
+        return pa.table({"timestamp": pa.array([], pa.string())})
+
+    condition = (ds.field("timestamp") < end) & (ds.field("date") <= end[:10])
+    if start:
+        condition &= (ds.field("timestamp") >= start) & (ds.field("date") >= start[:10])
+    if columns is not None:
+        # timestamp always comes along, for ordering and merging with Firestore
+        columns = [c for c in dict.fromkeys(["timestamp", *columns])
+                   if c in dataset.schema.names or c == "device_id"]
+        if device_id:
+            columns = [c for c in columns if c != "device_id"]
+    table = dataset.to_table(columns=columns, filter=condition).sort_by("timestamp")
+
+    if device_id and (columns is None or "device_id" in requested):
+        table = table.append_column("device_id", pa.array([device_id] * len(table), pa.string()))
+    record_read(collection, "archive", started, len(table))
+    return table
+
+
+def read_columns(collection, device_id=None, start=None, end=None, columns=None):
+    """read_table as {column: list}, the shape of CollectionCache.columns"""
+    table = read_table(collection, device_id, start, end, columns)
+    table = table.drop_columns([c for c in ("date",) if c in table.column_names])
+    return table.to_pydict()
+
+
+def read_records(collection, device_id=None, start=None, end=None, limit=None):
+    """read_table as a list of dicts, like the Firestore reads (newest limit rows if limit)"""
+    table = read_table(collection, device_id, start, end)
+    table = table.drop_columns([c for c in ("date",) if c in table.column_names])
+    if limit:
+        table = table.slice(max(0, len(table) - limit))
+    return [{k: v for k, v in row.items() if v is not None} for row in table.to_pylist()]
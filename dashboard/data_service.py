@@ -0,0 +1,255 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from aggregators import KpiState
+from firestore_client import get_telemetry, get_events, to_timestamp
+from live import get_feed
+from monitoring import get_logger, ANALYTICS_COMPUTE_SECONDS
+import kpi_store
+
+log = get_logger(__name__)
+
+# A snapshot is served without re-reading for this long if the live feed
+# is down; with a healthy feed it stays valid until the room's data changes.
+SNAPSHOT_MAX_AGE_SECONDS = 3
+# Keys nobody asked for in this long are dropped by the room loops
+IDLE_KEY_SECONDS = 300
+
+# Immutable view handed to every session
+Snapshot = namedtuple("Snapshot", [
+    "version", "device_id", "start", "end",
+    "telemetry", "events", "kpis", "feed_version", "fetched_at"
+])
+
+
+class _Entry:
+    def __init__(self):
+        self.snapshot = None
+        self.kpi_state = KpiState()
+        self.inflight = None     # Event set when the running fetch finishes
+        self.derived = {}        # (view, params) -> (snapshot version, result)
+        self.error = None
+        self.last_request = time.monotonic()
+
+
+class DataService:
+    """One per container: owns the Firestore reads and KPI state for all sessions.
+
+    Concurrent requests for the same room and range wait for a single fetch
+    (request coalescing), and a background loop per room refreshes the
+    snapshots when the live feed reports new data, so reads scale with the
+    number of rooms rather than the number of viewers.
+    """
+
+    def __init__(self, max_age=SNAPSHOT_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self._feed = None
+        self._entries = {}
+        self._loops = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.last_fetch_seconds = 0.0
+        self.total_fetch_seconds = 0.0
+        self.max_fetch_seconds = 0.0
+
+    @property
+    def feed(self):
+        # Started on first use: opening the listener is not needed for the first paint
+        if self._feed is None:
+            self._feed = get_feed()
+        return self._feed
+
+    # ================= PUBLIC =================
+    def snapshot(self, device_id, start=None, end=None, _touch=True):
+        key = (device_id, start, end)
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            if _touch:
+                entry.last_request = time.monotonic()
+            self._ensure_loop(device_id)
+            if self._fresh(entry):
+                self.hits += 1
+                return entry.snapshot
+            if entry.inflight is not None:
+                self.coalesced += 1
+                waiter = entry.inflight
+            else:
+                self.misses += 1
+                waiter = None
+                entry.inflight = threading.Event()
+
+        if waiter is not None:
+            waiter.wait()
+            if entry.snapshot is None:
+                raise RuntimeError(f"Fetch for {device_id} failed: {entry.error}")
+            return entry.snapshot
+        return self._fetch(key, entry)
+
+    def cached(self, device_id, start=None, end=None):
+        """The last snapshot of this room and range, possibly stale, without fetching"""
+        with self._lock:
+            entry = self._entries.get((device_id, start, end))
+            return entry.snapshot if entry is not None else None
+
+    def timeline(self, device_id, start, end, width=None):
+        """Downsampled state timelines of a snapshot, cached per room, range and width"""
+        from timeline import build_timeline, TIMELINE_WIDTH
+
+        width = width or TIMELINE_WIDTH
+        def compute(snap, start_ns, end_ns):
+            return build_timeline(snap.telemetry, start_ns, end_ns, width)
+        return self._derived(device_id, start, end, ("timeline", width), compute)
+
+    def energy(self, device_id, start, end):
+        """Energy use, cost and anomalies of a snapshot (energy.compute_energy), cached per room and range"""
+        from energy import compute_energy
+
+        def compute(snap, start_ns, end_ns):
+            return compute_energy({device_id: snap.telemetry}, until=end_ns)
+        return self._derived(device_id, start, end, ("energy",), compute)
+
+    def _derived(self, device_id, start, end, key, compute):
+        """compute(snapshot, start_ns, end_ns) for the current snapshot, recomputed only when
+        its version changes, so every session viewing the same range shares one pass"""
+        from timeutils import to_epoch_ns
+
+        snap = self.snapshot(device_id, start, end)
+        with self._lock:
+            entry = self._entries.get((device_id, start, end))
+            cached = entry.derived.get(key) if entry is not None else None
+        if cached is not None and cached[0] == snap.version:
+            return cached[1]
+
+        # Ranges ending in the future stop at now: state still on is counted up to now
+        now = time.time_ns()
+        start_ns = int(to_epoch_ns([to_timestamp(start)])[0]) if start else 0
+        end_ns = min(int(to_epoch_ns([to_timestamp(end)])[0]), now) if end else now
+        with ANALYTICS_COMPUTE_SECONDS.labels(key[0]).time():
+            result = compute(snap, start_ns, end_ns)
+        if entry is not None:
+            with self._lock:
+                entry.derived[key] = (snap.version, result)
+        return result
+
+    def metrics(self):
+        with self._lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {
+                "requests": requests,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / requests if requests else 0,
+                "fetches": self.fetches,
+                "fetch_errors": self.fetch_errors,
+                "last_fetch_seconds": self.last_fetch_seconds,
+                "avg_fetch_seconds": self.total_fetch_seconds / self.fetches if self.fetches else 0,
+                "max_fetch_seconds": self.max_fetch_seconds,
+                "keys": len(self._entries),
+                "rooms": len(self._loops)
+            }
+
+    # ================= FETCH =================
+    def _fresh(self, entry):
+        snap = entry.snapshot
+        if snap is None:
+            return False
+        if self.feed.healthy:
+            return snap.feed_version == self.feed.version(snap.device_id)
+        return time.monotonic() - snap.fetched_at < self.max_age
+
+    def _fetch(self, key, entry):
+        device_id, start, end = key
+        started = time.monotonic()
+        try:
+            feed_version = self.feed.version(device_id)
+            telemetry = get_telemetry(device_id=device_id, start=start, end=end)
+            events = get_events(device_id=device_id, start=start, end=end)
+            with ANALYTICS_COMPUTE_SECONDS.labels("kpis").time():
+                kpis = entry.kpi_state.update(telemetry, events).snapshot()
+
+            version = entry.snapshot.version + 1 if entry.snapshot else 1
+            entry.snapshot = Snapshot(
+                version=version,
+                device_id=device_id,
+                start=start,
+                end=end,
+                telemetry=tuple(telemetry),
+                events=tuple(events),
+                kpis=MappingProxyType(kpis),
+                feed_version=feed_version,
+                fetched_at=time.monotonic()
+            )
+            entry.error = None
+            if telemetry:
+                self._persist(entry.snapshot)
+            return entry.snapshot
+        except Exception as e:
+            entry.error = str(e)
+            with self._lock:
+                self.fetch_errors += 1
+            if entry.snapshot is None:
+                raise
+            return entry.snapshot
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.fetches += 1
+                self.last_fetch_seconds = elapsed
+                self.total_fetch_seconds += elapsed
+                self.max_fetch_seconds = max(self.max_fetch_seconds, elapsed)
+                done, entry.inflight = entry.inflight, None
+            if done is not None:
+                done.set()
+
+    def _persist(self, snap):
+        """Save the overview for the next cold start, off the request path"""
+        if kpi_store.due(snap.device_id, snap.start, snap.end):
+            threading.Thread(target=kpi_store.save, name="kpi-snapshot", daemon=True,
+                             args=(snap.device_id, snap.start, snap.end, dict(snap.kpis),
+                                   snap.telemetry[-1])).start()
+
+    # ================= ROOM LOOPS =================
+    def _ensure_loop(self, device_id):
+        if device_id not in self._loops and self.feed.healthy:
+            t = threading.Thread(target=self._room_loop, args=(device_id,),
+                                 name=f"data-{device_id}", daemon=True)
+            self._loops[device_id] = t
+            t.start()
+
+    def _room_loop(self, device_id):
+        """Refresh this room's snapshots as soon as the live feed sees new data"""
+        seen = self.feed.version(device_id)
+        while True:
+            seen = self.feed.wait_for_change(device_id, seen, timeout=60)
+            now = time.monotonic()
+            with self._lock:
+                for key in [k for k, e in self._entries.items()
+                            if k[0] == device_id and now - e.last_request > IDLE_KEY_SECONDS]:
+                    del self._entries[key]
+                keys = [k for k in self._entries if k[0] == device_id]
+            for key in keys:
+                try:
+                    self.snapshot(*key, _touch=False)
+                except Exception as e:
+                    log.warning("Background refresh failed", device_id=device_id, error=str(e),
+                                sample=f"refresh-{device_id}")
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_data_service():
+    """The container-wide DataService"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = DataService()
+        return _service
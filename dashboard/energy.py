@@ -0,0 +1,355 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analytics_engine import to_frame, NS_PER_SECOND, SECONDS_PER_DAY
+from timeutils import DISPLAY_TZ, to_epoch_ns
+
+# Rated power of each switched device, in watts
+DEVICE_WATTS = {
+    "fan": float(os.environ.get("FAN_WATTS", 50)),
+    "led": float(os.environ.get("LED_WATTS", 10)),
+}
+# Time-of-use tariff as JSON, {"weekday": [[hour, price per kWh], ...], "weekend": [...]},
+# each list starting at hour 0 (weekend defaults to weekday); otherwise one flat price
+ENERGY_TARIFF = os.environ.get("ENERGY_TARIFF", "")
+ENERGY_PRICE_PER_KWH = float(os.environ.get("ENERGY_PRICE_PER_KWH", 0.25))
+
+# Manual overrides expire after this long (overrideDuration in the firmware)
+OVERRIDE_TIMEOUT_SECONDS = 15
+# Loop delays and device clock jitter allowed on top of it
+OVERRIDE_TOLERANCE_SECONDS = 2
+# A device left on in an empty room for longer than this is flagged
+EMPTY_ROOM_GRACE_SECONDS = float(os.environ.get("EMPTY_ROOM_GRACE_SECONDS", 60))
+
+NS_PER_DAY = SECONDS_PER_DAY * NS_PER_SECOND
+# Weekend days among the first r days of a week starting on a Thursday (1970-01-01)
+WEEKENDS_BEFORE = np.concatenate(([0], np.cumsum(np.isin((np.arange(6) + 3) % 7, (5, 6)))))
+
+INTERVAL_COLUMNS = ["room", "start", "end", "open"]
+
+
+class Tariff:
+    """Time-of-use electricity price per kWh, by local hour of day.
+
+    weekday and weekend are [(hour, price), ...] starting at hour 0, each
+    price holding until the next hour listed. Costs integrate the price over
+    the local wall clock, so an interval crossing a period or midnight is
+    charged at each rate for the part it spends there.
+    """
+
+    def __init__(self, weekday, weekend=None, tz=DISPLAY_TZ):
+        self.tz = tz
+        self.weekday = self._table(weekday)
+        self.weekend = self._table(weekend or weekday)
+
+    @classmethod
+    def flat(cls, price, tz=DISPLAY_TZ):
+        return cls([(0, price)], tz=tz)
+
+    @classmethod
+    def from_json(cls, text, tz=DISPLAY_TZ):
+        spec = json.loads(text)
+        return cls(spec["weekday"], spec.get("weekend"), tz=tz)
+
+    @staticmethod
+    def _table(periods):
+        periods = sorted((float(hour), float(price)) for hour, price in periods)
+        if not periods or periods[0][0] != 0:
+            raise ValueError("A tariff schedule must start at hour 0")
+        starts = np.array([hour * 3600 for hour, _ in periods])
+        prices = np.array([price for _, price in periods])
+        lengths = np.diff(np.append(starts, SECONDS_PER_DAY))
+        # Price-seconds accumulated at each period start; the last entry is a whole day
+        return starts, prices, np.concatenate(([0.0], np.cumsum(prices * lengths)))
+
+    def local_ns(self, ns):
+        """UTC epoch ns -> local wall-clock ns"""
+        local = pd.to_datetime(np.asarray(ns, dtype=np.int64), utc=True).tz_convert(self.tz).tz_localize(None)
+        return local.to_numpy("datetime64[ns]").astype(np.int64)
+
+    def _integral(self, local_ns):
+        """Price-seconds from the local epoch up to each local time"""
+        day, offset = np.divmod(local_ns, NS_PER_DAY)
+        seconds = offset / NS_PER_SECOND
+        weekends = (day // 7) * 2 + WEEKENDS_BEFORE[day % 7]
+        whole_days = (day - weekends) * self.weekday[2][-1] + weekends * self.weekend[2][-1]
+        is_weekend = np.isin((day + 3) % 7, (5, 6))
+        return whole_days + np.where(is_weekend, self._within(self.weekend, seconds),
+                                     self._within(self.weekday, seconds))
+
+    @staticmethod
+    def _within(table, seconds):
+        starts, prices, cumulative = table
+        i = np.searchsorted(starts, seconds, side="right") - 1
+        return cumulative[i] + prices[i] * (seconds - starts[i])
+
+    def cost_local(self, start, end, kw):
+        """Cost of drawing kw over each local-time [start, end)"""
+        return kw * (self._integral(end) - self._integral(start)) / 3600
+
+    def cost(self, start, end, kw):
+        """Cost of drawing kw over each [start, end) in UTC epoch ns"""
+        return self.cost_local(self.local_ns(start), self.local_ns(end), kw)
+
+
+TARIFF = Tariff.from_json(ENERGY_TARIFF) if ENERGY_TARIFF else Tariff.flat(ENERGY_PRICE_PER_KWH)
+
+
+# =========================================================
+# INTERVALS
+# =========================================================
+def room_frame(data):
+    """Telemetry of many rooms as one frame sorted by room and time.
+
+    data is {device_id: records or columns}, or columns with a "device_id"
+    column (e.g. firestore_client.get_history without a room). Returns the
+    frame, whose "room" column indexes the returned list of room ids.
+    """
+    if "timestamp" in data:
+        frame = to_frame(data)
+        rooms, codes = np.unique(np.asarray(data["device_id"], dtype=str), return_inverse=True)
+        rooms = rooms.tolist()
+    else:
+        rooms = sorted(data)
+        frames = [to_frame(data[room]) for room in rooms]
+        codes = np.repeat(np.arange(len(rooms)), [len(f) for f in frames])
+        frame = pd.concat(frames, ignore_index=True) if frames else to_frame([])
+    frame["room"] = codes.astype(np.int64)
+    return frame.sort_values(["room", "ts"], kind="stable", ignore_index=True), rooms
+
+
+def _as_ns(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return int(to_epoch_ns([value])[0])
+
+
+def runs(frame, mask, until=None):
+    """Runs of consecutive rows where mask is true, per room.
+
+    Returns room, start, end (epoch ns) and open. A run ends at the row that
+    ends it; one still going at the room's last row is open and lasts until
+    `until` (default: that row).
+    """
+    if len(frame) == 0:
+        return pd.DataFrame({c: np.zeros(0, dtype=bool if c == "open" else np.int64) for c in INTERVAL_COLUMNS})
+    room = frame["room"].to_numpy()
+    ts = frame["ts"].to_numpy()
+    mask = np.asarray(mask, dtype=bool)
+
+    first = np.r_[True, room[1:] != room[:-1]]
+    last = np.r_[first[1:], True]
+    starts = np.flatnonzero(mask & ~(np.r_[False, mask[:-1]] & ~first))
+    ends = np.flatnonzero(mask & ~(np.r_[mask[1:], False] & ~last))
+    is_open = last[ends]
+    closed_end = ts[np.minimum(ends + 1, len(ts) - 1)]
+    open_end = ts[ends] if until is None else np.maximum(ts[ends], until)
+    return pd.DataFrame({
+        "room": room[starts],
+        "start": ts[starts],
+        "end": np.where(is_open, open_end, closed_end),
+        "open": is_open,
+    })
+
+
+def overlap(a, b):
+    """Intersection of two interval tables, per room, in one vectorized pass.
+
+    a and b hold room, start, end, open with no overlaps inside a table for
+    the same room (runs() never produces any). The boundaries of both are
+    swept in (room, time) order with a running depth per table; the spans
+    where both depths are positive form the result. An interval is open if
+    the intervals of a and b that contain it are both open and end with it.
+    """
+    n_a, n_b = len(a), len(b)
+    room = np.concatenate([a["room"], a["room"], b["room"], b["room"]]).astype(np.int64)
+    time = np.concatenate([a["start"], a["end"], b["start"], b["end"]]).astype(np.int64)
+    is_start = np.concatenate([np.ones(n_a, bool), np.zeros(n_a, bool), np.ones(n_b, bool), np.zeros(n_b, bool)])
+    in_a = np.concatenate([np.ones(2 * n_a, bool), np.zeros(2 * n_b, bool)])
+
+    # Ends sort before starts at the same instant, so touching intervals do not overlap
+    order = np.lexsort((is_start, time, room))
+    room, time, is_start, in_a = room[order], time[order], is_start[order], in_a[order]
+    step = np.where(is_start, 1, -1)
+    both = (np.cumsum(np.where(in_a, step, 0)) > 0) & (np.cumsum(np.where(in_a, 0, step)) > 0)
+
+    seg = np.flatnonzero(both[:-1] & (room[1:] == room[:-1]) & (time[1:] > time[:-1]))
+    seg_room, seg_start, seg_end = room[seg], time[seg], time[seg + 1]
+    # Glue spans split only by a zero-length gap (an interval ending where the next starts)
+    new = np.r_[True, (seg_room[1:] != seg_room[:-1]) | (seg_start[1:] != seg_end[:-1])] if len(seg) else np.zeros(0, bool)
+    group_first = np.flatnonzero(new)
+    group_last = np.r_[group_first[1:] - 1, len(seg) - 1].astype(np.int64) if len(seg) else group_first
+
+    result = pd.DataFrame({
+        "room": seg_room[group_first],
+        "start": seg_start[group_first],
+        "end": seg_end[group_last],
+    })
+    # Open only if the input intervals holding its last instant both run on past it
+    result["open"] = _open_through(result, a) & _open_through(result, b)
+    return result
+
+
+def _open_through(result, table):
+    """Per result interval: True if the interval of table containing its last instant is open and ends with it"""
+    if not len(result) or not len(table):
+        return np.zeros(len(result), bool)
+    last = pd.DataFrame({"room": result["room"].to_numpy().astype(np.int64),
+                         "at": result["end"].to_numpy().astype(np.int64) - 1,
+                         "row": np.arange(len(result))}).sort_values("at")
+    holder = pd.DataFrame({"room": table["room"].to_numpy().astype(np.int64),
+                           "at": table["start"].to_numpy().astype(np.int64),
+                           "holder_end": table["end"].to_numpy().astype(np.int64),
+                           "holder_open": table["open"].to_numpy()}).sort_values("at")
+    found = pd.merge_asof(last, holder, on="at", by="room", direction="backward")
+    is_open = found["holder_open"].fillna(False).astype(bool) & (found["holder_end"] == found["at"] + 1)
+    flags = np.zeros(len(result), bool)
+    flags[found["row"].to_numpy()] = is_open.to_numpy()
+    return flags
+
+
+# =========================================================
+# ENERGY
+# =========================================================
+def energy_by_room(frame, rooms, until=None, watts=None, tariff=None):
+    """kWh, hours and cost per room and device: one row per room"""
+    watts = watts or DEVICE_WATTS
+    tariff = tariff or TARIFF
+    report = pd.DataFrame(index=pd.Index(rooms, name="device_id"))
+    report["kwh"] = 0.0
+    report["cost"] = 0.0
+    for device, w in watts.items():
+        iv = runs(frame, frame[device].to_numpy() == 1, until)
+        room = iv["room"].to_numpy()
+        hours = (iv["end"] - iv["start"]).to_numpy() / NS_PER_SECOND / 3600
+        cost = tariff.cost(iv["start"].to_numpy(), iv["end"].to_numpy(), w / 1000) if len(iv) else hours
+        report[f"{device}_hours"] = np.bincount(room, hours, minlength=len(rooms))
+        report[f"{device}_kwh"] = report[f"{device}_hours"] * w / 1000
+        report[f"{device}_cost"] = np.bincount(room, cost, minlength=len(rooms))
+        report["kwh"] += report[f"{device}_kwh"]
+        report["cost"] += report[f"{device}_cost"]
+    return report
+
+
+def split_days(start_local, end_local):
+    """Cut local-time intervals at midnight: (index of the source interval, piece start, piece end)"""
+    first_day = start_local // NS_PER_DAY
+    last_day = np.maximum(end_local - 1, start_local) // NS_PER_DAY
+    pieces = (last_day - first_day + 1).astype(np.int64)
+    source = np.repeat(np.arange(len(start_local)), pieces)
+    day = first_day[source] + (np.arange(len(source)) - np.repeat(np.cumsum(pieces) - pieces, pieces))
+    return (source,
+            np.maximum(start_local[source], day * NS_PER_DAY),
+            np.minimum(end_local[source], (day + 1) * NS_PER_DAY))
+
+
+def energy_by_day(frame, rooms, until=None, watts=None, tariff=None):
+    """kWh, hours and cost per room, local calendar day and device"""
+    watts = watts or DEVICE_WATTS
+    tariff = tariff or TARIFF
+    parts = []
+    for device, w in watts.items():
+        iv = runs(frame, frame[device].to_numpy() == 1, until)
+        if not len(iv):
+            continue
+        source, start, end = split_days(tariff.local_ns(iv["start"].to_numpy()),
+                                        tariff.local_ns(iv["end"].to_numpy()))
+        hours = (end - start) / NS_PER_SECOND / 3600
+        parts.append(pd.DataFrame({
+            "room": iv["room"].to_numpy()[source],
+            "date": start // NS_PER_DAY,
+            "device": device,
+            "hours": hours,
+            "kwh": hours * w / 1000,
+            "cost": tariff.cost_local(start, end, w / 1000),
+        }))
+    if not parts:
+        return pd.DataFrame(columns=["device_id", "date", "device", "hours", "kwh", "cost"])
+    daily = pd.concat(parts, ignore_index=True).groupby(["room", "date", "device"], as_index=False).sum()
+    daily.insert(0, "device_id", np.asarray(rooms, dtype=object)[daily.pop("room").to_numpy()])
+    daily["date"] = pd.to_datetime(daily["date"] * NS_PER_DAY).dt.date
+    return daily
+
+
+# =========================================================
+# ANOMALIES
+# =========================================================
+def devices_on_empty(frame, until=None, devices=None, grace=EMPTY_ROOM_GRACE_SECONDS):
+    """Device-on intervals joined with vacancy intervals, kept when longer than grace"""
+    vacant = runs(frame, frame["occupied"].to_numpy() != 1, until)
+    found = []
+    for device in devices or DEVICE_WATTS:
+        both = overlap(runs(frame, frame[device].to_numpy() == 1, until), vacant)
+        both = both[(both["end"] - both["start"]) > grace * NS_PER_SECOND]
+        found.append(both.assign(kind="device_on_empty", device=device))
+    return pd.concat(found, ignore_index=True)
+
+
+def late_overrides(frame, devices=None, timeout=OVERRIDE_TIMEOUT_SECONDS, tolerance=OVERRIDE_TOLERANCE_SECONDS):
+    """Manual overrides still reported after the firmware should have cleared them.
+
+    The firmware does not publish when an override expires, so only a row
+    that still says <device>_override = 1 more than timeout + tolerance
+    after the button press counts. A press toggles the device, so a row
+    where the device changed under an active override is a new press.
+    """
+    room = frame["room"].to_numpy()
+    ts = frame["ts"].to_numpy()
+    first = np.r_[True, room[1:] != room[:-1]] if len(frame) else np.zeros(0, bool)
+    found = []
+    for device in devices or DEVICE_WATTS:
+        active = frame[f"{device}_override"].to_numpy() == 1
+        value = frame[device].to_numpy()
+        prev_active = np.r_[False, active[:-1]] & ~first
+        changed = np.r_[False, value[1:] != value[:-1]] & ~first
+        press = active & (~prev_active | changed)
+        # Index of the latest press at every row (rows before the first press get 0 and are inactive)
+        pressed_at = np.maximum.accumulate(np.where(press, np.arange(len(ts)), 0))
+        late = active & (ts - ts[pressed_at] > (timeout + tolerance) * NS_PER_SECOND)
+        rows = np.flatnonzero(late)
+        holds, last = np.unique(pressed_at[rows][::-1], return_index=True)
+        last_row = rows[::-1][last]
+        found.append(pd.DataFrame({
+            "room": room[holds],
+            "start": ts[holds],
+            "end": ts[last_row],
+            "open": np.zeros(len(holds), bool),
+            "kind": "override_timeout",
+            "device": device,
+        }))
+    return pd.concat(found, ignore_index=True)
+
+
+def find_anomalies(frame, rooms, until=None, devices=None):
+    """Devices left on in empty rooms and overrides held past the timeout, longest first"""
+    found = pd.concat([devices_on_empty(frame, until, devices), late_overrides(frame, devices)],
+                      ignore_index=True)
+    found["seconds"] = (found["end"] - found["start"]) // NS_PER_SECOND
+    found.insert(0, "device_id", np.asarray(rooms, dtype=object)[found.pop("room").to_numpy().astype(np.int64)])
+    for column in ("start", "end"):
+        found[column] = pd.to_datetime(found[column].astype(np.int64), utc=True)
+    return found[["device_id", "kind", "device", "start", "end", "seconds", "open"]] \
+        .sort_values("seconds", ascending=False, ignore_index=True)
+
+
+def compute_energy(data, until=None, watts=None, tariff=None):
+    """Energy and anomaly report for any number of rooms in one batch pass.
+
+    data is what room_frame() takes. until (datetime, ISO string or epoch
+    ns) closes intervals still open at each room's last row; pass "now" for
+    live data. Returns {"rooms": per-room totals, "daily": per room, day and
+    device, "anomalies": one row per finding}.
+    """
+    frame, rooms = room_frame(data)
+    until = _as_ns(until)
+    return {
+        "rooms": energy_by_room(frame, rooms, until, watts, tariff),
+        "daily": energy_by_day(frame, rooms, until, watts, tariff),
+        "anomalies": find_anomalies(frame, rooms, until, list((watts or DEVICE_WATTS).keys())),
+    }
@@ -1,34 +1,472 @@
 import os
-from google.cloud import firestore
-from google.oauth2 import service_account
-import google.auth
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from monitoring import record_read, DOCUMENTS_PER_REFRESH
+import cold_store
 
 PROJECT_ID = "gcp-project-id"
 DATABASE_ID = "firestrore-database-id"
 
-if os.path.exists("firestore-key.json"):
-    # Local development
-    credentials = service_account.Credentials.from_service_account_file(
-        "firestore-key.json"
+# Only documents newer than this are kept in the process-wide cache
+CACHE_RETENTION_DAYS = float(os.environ.get("CACHE_RETENTION_DAYS", 30))
+# Sessions refreshing within this window share one Firestore read
+CACHE_MIN_REFRESH_SECONDS = float(os.environ.get("CACHE_MIN_REFRESH_SECONDS", 1))
+# Firestore commit time the ingester's writers store with every document
+# (pythonSubscriber/batch_writer.py): a refresh reads only the documents
+# committed after the newest one cached, however old their timestamps are
+COMMITTED = "committed"
+# Documents from writers that predate COMMITTED carry none; until one that has
+# it is read, a refresh re-reads this far behind the newest timestamp seen
+CACHE_REFRESH_OVERLAP_SECONDS = float(os.environ.get("CACHE_REFRESH_OVERLAP_SECONDS", 120))
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def _connect():
+    if os.environ.get("FAKE_FIRESTORE") == "1":
+        # Local runs and benchmarks, with pythonSubscriber/ on PYTHONPATH
+        from fake_firestore import FakeClient
+        return FakeClient()
+
+    from google.cloud import firestore
+    if os.path.exists("firestore-key.json"):
+        # Local development
+        from google.oauth2 import service_account
+        credentials = service_account.Credentials.from_service_account_file(
+            "firestore-key.json"
+        )
+    else:
+        # Cloud Run (ADC)
+        import google.auth
+        credentials, _ = google.auth.default()
+
+    return firestore.Client(
+        project=PROJECT_ID,
+        credentials=credentials,
+        database=DATABASE_ID
     )
-else:
-    # Cloud Run (ADC)
-    credentials, _ = google.auth.default()
-
-db = firestore.Client(
-    project=PROJECT_ID,
-    credentials=credentials,
-    database=DATABASE_ID
-)
-
-def get_telemetry():
-    docs = db.collection("room_telemetry") \
-             .order_by("timestamp") \
-             .stream()
-    return [d.to_dict() for d in docs]
-
-def get_events():
-    docs = db.collection("room_events") \
-             .order_by("timestamp") \
-             .stream()
-    return [d.to_dict() for d in docs]
+
+
+def get_db():
+    """The Firestore client, created on first use rather than at import.
+
+    Importing the client library and resolving credentials take a good part
+    of a cold start, and the first paint does not need them.
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = _connect()
+    return _db
+
+
+def __getattr__(name):
+    # firestore_client.db / from firestore_client import db still work
+    if name == "db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _descending(descending=True):
+    from google.cloud import firestore
+    return firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+
+# =========================================================
+# INCREMENTAL COLLECTION CACHE
+# =========================================================
+class CollectionCache:
+    """Columnar copy of one collection ordered by timestamp.
+
+    The first refresh reads the retention window; later ones read only the
+    documents committed after the newest commit time cached (COMMITTED), so
+    their cost is the number of new documents, not history. A document that
+    committed late, behind rows already read (a spool replaying a backlog),
+    is still read once and inserted in timestamp order. Rows are also kept
+    in arrival order for readers that follow the new ones (added_since).
+    """
+
+    def __init__(self, collection, device_id=None, retention_days=CACHE_RETENTION_DAYS,
+                 min_refresh_seconds=CACHE_MIN_REFRESH_SECONDS, overlap_seconds=CACHE_REFRESH_OVERLAP_SECONDS):
+        self.collection = collection
+        self.device_id = device_id
+        self.retention_days = retention_days
+        self.min_refresh_seconds = min_refresh_seconds
+        self.overlap_seconds = overlap_seconds
+
+        self.ids = []
+        self._id_set = set()
+        self.timestamps = []
+        self.columns = {}
+        self._rows = []
+        self.rooms = Counter()   # device_id -> cached documents
+        self.cursor = None       # newest timestamp cached
+        self.committed = None    # newest commit time read
+        self._arrived = deque()  # rows in the order they were cached
+        self._arrived_base = 0   # rows dropped from the front of _arrived
+        self.last_refresh = 0.0
+        self.docs_read = 0
+        self.late_docs = 0
+        self._lock = threading.Lock()
+
+    def horizon(self):
+        if not self.retention_days:
+            return None
+        return (datetime.utcnow() - timedelta(days=self.retention_days)).isoformat()
+
+    def refresh(self, force=False):
+        """Fetch the documents committed since the last refresh and evict expired ones"""
+        with self._lock:
+            if not force and time.monotonic() - self.last_refresh < self.min_refresh_seconds:
+                return 0
+
+            query = get_db().collection(self.collection)
+            if self.device_id:
+                query = query.where("device_id", "==", self.device_id)
+            if self.committed is not None:
+                query = query.where(COMMITTED, ">", self.committed).order_by(COMMITTED)
+            else:
+                lower = overlap_start(self.cursor, self.overlap_seconds) if self.cursor else self.horizon()
+                if lower:
+                    query = query.where("timestamp", ">=", lower)
+                query = query.order_by("timestamp")
+            started = time.perf_counter()
+
+            read = added = 0
+            for d in query.stream():
+                read += 1
+                added += self._append(d.id, d.to_dict())
+
+            record_read(self.collection, "refresh", started, read)
+            DOCUMENTS_PER_REFRESH.labels(self.collection).observe(read)
+            self.docs_read += read
+            self.last_refresh = time.monotonic()
+            self._evict()
+            return added
+
+    def added_since(self, arrival):
+        """(rows cached after the first `arrival` ones in arrival order, rows cached so far)"""
+        self.refresh()
+        with self._lock:
+            skip = max(0, arrival - self._arrived_base)
+            return list(islice(self._arrived, skip, None)), self._arrived_base + len(self._arrived)
+
+    def arrivals(self):
+        """Rows cached so far, the arrival to pass to added_since for what comes next"""
+        with self._lock:
+            return self._arrived_base + len(self._arrived)
+
+    def covers(self, start):
+        """True if the cache holds every document at or after start (None = retention window)"""
+        horizon = self.horizon()
+        return start is None or horizon is None or start >= horizon
+
+    def records(self, start=None, end=None, limit=None):
+        """Cached rows as dicts, oldest first, optionally sliced to [start, end)"""
+        self.refresh()
+        with self._lock:
+            lo = bisect_left(self.timestamps, start) if start else 0
+            hi = bisect_left(self.timestamps, end) if end else len(self._rows)
+            if limit:
+                lo = max(lo, hi - limit)
+            return self._rows[lo:hi]
+
+    def column_slice(self, start=None, end=None, columns=None):
+        """Cached columns of [start, end) as lists, like records() without a dict per row"""
+        self.refresh()
+        with self._lock:
+            lo = bisect_left(self.timestamps, start) if start else 0
+            hi = bisect_left(self.timestamps, end) if end else len(self._rows)
+            keys = [*self.columns, "id"] if columns is None else columns
+            sliced = {}
+            for key in dict.fromkeys(["timestamp", *keys]):
+                column = self.ids if key == "id" else self.columns.get(key)
+                sliced[key] = column[lo:hi] if column is not None else [None] * (hi - lo)
+            return sliced
+
+    def _append(self, doc_id, data):
+        committed = data.pop(COMMITTED, None)
+        if committed is not None and (self.committed is None or committed > self.committed):
+            self.committed = committed
+        if doc_id in self._id_set:
+            return False
+        timestamp = data.get("timestamp", "")
+        n = len(self.ids)
+        for key in data:
+            if key not in self.columns:
+                self.columns[key] = [None] * n
+
+        data["id"] = doc_id
+        if not n or timestamp >= self.timestamps[-1]:
+            for key, column in self.columns.items():
+                column.append(data.get(key))
+            self.ids.append(doc_id)
+            self.timestamps.append(timestamp)
+            self._rows.append(data)
+        else:
+            # Committed late: after the rows stamped no later than it
+            i = bisect_right(self.timestamps, timestamp)
+            for key, column in self.columns.items():
+                column.insert(i, data.get(key))
+            self.ids.insert(i, doc_id)
+            self.timestamps.insert(i, timestamp)
+            self._rows.insert(i, data)
+            self.late_docs += 1
+        self._id_set.add(doc_id)
+        self._arrived.append(data)
+        self.rooms[data.get("device_id")] += 1
+        if self.cursor is None or timestamp > self.cursor:
+            self.cursor = timestamp
+        return True
+
+    def _evict(self):
+        horizon = self.horizon()
+        if horizon is None:
+            return
+        while self._arrived and self._arrived[0].get("timestamp", "") < horizon:
+            self._arrived.popleft()
+            self._arrived_base += 1
+        cut = bisect_left(self.timestamps, horizon)
+        if cut == 0:
+            return
+        self._id_set.difference_update(self.ids[:cut])
+        self.rooms.subtract(r.get("device_id") for r in self._rows[:cut])
+        self.rooms += Counter()  # drop rooms with nothing left
+        del self.ids[:cut]
+        del self.timestamps[:cut]
+        del self._rows[:cut]
+        for column in self.columns.values():
+            del column[:cut]
+
+
+def overlap_start(cursor, seconds=CACHE_REFRESH_OVERLAP_SECONDS):
+    """The timestamp `seconds` before cursor"""
+    try:
+        return (datetime.fromisoformat(cursor) - timedelta(seconds=seconds)).isoformat()
+    except ValueError:
+        return cursor
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(collection, device_id=None):
+    """Process-wide cache per collection and room, shared by every Streamlit session"""
+    key = (collection, device_id)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = CollectionCache(collection, device_id)
+        return _caches[key]
+
+def invalidate(collection, device_id=None):
+    """Make the next read of these caches go to Firestore (used by the live feed)"""
+    with _caches_lock:
+        caches = [c for (name, room), c in _caches.items()
+                  if name == collection and room in (None, device_id)]
+    for cache in caches:
+        cache.last_refresh = 0.0
+
+def list_rooms(collection="room_telemetry", load=True):
+    """Rooms with documents in the cache window, read from the all-rooms cache.
+
+    With load=False nothing is read: an all-rooms cache that was never
+    filled gives None, so callers can fall back to a saved list.
+    """
+    cache = get_cache(collection)
+    if load:
+        cache.refresh()
+    elif not cache.ids:
+        return None
+    with cache._lock:
+        return sorted(room for room in cache.rooms if room)
+
+# =========================================================
+# QUERIES
+# =========================================================
+def to_timestamp(value):
+    """Convert a date/datetime bound into the stored naive-UTC ISO format"""
+    if value is None or isinstance(value, str):
+        return value
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+def query_collection(collection, device_id=None, start=None, end=None, limit=None):
+    """Run the filters in Firestore (see firestore.indexes.json for the indexes)"""
+    query = get_db().collection(collection)
+    if device_id:
+        query = query.where("device_id", "==", device_id)
+    if start:
+        query = query.where("timestamp", ">=", start)
+    if end:
+        query = query.where("timestamp", "<", end)
+
+    started = time.perf_counter()
+    if limit:
+        # Newest `limit` documents, returned oldest first
+        docs = query.order_by("timestamp", direction=_descending()) \
+                    .limit(limit) \
+                    .stream()
+        records = [_with_id(d) for d in docs][::-1]
+    else:
+        docs = query.order_by("timestamp").stream()
+        records = [_with_id(d) for d in docs]
+    record_read(collection, "range", started, len(records))
+    return records
+
+def _with_id(doc):
+    data = doc.to_dict()
+    data.pop(COMMITTED, None)
+    data["id"] = doc.id
+    return data
+
+def fetch(collection, device_id=None, start=None, end=None, limit=None):
+    start, end = to_timestamp(start), to_timestamp(end)
+    cache = get_cache(collection, device_id)
+    if cache.covers(start):
+        return cache.records(start, end, limit)
+    cold_before = cold_store.watermark(collection)
+    if cold_before and (start is None or start < cold_before):
+        # Archived days come from Parquet, the rest from the cache or Firestore
+        hot = fetch(collection, device_id, cold_before, end, limit) \
+            if end is None or end > cold_before else []
+        if limit and len(hot) >= limit:
+            return hot
+        cold = cold_store.read_records(collection, device_id, start, end,
+                                       limit - len(hot) if limit else None)
+        return cold + hot
+    # Older than the cache retention: go to Firestore directly
+    return query_collection(collection, device_id, start, end, limit)
+
+def get_history(collection, device_id=None, start=None, end=None, columns=None):
+    """Columns of [start, end) across the Parquet archive and Firestore, oldest first.
+
+    For long reports: archived days are read with only the requested columns
+    and the room and time filters pushed down, then the newer rows from the
+    cache or Firestore are appended. The result feeds analytics_engine.
+    """
+    start, end = to_timestamp(start), to_timestamp(end)
+    cold_before = cold_store.watermark(collection)
+    history = {}
+    if cold_before and (start is None or start < cold_before):
+        history = cold_store.read_columns(collection, device_id, start, end, columns)
+        start = max(start, cold_before) if start else cold_before
+    if end is not None and start is not None and start >= end:
+        return history
+
+    cache = get_cache(collection, device_id)
+    if cache.covers(start):
+        hot = cache.column_slice(start, end, columns)
+    else:
+        rows = fetch(collection, device_id, start, end)
+        keys = columns if columns is not None else {k for r in rows for k in r}
+        hot = {key: [r.get(key) for r in rows] for key in dict.fromkeys(["timestamp", *keys])}
+    n = len(history.get("timestamp", []))
+    m = len(hot["timestamp"])
+    for key in dict.fromkeys(["timestamp", *history, *hot]):
+        history.setdefault(key, [None] * n).extend(hot.get(key) or [None] * m)
+    return history
+
+def get_telemetry(device_id=None, start=None, end=None, limit=None):
+    return fetch("room_telemetry", device_id, start, end, limit)
+
+def get_events(device_id=None, start=None, end=None, limit=None):
+    return fetch("room_events", device_id, start, end, limit)
+
+# =========================================================
+# PAGINATED EVENT LOG
+# =========================================================
+PAGE_CACHE_SIZE = 256
+# First pages and partial last pages still change as events arrive
+PAGE_CACHE_TTL_SECONDS = 5
+
+_page_cache = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+def get_events_page(device_id=None, page_size=50, cursor=None, descending=True,
+                    event_types=None, start=None, end=None):
+    """One page of room_events and the cursor (last document id) of the next page.
+
+    Only the requested page is read from Firestore; pages are cached by
+    filters and cursor, and the next page starts after the cached last
+    document snapshot instead of re-reading the log.
+    """
+    start, end = to_timestamp(start), to_timestamp(end)
+    event_types = tuple(sorted(event_types)) if event_types else None
+    filters = (device_id, page_size, descending, event_types, start, end)
+
+    with _page_cache_lock:
+        cached = _page_cache.get((filters, cursor))
+        if cached and (not cached["volatile"] or time.monotonic() < cached["expires"]):
+            _page_cache.move_to_end((filters, cursor))
+            return cached["events"], cached["next_cursor"]
+        after = _page_cache.get((filters, "snapshot", cursor))
+
+    query = get_db().collection("room_events")
+    if device_id:
+        query = query.where("device_id", "==", device_id)
+    if event_types:
+        query = query.where("event", "in", list(event_types))
+    if start:
+        query = query.where("timestamp", ">=", start)
+    if end:
+        query = query.where("timestamp", "<", end)
+    direction = _descending(descending)
+    query = query.order_by("timestamp", direction=direction)
+
+    started = time.perf_counter()
+    if cursor:
+        if after is None:
+            after = get_db().collection("room_events").document(cursor).get()
+        query = query.start_after(after)
+
+    snapshots = list(query.limit(page_size).stream())
+    record_read("room_events", "page", started, len(snapshots))
+    events = [_with_id(d) for d in snapshots]
+    next_cursor = snapshots[-1].id if len(snapshots) == page_size else None
+
+    with _page_cache_lock:
+        _page_cache[(filters, cursor)] = {
+            "events": events,
+            "next_cursor": next_cursor,
+            "volatile": cursor is None or next_cursor is None,
+            "expires": time.monotonic() + PAGE_CACHE_TTL_SECONDS
+        }
+        if next_cursor:
+            _page_cache[(filters, "snapshot", next_cursor)] = snapshots[-1]
+        while len(_page_cache) > PAGE_CACHE_SIZE:
+            _page_cache.popitem(last=False)
+
+    return events, next_cursor
+
+# =========================================================
+# ROLLUPS
+# =========================================================
+ROLLUP_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%dT%H:%M",
+    "hour": "%Y-%m-%dT%H",
+    "day": "%Y-%m-%d",
+}
+
+def get_rollups(device_id, granularity="day", start=None, end=None):
+    """Pre-aggregated room_rollups docs for [start, end), written by the ingester"""
+    fmt = ROLLUP_BUCKET_FORMATS[granularity]
+    query = get_db().collection("room_rollups") \
+              .where("device_id", "==", device_id) \
+              .where("granularity", "==", granularity)
+    if start:
+        query = query.where("bucket", ">=", datetime.fromisoformat(to_timestamp(start)).strftime(fmt))
+    if end:
+        query = query.where("bucket", "<", datetime.fromisoformat(to_timestamp(end)).strftime(fmt))
+    started = time.perf_counter()
+    rollups = [d.to_dict() for d in query.order_by("bucket").stream()]
+    record_read("room_rollups", "rollups", started, len(rollups))
+    return rollups
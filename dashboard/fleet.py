@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from analytics_engine import STATE_COLUMNS, WEIGHT, compute_grouped, grouped_entries, to_frame
+from firestore_client import get_cache, get_history, to_timestamp
+from timeutils import local_hours, to_epoch_ns
+from monitoring import get_logger, ANALYTICS_COMPUTE_SECONDS
+import kpi_store
+
+log = get_logger(__name__)
+
+# Date ranges with a fleet view in memory; each holds the state columns of every room
+FLEET_VIEWS = int(os.environ.get("FLEET_VIEWS", 4))
+# Sessions asking within this window share one refresh
+FLEET_MIN_REFRESH_SECONDS = float(os.environ.get("FLEET_MIN_REFRESH_SECONDS", 1))
+
+COLUMNS = ["ts", *STATE_COLUMNS, WEIGHT]
+# Ingest time of each row: a room's rows are kept in this order, like the cache
+ORDER = "ingest_ns"
+READ_COLUMNS = ["device_id", "id", "device_timestamp", "repeats", *STATE_COLUMNS]
+
+
+class FleetView:
+    """KPIs of every room over one date range, kept per room.
+
+    The first refresh reads the range for all rooms at once (get_history) and
+    computes every room in one grouped pass (analytics_engine.compute_grouped).
+    Later refreshes take only the rows the all-rooms cache added since
+    (CollectionCache.added_since, in commit order, so a row committed late
+    is not missed), add those in the range to their rooms and recompute just
+    those rooms, so a refresh costs the rooms that changed rather than the
+    whole building.
+    """
+
+    def __init__(self, start=None, end=None, min_refresh_seconds=FLEET_MIN_REFRESH_SECONDS):
+        self.start = to_timestamp(start)
+        self.end = to_timestamp(end)
+        self.min_refresh_seconds = min_refresh_seconds
+
+        self.rooms = {}          # room -> {column: array}, rows in ingest order
+        self.kpis = {}           # room -> compute_all-shaped dict
+        self.hours = {}          # room -> entries per hour of day in the display timezone
+        self.version = 0         # bumped whenever a room's KPIs change
+        self.arrival = 0         # rows of the all-rooms cache already taken
+        self._loaded_ids = None  # ids read by the first refresh, until the next one
+        self.loaded = False
+        self.last_refresh = 0.0
+        self.last_refresh_seconds = 0.0
+        self.rooms_recomputed = 0
+        self._saved_rooms = None
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Bring every room up to date; returns the number of rooms recomputed"""
+        with self._lock:
+            if not force and time.monotonic() - self.last_refresh < self.min_refresh_seconds:
+                return 0
+            started = time.perf_counter()
+            if not self.loaded:
+                frame, names = self._load()
+                self.loaded = True
+            else:
+                rows, self.arrival = get_cache("room_telemetry").added_since(self.arrival)
+                frame, names = self._append(rows)
+            if names:
+                with ANALYTICS_COMPUTE_SECONDS.labels("fleet").time():
+                    self.kpis.update(zip(names, compute_grouped(frame, names)))
+                    self.hours.update(zip(names, entry_hours(frame, len(names))))
+                self.version += 1
+                self._remember_rooms()
+
+            self.rooms_recomputed = len(names)
+            self.last_refresh_seconds = time.perf_counter() - started
+            self.last_refresh = time.monotonic()
+            return len(names)
+
+    def tables(self):
+        """(summary, heatmap) frames of the current KPIs, rebuilt only when they change"""
+        self.refresh()
+        with self._lock:
+            if self._tables is None or self._tables[0] != self.version:
+                self._tables = (self.version, summary(self.kpis, self.hours), heatmap(self.hours))
+            return self._tables[1], self._tables[2]
+
+    def _load(self):
+        """Every room's rows of the range, as one frame grouped by room"""
+        cache = get_cache("room_telemetry")
+        cache.refresh()
+        # Rows cached from here on come again from added_since; _loaded_ids skips them
+        self.arrival = cache.arrivals()
+        columns = get_history("room_telemetry", None, self.start, self.end, columns=READ_COLUMNS)
+        n = len(columns["timestamp"])
+        if not n:
+            return None, []
+        frame = to_frame(columns)
+        codes, names = pd.factorize(pd.Series(columns["device_id"], dtype=object))
+        # Stable, so each room keeps its rows in arrival order
+        order = np.argsort(codes, kind="stable")
+        order = order[codes[order] >= 0]
+        frame = frame.iloc[order].reset_index(drop=True)
+        frame["room"] = codes[order]
+        frame[ORDER] = to_epoch_ns(columns["timestamp"])[order]
+
+        bounds = np.searchsorted(frame["room"].to_numpy(), np.arange(len(names) + 1))
+        arrays = {c: frame[c].to_numpy() for c in (*COLUMNS, ORDER)}
+        for i, room in enumerate(names):
+            self.rooms[room] = {c: a[bounds[i]:bounds[i + 1]] for c, a in arrays.items()}
+        self._loaded_ids = set(columns["id"])
+        return frame, list(names)
+
+    def _append(self, records):
+        """Add the new rows of the range to their rooms; the frame of the rooms that changed"""
+        loaded, self._loaded_ids = self._loaded_ids or (), None
+        records = [r for r in records
+                   if (not self.start or r.get("timestamp", "") >= self.start)
+                   and (not self.end or r.get("timestamp", "") < self.end) and r.get("id") not in loaded]
+        by_room = {}
+        for r in records:
+            if r.get("device_id"):
+                by_room.setdefault(r["device_id"], []).append(r)
+        if not by_room:
+            return None, []
+
+        names = sorted(by_room)
+        parts = []
+        for room in names:
+            new = to_frame(by_room[room])
+            new[ORDER] = to_epoch_ns([r["timestamp"] for r in by_room[room]])
+            old = self.rooms.get(room)
+            arrays = {c: new[c].to_numpy() if old is None else np.concatenate((old[c], new[c].to_numpy()))
+                      for c in (*COLUMNS, ORDER)}
+            if old is not None and len(old[ORDER]) and arrays[ORDER][len(old[ORDER])] < old[ORDER][-1]:
+                # A row committed late: put it back in ingest order
+                order = np.argsort(arrays[ORDER], kind="stable")
+                arrays = {c: a[order] for c, a in arrays.items()}
+            self.rooms[room] = arrays
+            parts.append(arrays)
+        frame = pd.DataFrame({c: np.concatenate([p[c] for p in parts]) for c in COLUMNS})
+        frame["room"] = np.repeat(np.arange(len(names)), [len(p["ts"]) for p in parts])
+        return frame, names
+
+    def _remember_rooms(self):
+        """Save the room list for the room selector of the next instance, off the request path"""
+        rooms = sorted(self.rooms)
+        if rooms != self._saved_rooms and kpi_store.due(kpi_store.ROOMS_KEY):
+            self._saved_rooms = rooms
+            threading.Thread(target=kpi_store.save_rooms, args=(rooms,), name="room-list",
+                             daemon=True).start()
+
+
+def entry_hours(frame, n):
+    """Entries per room and hour of day in the display timezone, one row of 24 per room.
+
+    peak_usage_time buckets by UTC hour; shifting that by today's offset is
+    wrong for half-hour zones and across DST, so the entries are converted.
+    """
+    entries = grouped_entries(frame)
+    hours = local_hours(frame["ts"].to_numpy()[entries])
+    room = frame["room"].to_numpy()[entries]
+    return np.bincount(room * 24 + hours, minlength=n * 24).reshape(n, 24)
+
+
+def summary(kpis, hours):
+    """One row of headline KPIs per room, for the sortable fleet table (peak hour local)"""
+    rows = []
+    for room, k in sorted(kpis.items()):
+        peak = hours.get(room)
+        rows.append({
+            "room": room,
+            "entries": k["occupancy_frequency"],
+            "occupied_hours": k["occupancy_duration"]["total_seconds"] / 3600,
+            "fan_hours": k["fan_usage_time"] / 3600,
+            "led_hours": k["led_usage_time"] / 3600,
+            "short_visits": k["occupancy_duration"]["short_visits"],
+            "long_stays": k["occupancy_duration"]["long_stays"],
+            "auto_pct": k["automation_efficiency"]["auto_pct"],
+            "manual_count": k["automation_efficiency"]["manual_count"],
+            "avg_response_seconds": k["system_response_time"]["avg_seconds"],
+            "peak_hour": int(peak.argmax()) if peak is not None and peak.any() else None
+        })
+    return pd.DataFrame(rows, columns=[
+        "room", "entries", "occupied_hours", "fan_hours", "led_hours", "short_visits",
+        "long_stays", "auto_pct", "manual_count", "avg_response_seconds", "peak_hour"
+    ])
+
+
+def heatmap(hours):
+    """Entries per room and hour of day in the display timezone, in long format"""
+    rooms = sorted(hours)
+    counts = np.array([hours[r] for r in rooms], dtype=np.int64).reshape(len(rooms), 24)
+    return pd.DataFrame({
+        "room": np.repeat(rooms, 24),
+        "hour": np.tile(np.arange(24), len(rooms)),
+        "entries": counts.ravel()
+    })
+
+
+_views = OrderedDict()
+_views_lock = threading.Lock()
+
+def get_fleet(start=None, end=None):
+    """The process-wide FleetView of this range, shared by every session"""
+    key = (to_timestamp(start), to_timestamp(end))
+    with _views_lock:
+        if key not in _views:
+            _views[key] = FleetView(start, end)
+            while len(_views) > FLEET_VIEWS:
+                _views.popitem(last=False)
+        _views.move_to_end(key)
+        return _views[key]
@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from firestore_client import get_db, to_timestamp
+from monitoring import get_logger
+
+log = get_logger(__name__)
+
+# Last computed overview (KPIs + latest status) per room, so a new instance
+# can paint before its first Firestore read. Kept as one small Firestore
+# document per room and window, or as JSON files when KPI_SNAPSHOT_DIR is set.
+KPI_SNAPSHOT_DIR = os.environ.get("KPI_SNAPSHOT_DIR", "")
+KPI_SNAPSHOT_COLLECTION = "dashboard_snapshots"
+# A room's snapshot is written at most this often
+KPI_SNAPSHOT_SAVE_SECONDS = float(os.environ.get("KPI_SNAPSHOT_SAVE_SECONDS", 60))
+# Document / file name of the room list (room snapshots are "<room>-<days>d")
+ROOMS_KEY = "rooms"
+
+_last_saved = {}
+_lock = threading.Lock()
+
+
+def snapshot_key(device_id, start=None, end=None):
+    """Keyed by room and window length, so a rolling "last N days" range survives midnight"""
+    days = f"{(end - start).days}d" if start is not None and end is not None else "all"
+    return f"{device_id}-{days}"
+
+
+def due(device_id, start=None, end=None):
+    """True (and the slot taken) if this snapshot was not saved in the last KPI_SNAPSHOT_SAVE_SECONDS"""
+    key = snapshot_key(device_id, start, end)
+    now = time.monotonic()
+    with _lock:
+        last = _last_saved.get(key)
+        if last is not None and now - last < KPI_SNAPSHOT_SAVE_SECONDS:
+            return False
+        _last_saved[key] = now
+        return True
+
+
+def _write(key, doc):
+    try:
+        if KPI_SNAPSHOT_DIR:
+            os.makedirs(KPI_SNAPSHOT_DIR, exist_ok=True)
+            path = os.path.join(KPI_SNAPSHOT_DIR, f"{key}.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(doc, f)
+            os.replace(path + ".tmp", path)
+        else:
+            get_db().collection(KPI_SNAPSHOT_COLLECTION).document(key).set(doc)
+    except Exception as e:
+        log.warning("Saving KPI snapshot failed", key=key, error=str(e), sample="kpi-snapshot")
+
+
+def _read(key):
+    try:
+        if KPI_SNAPSHOT_DIR:
+            path = os.path.join(KPI_SNAPSHOT_DIR, f"{key}.json")
+            if not os.path.exists(path):
+                return None
+            with open(path) as f:
+                return json.load(f)
+        doc = get_db().collection(KPI_SNAPSHOT_COLLECTION).document(key).get()
+        return doc.to_dict() if doc.exists else None
+    except Exception as e:
+        log.warning("Loading KPI snapshot failed", key=key, error=str(e), sample="kpi-snapshot")
+        return None
+
+
+def encode_kpis(kpis):
+    """KPIs in a form Firestore stores: string map keys, no per-visit durations.
+
+    Firestore rejects the int hour keys of peak_usage_time, and the list of
+    every visit's duration grows with the range past the 1 MiB document
+    limit; the overview does not show it.
+    """
+    kpis = dict(kpis)
+    if "peak_usage_time" in kpis:
+        kpis["peak_usage_time"] = {str(h): n for h, n in kpis["peak_usage_time"].items()}
+    if "occupancy_duration" in kpis:
+        kpis["occupancy_duration"] = dict(kpis["occupancy_duration"], durations=[])
+    return kpis
+
+
+def decode_kpis(kpis):
+    """encode_kpis back to the shapes KpiState.snapshot returns"""
+    kpis = dict(kpis)
+    if "peak_usage_time" in kpis:
+        kpis["peak_usage_time"] = Counter({int(h): n for h, n in kpis["peak_usage_time"].items()})
+    return kpis
+
+
+def save(device_id, start, end, kpis, latest):
+    _write(snapshot_key(device_id, start, end), {
+        "device_id": device_id,
+        "start": to_timestamp(start),
+        "end": to_timestamp(end),
+        "kpis": encode_kpis(kpis),
+        "latest": latest,
+        "saved_at": datetime.utcnow().isoformat()
+    })
+
+
+def load(device_id, start=None, end=None):
+    """The saved overview for this room and window length, or None"""
+    saved = _read(snapshot_key(device_id, start, end))
+    if saved:
+        saved["kpis"] = decode_kpis(saved["kpis"])
+    return saved
+
+
+def save_rooms(rooms):
+    """Remember the discovered room list, for the room selector of the next instance"""
+    _write(ROOMS_KEY, {"rooms": list(rooms), "saved_at": datetime.utcnow().isoformat()})
+
+
+def load_rooms():
+    """The last saved room list, or None"""
+    saved = _read(ROOMS_KEY)
+    return saved["rooms"] if saved else None
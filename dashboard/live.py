@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import firestore_client
+from monitoring import get_logger
+
+log = get_logger(__name__)
+
+# Recent documents kept per process for sessions that want the deltas
+DELTA_BUFFER_SIZE = 5000
+# The listeners are re-opened this often with their lower bound moved up, so
+# the documents Firestore keeps in each listen result stay bounded
+LIVE_WINDOW_SECONDS = float(os.environ.get("LIVE_WINDOW_SECONDS", 600))
+
+
+class LiveFeed:
+    """Process-wide Firestore on_snapshot listener shared by every session.
+
+    Keeps the latest telemetry per room, a bounded buffer of new documents and
+    a version counter per room, so sessions only re-render when data changes.
+    The listeners follow the commit time (firestore_client.COMMITTED), so a
+    row committed late is still delivered. Every window_seconds they are
+    replaced by ones starting at the read time of the last snapshot;
+    documents both listeners deliver are counted once by id.
+    """
+
+    def __init__(self, collections=("room_telemetry", "room_events"), window_seconds=LIVE_WINDOW_SECONDS):
+        self.collections = collections
+        self.window_seconds = window_seconds
+        self.latest = {}
+        self.deltas = deque(maxlen=DELTA_BUFFER_SIZE)
+        self.versions = {}
+        self.healthy = False
+        self.error = None
+        self.since = None        # commit time the listeners start after
+        self.read_time = None    # read time of the newest snapshot delivered
+        self._watches = []
+        self._seen = {}          # id -> commit time of the documents after since
+        self._stopped = threading.Event()
+        self._changed = threading.Condition()
+
+    def start(self):
+        """Listen for documents written from now on (history comes from the cache)"""
+        try:
+            self._subscribe(datetime.now(timezone.utc))
+            self.healthy = True
+        except Exception as e:
+            self.error = str(e)
+            self.healthy = False
+            return self
+        threading.Thread(target=self._roll, name="live-window", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+        self.healthy = False
+
+    def _subscribe(self, since):
+        """Open listeners for the documents committed after since, then close the ones they replace"""
+        watches = []
+        try:
+            for collection in self.collections:
+                query = firestore_client.db.collection(collection) \
+                    .where(firestore_client.COMMITTED, ">", since)
+                watches.append(query.on_snapshot(self._callback(collection)))
+        except Exception:
+            for watch in watches:
+                watch.unsubscribe()
+            raise
+        old, self._watches = self._watches, watches
+        for watch in old:
+            watch.unsubscribe()
+        with self._changed:
+            self.since = since
+            self._seen = {doc_id: committed for doc_id, committed in self._seen.items()
+                          if committed is not None and committed > since}
+
+    def _roll(self):
+        while not self._stopped.wait(self.window_seconds):
+            try:
+                with self._changed:
+                    since = self.read_time or self.since
+                self._subscribe(since)
+                self.error = None
+            except Exception as e:
+                # The current listeners stay open; try again next window
+                self.error = str(e)
+                log.warning("Live listener re-subscribe failed", error=str(e), sample="live-window")
+
+    def version(self, device_id):
+        with self._changed:
+            return self.versions.get(device_id, 0)
+
+    def latest_status(self, device_id):
+        with self._changed:
+            return self.latest.get(device_id)
+
+    def wait_for_change(self, device_id, seen_version, timeout):
+        """Block until the room's version moves past seen_version; returns the new version"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.versions.get(device_id, 0) != seen_version, timeout)
+            return self.versions.get(device_id, 0)
+
+    def _callback(self, collection):
+        def on_snapshot(_docs, changes, read_time):
+            with self._changed:
+                if self.read_time is None or read_time > self.read_time:
+                    self.read_time = read_time
+                for change in changes:
+                    if change.type.name != "ADDED":
+                        continue
+                    data = change.document.to_dict()
+                    data["id"] = change.document.id
+                    committed = data.pop(firestore_client.COMMITTED, None)
+                    if data["id"] in self._seen:
+                        continue
+                    self._seen[data["id"]] = committed
+                    device_id = data.get("device_id")
+                    self.deltas.append((collection, data))
+                    if collection == "room_telemetry" and device_id:
+                        current = self.latest.get(device_id)
+                        if current is None or data.get("timestamp", "") >= current.get("timestamp", ""):
+                            self.latest[device_id] = data
+                    self.versions[device_id] = self.versions.get(device_id, 0) + 1
+                    firestore_client.invalidate(collection, device_id)
+                self._changed.notify_all()
+        return on_snapshot
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+def get_feed():
+    """The single LiveFeed of this process, started on first use"""
+    global _feed
+    with _feed_lock:
+        if _feed is None:
+            _feed = LiveFeed().start()
+        return _feed
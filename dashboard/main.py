@@ -3,6 +3,11 @@ import streamlit.web.cli as stcli
 import sys
 
 if __name__ == "__main__":
+    # Same process as the Streamlit server, so /metrics sees the app's metrics
+    from monitoring import enable_profiling, start_metrics_server
+    enable_profiling()
+    start_metrics_server()
+
     port = int(os.environ.get("PORT", 8080))
     sys.argv = [
         "streamlit",
@@ -0,0 +1,76 @@
+import logging
+import os
+import sys
+import time
+
+from prometheus_client import Counter, Histogram, start_http_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+# Logging and profiling are shared with the ingester (common/diagnostics.py)
+import diagnostics  # noqa: E402
+from diagnostics import StructuredLogger, configure_logging, dump_profile  # noqa: E402,F401
+
+# =========================================================
+# CONFIGURATION
+# =========================================================
+# Cloud Run only routes PORT; scrape this one from a sidecar (0 disables it)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9109))
+
+# PROFILE=1 profiles every thread (each Streamlit script run included) with
+# cProfile; stats go to PROFILE_OUTPUT on exit and on SIGUSR1.
+PROFILE_OUTPUT = os.environ.get("PROFILE_OUTPUT", "dashboard.prof")
+
+# =========================================================
+# METRICS
+# =========================================================
+FIRESTORE_FETCH_SECONDS = Histogram(
+    "dashboard_firestore_fetch_seconds", "Time spent in one Firestore query",
+    ["collection", "query"]
+)
+DOCUMENTS_READ = Counter(
+    "dashboard_documents_read_total", "Documents read from Firestore", ["collection"]
+)
+DOCUMENTS_PER_REFRESH = Histogram(
+    "dashboard_documents_per_refresh", "Documents read by one cache refresh", ["collection"],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+)
+ANALYTICS_COMPUTE_SECONDS = Histogram(
+    "dashboard_analytics_compute_seconds", "Time spent computing KPIs", ["stage"]
+)
+RENDER_SECONDS = Histogram(
+    "dashboard_render_seconds", "Time for one full dashboard script run",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+
+def record_read(collection, query, started, documents):
+    """Account one finished Firestore query that started at time.perf_counter() `started`"""
+    FIRESTORE_FETCH_SECONDS.labels(collection, query).observe(time.perf_counter() - started)
+    DOCUMENTS_READ.labels(collection).inc(documents)
+
+
+_metrics_started = False
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics once per process"""
+    global _metrics_started
+    if port and not _metrics_started:
+        start_http_server(port)
+        _metrics_started = True
+        get_logger(__name__).info("Metrics listening", port=port)
+
+# =========================================================
+# LOGGING
+# =========================================================
+def get_logger(name):
+    # Streamlit configures its own "streamlit" loggers; ours live under "dashboard"
+    configure_logging("dashboard", propagate=False)
+    return StructuredLogger(logging.getLogger(f"dashboard.{name}"))
+
+# =========================================================
+# PROFILING
+# =========================================================
+def enable_profiling():
+    """Profile every thread into PROFILE_OUTPUT, if PROFILE=1 (see diagnostics.enable_profiling)"""
+    diagnostics.enable_profiling(PROFILE_OUTPUT, get_logger(__name__))
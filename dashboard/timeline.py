@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from analytics_engine import to_frame
+
+# State rows drawn on the timeline, top to bottom
+TIMELINE_SERIES = {"occupied": "Occupancy", "fan": "Fan", "led": "Lamp"}
+# Horizontal resolution: at most this many marks per series (about one per pixel)
+TIMELINE_WIDTH = 1000
+# The occupancy-rate line is bucketed this much finer, then reduced by LTTB
+LTTB_OVERSAMPLE = 8
+
+
+def run_lengths(ts, values, until=None):
+    """Run-length encode a state column into (starts, ends, values).
+
+    ts is sorted int64 epoch ns; each run lasts until the next change and
+    the last one until `until` (default: the last sample).
+    """
+    if len(ts) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=values.dtype)
+    change = np.flatnonzero(np.diff(values)) + 1
+    first = np.concatenate(([0], change))
+    starts = ts[first]
+    ends = np.append(ts[change], max(ts[-1], until if until is not None else ts[-1]))
+    return starts, ends, values[first]
+
+
+def _on_time(starts, ends, values, at):
+    """Total time with value 1 in [starts[0], at), for each point of at"""
+    on = (values == 1) * (ends - starts)
+    before = np.concatenate(([0], np.cumsum(on)))
+    i = np.clip(np.searchsorted(starts, at, side="right") - 1, 0, len(starts) - 1)
+    partial = np.clip(at - starts[i], 0, ends[i] - starts[i]) * (values[i] == 1)
+    return np.where(at <= starts[0], 0, before[i] + partial)
+
+
+def duty_buckets(starts, ends, values, lo, hi, buckets):
+    """Fraction of each of `buckets` equal slices of [lo, hi) spent at 1"""
+    edges = np.linspace(lo, hi, buckets + 1).astype(np.int64)
+    on = np.diff(_on_time(starts, ends, values, edges))
+    return edges, on / np.maximum(np.diff(edges), 1)
+
+
+def minmax_intervals(starts, ends, values, lo, hi, width=TIMELINE_WIDTH):
+    """Intervals of one state series with at most `width` rows.
+
+    Returns a frame of start, end (epoch ns), min, max and level (share of
+    the interval spent on). Exact runs are kept when they fit; otherwise the
+    range is cut into `width` buckets whose min/max still show a short
+    on-period (max 1) or off-period (min 0) that averaging would hide.
+    Neighbouring buckets that look the same are merged again.
+    """
+    if len(starts) <= width:
+        level = values.astype(float)
+        return pd.DataFrame({"start": starts, "end": ends, "min": level, "max": level, "level": level})
+
+    edges, level = duty_buckets(starts, ends, values, lo, hi, width)
+    low = (level >= 1).astype(float)
+    high = (level > 0).astype(float)
+    # Uniform buckets (all on / all off) differ only by level rounding; merge runs of them
+    key = np.where(low == high, low, 2 + np.round(level, 2))
+    first = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1))
+    last = np.append(first[1:], len(key))
+    return pd.DataFrame({
+        "start": edges[first],
+        "end": edges[last],
+        "min": low[first],
+        "max": high[first],
+        "level": np.add.reduceat(level, first) / (last - first),
+    })
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: indexes of `threshold` points that keep the shape of (x, y)"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = x.astype(float)
+    y = y.astype(float)
+    bounds = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    chosen = np.empty(threshold, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        nxt_lo, nxt_hi = hi, bounds[i + 2] if i + 2 < len(bounds) else n
+        avg_x = x[nxt_lo:nxt_hi].mean()
+        avg_y = y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        chosen[i + 1] = a
+    return chosen
+
+
+def build_timeline(records, start_ns, end_ns, width=TIMELINE_WIDTH):
+    """Chart-ready, downsampled timelines for one room and range.
+
+    Returns {"states": frame of series, start, end, min, max, level with at
+    most `width` rows per series, "occupancy": frame of time, rate with at
+    most `width` points}. Times are pandas UTC datetimes. The timeline
+    starts at the first sample if that is after start_ns, and the last
+    state is drawn up to end_ns (pass "now" for a range that ends later).
+    """
+    frame = to_frame(records)
+    if len(frame):
+        frame = frame.sort_values("ts", kind="stable")
+    ts = frame["ts"].to_numpy()
+    lo = int(ts[0]) if len(ts) and ts[0] > start_ns else start_ns
+    hi = max(lo + 1, end_ns)
+
+    states = []
+    for column, label in TIMELINE_SERIES.items():
+        runs = run_lengths(ts, frame[column].to_numpy(), until=hi)
+        part = minmax_intervals(*runs, lo, hi, width)
+        part.insert(0, "series", label)
+        states.append(part)
+    states = pd.concat(states, ignore_index=True)
+    states["start"] = pd.to_datetime(states["start"], utc=True)
+    states["end"] = pd.to_datetime(states["end"], utc=True)
+
+    occupancy = pd.DataFrame({"time": pd.Series(dtype="datetime64[ns, UTC]"), "rate": pd.Series(dtype=float)})
+    if len(ts):
+        runs = run_lengths(ts, frame["occupied"].to_numpy(), until=hi)
+        edges, rate = duty_buckets(*runs, lo, hi, width * LTTB_OVERSAMPLE)
+        mids = (edges[:-1] + edges[1:]) // 2
+        keep = lttb(mids, rate, width)
+        occupancy = pd.DataFrame({"time": pd.to_datetime(mids[keep], utc=True), "rate": rate[keep]})
+    return {"states": states, "occupancy": occupancy}
@@ -0,0 +1,111 @@
+import os
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Timestamps are stored as naive UTC ISO strings by the ingester and shown
+# in DISPLAY_TIMEZONE (Malaysia time unless configured otherwise).
+DISPLAY_TIMEZONE = os.environ.get("DISPLAY_TIMEZONE", "Asia/Kuala_Lumpur")
+DISPLAY_TZ = ZoneInfo(DISPLAY_TIMEZONE)
+
+LOCAL_CACHE_SIZE = 200000
+
+
+def event_time(record):
+    """When it happened: the device timestamp if the firmware sent one, else ingest time"""
+    return record.get("device_timestamp") or record["timestamp"]
+
+
+def event_times(columns):
+    """event_time() over a dict of column lists"""
+    device = columns.get("device_timestamp")
+    if not device:
+        return columns["timestamp"]
+    return [d or t for d, t in zip(device, columns["timestamp"])]
+
+
+@lru_cache(maxsize=65536)
+def parse_epoch_us(timestamp):
+    """Epoch microseconds of one ISO timestamp (naive = UTC)"""
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def to_epoch_ns(timestamps):
+    """Vectorized parse of a sequence of ISO timestamps into int64 epoch nanoseconds.
+
+    Naive timestamps keep their wall-clock value (treated as UTC).
+    """
+    import pandas as pd   # imported on first use: the first paint does not need it
+    parsed = pd.to_datetime(pd.Series(timestamps, dtype=object), format="ISO8601")
+    if getattr(parsed.dt, "tz", None) is not None:
+        parsed = parsed.dt.tz_convert("UTC").dt.tz_localize(None)
+    return parsed.to_numpy(dtype="datetime64[ns]").astype("int64")
+
+
+def local_hours(epoch_ns, tz=DISPLAY_TZ):
+    """Hour of day in tz of each int64 epoch-nanosecond timestamp (DST and half-hour offsets included)"""
+    import pandas as pd
+    return pd.to_datetime(epoch_ns, unit="ns", utc=True).tz_convert(tz).hour.to_numpy()
+
+
+def to_local(timestamp, tz=DISPLAY_TZ):
+    """(date, time) strings of one timestamp in the display timezone"""
+    try:
+        dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        local = dt.astimezone(tz)
+        return local.strftime("%Y-%m-%d"), local.strftime("%H:%M:%S")
+    except (ValueError, AttributeError):
+        return str(timestamp)[:10], str(timestamp)[11:19]
+
+
+class LocalTimeCache:
+    """Display date/time strings per document ID, converted in bulk once"""
+
+    def __init__(self, tz=DISPLAY_TZ, max_size=LOCAL_CACHE_SIZE):
+        self.tz = tz
+        self.max_size = max_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def convert(self, records):
+        """[(date, time)] for each record, keyed by its "id" field"""
+        with self._lock:
+            missing = [r for r in records if r.get("id") not in self._cache]
+        if missing:
+            converted = self._convert_bulk([event_time(r) if r.get("timestamp") else "N/A" for r in missing])
+            with self._lock:
+                if len(self._cache) + len(missing) > self.max_size:
+                    self._cache.clear()
+                for r, value in zip(missing, converted):
+                    if r.get("id") is not None:
+                        self._cache[r["id"]] = value
+
+        with self._lock:
+            return [self._cache.get(r.get("id")) or to_local(event_time(r) if r.get("timestamp") else "N/A", self.tz)
+                    for r in records]
+
+    def _convert_bulk(self, timestamps):
+        import numpy as np
+        import pandas as pd
+        try:
+            parsed = pd.to_datetime(pd.Series(timestamps, dtype=object), format="ISO8601", utc=True)
+        except (ValueError, TypeError):
+            # Malformed timestamps: fall back to the per-row path
+            return [to_local(ts, self.tz) for ts in timestamps]
+        # datetime_as_string is far cheaper than a per-row strftime
+        local = parsed.dt.tz_convert(self.tz).dt.tz_localize(None).to_numpy("datetime64[s]")
+        return [(s[:10], s[11:19]) for s in np.datetime_as_string(local).tolist()]
+
+
+_local_times = LocalTimeCache()
+
+def local_date_time(records):
+    """Shared, process-wide cached (date, time) conversion for display"""
+    return _local_times.convert(records)
@@ -1,6 +1,8 @@
 #include <WiFi.h>
 #include <WiFiClientSecure.h>
 #include <PubSubClient.h>
+#include <time.h>
+#include <sys/time.h>
 
 // ================== WIFI CONFIG ==================
 const char* ssid = "SSID";
@@ -26,6 +28,13 @@ const int ledPin    = 19;   // LED
 const int btnFanPin = 33;   // FAN button
 const int btnLedPin = 25;   // LED button
 
+// ================== DEVICE ==================
+const uint16_t roomNumber = 1;   // building/room01 -> room_01
+
+// Set to 1 to publish one packed binary frame per change on
+// building/room01/frame instead of the status JSON + event string
+#define USE_BINARY_FRAMES 0
+
 // ================== TIMING ==================
 const unsigned long idleBuffer = 30000;        // 30 seconds
 const unsigned long overrideDuration = 15000; // 15 seconds
@@ -43,6 +52,8 @@ bool ledON = false;
 bool fanManualOverride = false;
 bool ledManualOverride = false;
 
+uint32_t publishSeq = 0;
+
 // ================== MQTT ==================
 WiFiClientSecure espClient;
 PubSubClient client(espClient);
@@ -78,16 +89,90 @@ void connectMQTT() {
   }
 }
 
+// ================== BINARY FRAME ==================
+// Little-endian, 18 bytes (matches FRAME in pythonSubscriber/router.py):
+//   magic u8 | version u8 | device u16 | seq u32 | device time ms u64 | state u8 | event u8
+const uint8_t FRAME_MAGIC = 0xA5;
+const uint8_t FRAME_VERSION = 1;
+const uint8_t TIME_SYNCED_BIT = 0x80;
+
+uint8_t eventCode(const char* event) {
+  if (strcmp(event, "AUTO_ON") == 0) return 1;
+  if (strcmp(event, "AUTO_OFF") == 0) return 2;
+  if (strcmp(event, "MANUAL_FAN") == 0) return 3;
+  if (strcmp(event, "MANUAL_LED") == 0) return 4;
+  return 0;
+}
+
+// ================== CLOCK ==================
+// Any time after 2020-01-01 means SNTP has set the clock
+const time_t MIN_VALID_EPOCH = 1577836800;
+
+void syncClock() {
+  configTime(0, 0, "pool.ntp.org", "time.google.com");
+}
+
+// Epoch ms once NTP has synced; millis() since boot until then
+uint64_t deviceTimeMs(bool* synced) {
+  struct timeval tv;
+  gettimeofday(&tv, NULL);
+  *synced = tv.tv_sec > MIN_VALID_EPOCH;
+  if (!*synced) return millis();
+  return (uint64_t)tv.tv_sec * 1000ULL + tv.tv_usec / 1000;
+}
+
+void putLE(uint8_t* buf, uint64_t value, int bytes) {
+  for (int i = 0; i < bytes; i++) {
+    buf[i] = (value >> (8 * i)) & 0xFF;
+  }
+}
+
+void publishFrame(const char* event) {
+  uint8_t frame[18];
+  bool synced;
+  uint64_t ts = deviceTimeMs(&synced);
+  uint8_t state = (occupied ? 0x01 : 0) | (fanON ? 0x02 : 0) | (ledON ? 0x04 : 0) |
+                  (fanManualOverride ? 0x08 : 0) | (ledManualOverride ? 0x10 : 0) |
+                  (synced ? TIME_SYNCED_BIT : 0);
+
+  frame[0] = FRAME_MAGIC;
+  frame[1] = FRAME_VERSION;
+  putLE(frame + 2, roomNumber, 2);
+  putLE(frame + 4, publishSeq, 4);
+  putLE(frame + 8, ts, 8);
+  frame[16] = state;
+  frame[17] = eventCode(event);
+
+  client.publish("building/room01/frame", frame, sizeof(frame));
+}
+
 // ================== MQTT PUBLISH ==================
 void publishStatus(const char* event) {
+  publishSeq++;
+
+#if USE_BINARY_FRAMES
+  publishFrame(event);
+  return;
+#endif
+
+  bool synced;
+  uint64_t ts = deviceTimeMs(&synced);
+
   char payload[200];
   snprintf(payload, sizeof(payload),
-    "{\"occupied\":%d,\"fan\":%d,\"led\":%d,\"fan_override\":%d,\"led_override\":%d}",
-    occupied, fanON, ledON, fanManualOverride, ledManualOverride
+    "{\"occupied\":%d,\"fan\":%d,\"led\":%d,\"fan_override\":%d,\"led_override\":%d,"
+    "\"seq\":%lu,\"ts\":%llu,\"synced\":%d}",
+    occupied, fanON, ledON, fanManualOverride, ledManualOverride,
+    (unsigned long)publishSeq, (unsigned long long)ts, synced
   );
-
   client.publish("building/room01/status", payload);
-  client.publish("building/room01/event", event);
+
+  char eventPayload[120];
+  snprintf(eventPayload, sizeof(eventPayload),
+    "{\"event\":\"%s\",\"seq\":%lu,\"ts\":%llu,\"synced\":%d}",
+    event, (unsigned long)publishSeq, (unsigned long long)ts, synced
+  );
+  client.publish("building/room01/event", eventPayload);
 }
 
 // ================== SETUP ==================
@@ -103,6 +188,7 @@ void setup() {
   attachInterrupt(digitalPinToInterrupt(pirPin), motionISR, RISING);
 
   connectWiFi();
+  syncClock();
   espClient.setCACert(ca_cert);
   client.setServer(mqttServer, mqttPort);
   connectMQTT();
@@ -0,0 +1,201 @@
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from batch_writer import MAX_BATCH_SIZE
+from observability import get_logger
+
+log = get_logger("archive")
+
+# ================= CONFIG =================
+# Run daily (Cloud Scheduler, cron): ARCHIVE_URI=gs://bucket/archive python archive.py
+ARCHIVE_URI = os.environ.get("ARCHIVE_URI", "archive")       # local directory or gs://, s3:// URI
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 90))
+ARCHIVE_COLLECTIONS = ("room_telemetry", "room_events")
+PAGE_SIZE = 5000
+
+WATERMARK_FILE = "_watermark.json"
+PART_FILE = "part-0.parquet"
+
+# Partition columns (device_id, date) live in the path, not in the files
+SCHEMAS = {
+    "room_telemetry": pa.schema([
+        ("id", pa.string()),
+        ("timestamp", pa.string()),
+        ("device_timestamp", pa.string()),
+        ("occupied", pa.int8()),
+        ("fan", pa.int8()),
+        ("led", pa.int8()),
+        ("fan_override", pa.int8()),
+        ("led_override", pa.int8()),
+        ("seq", pa.int64()),
+        ("device_ms", pa.int64()),
+        ("repeats", pa.int64()),
+    ]),
+    "room_events": pa.schema([
+        ("id", pa.string()),
+        ("timestamp", pa.string()),
+        ("device_timestamp", pa.string()),
+        ("event", pa.string()),
+        ("seq", pa.int64()),
+        ("device_ms", pa.int64()),
+    ]),
+}
+
+
+def open_archive(uri):
+    """(pyarrow FileSystem, root path) for a local directory or object-storage URI"""
+    if "://" not in uri:
+        uri = os.path.abspath(uri)
+    return pafs.FileSystem.from_uri(uri)
+
+
+class Archiver:
+    """Move documents older than after_days from Firestore to Parquet, then delete them.
+
+    Layout, read by dashboard/cold_store.py:
+
+        <uri>/<collection>/device_id=<room>/date=<YYYY-MM-DD>/part-0.parquet
+        <uri>/<collection>/_watermark.json    {"archived_before": <ISO timestamp>}
+
+    Days are archived whole, oldest first, by ingest timestamp. After a day's
+    partitions are written the watermark moves past it and only then are its
+    documents deleted, so a reader taking timestamps below the watermark from
+    Parquet and the rest from Firestore never sees a document twice or misses
+    one. An existing partition is merged by document id, which makes a rerun
+    after a crash (or a late document) safe.
+    """
+
+    def __init__(self, db, uri=ARCHIVE_URI, after_days=ARCHIVE_AFTER_DAYS, delete=True,
+                 page_size=PAGE_SIZE):
+        self.db = db
+        self.fs, self.root = open_archive(uri)
+        self.after_days = after_days
+        self.delete = delete
+        self.page_size = page_size
+
+        self.archived = 0
+        self.deleted = 0
+        self.partitions = 0
+
+    def horizon(self, now=None):
+        """Start of the UTC day after_days ago; everything before it is archived"""
+        now = now or datetime.utcnow()
+        day = (now - timedelta(days=self.after_days)).date()
+        return datetime.combine(day, datetime.min.time()).isoformat()
+
+    def run(self, collections=ARCHIVE_COLLECTIONS, now=None):
+        horizon = self.horizon(now)
+        for collection in collections:
+            self.archive_collection(collection, horizon)
+        log.info("Archive done", horizon=horizon, archived=self.archived, deleted=self.deleted,
+                 partitions=self.partitions)
+        return self
+
+    def archive_collection(self, collection, horizon):
+        day, docs = None, []
+        for snapshot in self._older_than(collection, horizon):
+            data = snapshot.to_dict()
+            data["id"] = snapshot.id
+            if day is not None and data["timestamp"][:10] != day:
+                self._archive_day(collection, day, docs)
+                docs = []
+            day = data["timestamp"][:10]
+            docs.append(data)
+        if docs:
+            self._archive_day(collection, day, docs)
+        self._advance_watermark(collection, horizon)
+
+    # ================= STEPS =================
+    def _older_than(self, collection, horizon):
+        """Documents before horizon, oldest first, read a page at a time"""
+        query = self.db.collection(collection) \
+                    .where("timestamp", "<", horizon) \
+                    .order_by("timestamp") \
+                    .limit(self.page_size)
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            yield from page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+
+    def _archive_day(self, collection, day, docs):
+        by_device = defaultdict(list)
+        for data in docs:
+            by_device[data.get("device_id", "unknown")].append(data)
+        for device_id, rows in by_device.items():
+            self._write_partition(collection, device_id, day, rows)
+
+        next_day = (datetime.fromisoformat(day) + timedelta(days=1)).isoformat()
+        self._advance_watermark(collection, next_day)
+        if self.delete:
+            self._delete(collection, [data["id"] for data in docs])
+        self.archived += len(docs)
+        log.info("Archived day", collection=collection, day=day, documents=len(docs),
+                 rooms=len(by_device))
+
+    def _write_partition(self, collection, device_id, day, rows):
+        schema = SCHEMAS[collection]
+        directory = f"{self.root}/{collection}/device_id={device_id}/date={day}"
+        path = f"{directory}/{PART_FILE}"
+        self.fs.create_dir(directory, recursive=True)
+
+        merged = {}
+        if self.fs.get_file_info(path).type == pafs.FileType.File:
+            for row in pq.read_table(path, filesystem=self.fs, schema=schema).to_pylist():
+                merged[row["id"]] = row
+        for row in rows:
+            merged[row["id"]] = row
+        table = pa.Table.from_pylist(sorted(merged.values(), key=lambda r: r["timestamp"]),
+                                     schema=schema)
+
+        if isinstance(self.fs, pafs.LocalFileSystem):
+            # Object stores publish an object only once it is complete; locally, rename
+            tmp = f"{directory}/_{PART_FILE}.tmp"
+            pq.write_table(table, tmp, filesystem=self.fs, compression="zstd")
+            self.fs.move(tmp, path)
+        else:
+            pq.write_table(table, path, filesystem=self.fs, compression="zstd")
+        self.partitions += 1
+
+    def _delete(self, collection, ids):
+        for i in range(0, len(ids), MAX_BATCH_SIZE):
+            batch = self.db.batch()
+            for doc_id in ids[i:i + MAX_BATCH_SIZE]:
+                batch.delete(self.db.collection(collection).document(doc_id))
+            batch.commit()
+            self.deleted += len(ids[i:i + MAX_BATCH_SIZE])
+
+    # ================= WATERMARK =================
+    def watermark(self, collection):
+        path = f"{self.root}/{collection}/{WATERMARK_FILE}"
+        if self.fs.get_file_info(path).type != pafs.FileType.File:
+            return None
+        with self.fs.open_input_stream(path) as f:
+            return json.loads(f.read())["archived_before"]
+
+    def _advance_watermark(self, collection, timestamp):
+        current = self.watermark(collection)
+        if current is not None and current >= timestamp:
+            return
+        self.fs.create_dir(f"{self.root}/{collection}", recursive=True)
+        with self.fs.open_output_stream(f"{self.root}/{collection}/{WATERMARK_FILE}") as f:
+            f.write(json.dumps({"archived_before": timestamp}).encode())
+
+
+def main():
+    from mqtt_to_firestore import connect_firestore
+
+    db, _ = connect_firestore()
+    Archiver(db).run()
+
+
+if __name__ == "__main__":
+    main()
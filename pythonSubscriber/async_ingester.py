@@ -0,0 +1,485 @@
+import asyncio
+import functools
+import os
+import random
+import signal
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.enums import CallbackAPIVersion
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from router import decode, parse_topic, document_id, DecodeError, SUBSCRIBE_TOPIC
+from pipeline_stats import PipelineStats, Histogram, BATCH_SIZE_BUCKETS
+from batch_writer import already_exists, stamped
+from observability import get_logger, start_metrics_server, enable_profiling
+
+log = get_logger("async_ingester")
+
+# ================= LIMITS =================
+# Memory ceiling: the broker sends at most RECEIVE_MAXIMUM unacked QoS 1
+# messages, and reading pauses once MAX_PENDING_DOCUMENTS wait for a batch
+# (QoS 0 messages are not covered by Receive Maximum). At most
+# MAX_INFLIGHT_WRITES batches of MAX_BATCH_SIZE are committing on top of that.
+RECEIVE_MAXIMUM = int(os.environ.get("RECEIVE_MAXIMUM", 1000))
+MAX_PENDING_DOCUMENTS = int(os.environ.get("MAX_PENDING_DOCUMENTS", 5000))
+MAX_INFLIGHT_WRITES = int(os.environ.get("MAX_INFLIGHT_WRITES", 4))
+MAX_BATCH_SIZE = 500
+MAX_BATCH_AGE = 0.2
+
+# ================= CONNECTION =================
+KEEPALIVE_SECONDS = 60
+CONNECT_TIMEOUT_SECONDS = 10
+# Must be unique per replica; stable across restarts so the session survives them
+CLIENT_ID = os.environ.get("MQTT_CLIENT_ID") or f"ingester-{socket.gethostname()}"
+# The broker keeps our subscription and unacked messages this long after a disconnect
+SESSION_EXPIRY_SECONDS = int(os.environ.get("SESSION_EXPIRY_SECONDS", 3600))
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+COMMIT_RETRY_MIN_DELAY = 0.5
+COMMIT_RETRY_MAX_DELAY = 30
+
+# On SIGTERM, outstanding writes get this long before the process exits
+DRAIN_TIMEOUT_SECONDS = float(os.environ.get("DRAIN_TIMEOUT_SECONDS", 25))
+
+
+class AsyncioBridge:
+    """Drive a paho client from an asyncio loop instead of loop_forever().
+
+    The socket callbacks may fire on the executor thread running connect();
+    they are then handed to the loop, which owns the readers and writers.
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.sock = None
+        self.paused = False
+        self._misc = None
+        self._loop_thread = threading.get_ident()
+        client.on_socket_open = self._on_loop(self.on_socket_open)
+        client.on_socket_close = self._on_loop(self.on_socket_close)
+        client.on_socket_register_write = self._on_loop(self.on_socket_register_write)
+        client.on_socket_unregister_write = self._on_loop(self.on_socket_unregister_write)
+
+    def _on_loop(self, callback):
+        def run(*args):
+            if threading.get_ident() == self._loop_thread:
+                callback(*args)
+            else:
+                self.loop.call_soon_threadsafe(callback, *args)
+        return run
+
+    def on_socket_open(self, client, userdata, sock):
+        self.sock = sock
+        self.paused = False
+        self.loop.add_reader(sock, client.loop_read)
+        self._misc = self.loop.create_task(self._misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self.sock = None
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def pause(self):
+        """Stop reading; unread messages wait in the socket and at the broker"""
+        if self.sock is not None and not self.paused:
+            self.loop.remove_reader(self.sock)
+            self.paused = True
+
+    def resume(self):
+        if self.sock is not None and self.paused:
+            self.loop.add_reader(self.sock, self.client.loop_read)
+            self.paused = False
+
+    async def _misc_loop(self):
+        # Keepalive pings and retries; returns once the connection is gone
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+class _Delivery:
+    """One received message, acked once all of its documents are committed"""
+    __slots__ = ("mid", "qos", "connection", "remaining")
+
+    def __init__(self, mid, qos, connection):
+        self.mid = mid
+        self.qos = qos
+        self.connection = connection
+        self.remaining = 0
+
+
+class AsyncIngester:
+    """Single-threaded ingester on asyncio: MQTT v5 in, batched async Firestore commits out.
+
+    Messages are subscribed with QoS 1 and acked manually, in receive order,
+    only after every document decoded from them is committed. A crash or a
+    lost connection therefore leaves the unacked messages with the broker,
+    which redelivers them on the persistent session (or to another replica of
+    a shared subscription). Document ids are deterministic, so a redelivered
+    message overwrites the document it already produced.
+
+    db is a firestore.AsyncClient (or fake_firestore.FakeAsyncClient). rollups,
+    if given, is a RollupAggregator fed with every stored document; changes, a
+    ChangeFilter dropping unchanged telemetry states.
+    """
+
+    def __init__(self, db, host, port=8883, client_id=None, topic=SUBSCRIBE_TOPIC,
+                 username=None, password=None, ca_file=None, rollups=None, changes=None,
+                 max_inflight=MAX_INFLIGHT_WRITES, max_pending=MAX_PENDING_DOCUMENTS,
+                 receive_maximum=RECEIVE_MAXIMUM, batch_size=MAX_BATCH_SIZE,
+                 batch_age=MAX_BATCH_AGE, drain_timeout=DRAIN_TIMEOUT_SECONDS):
+        self.db = db
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.rollups = rollups
+        self.changes = changes
+        self.max_inflight = max_inflight
+        self.max_pending = max_pending
+        self.receive_maximum = receive_maximum
+        self.batch_size = batch_size
+        self.batch_age = batch_age
+        self.drain_timeout = drain_timeout
+
+        self.client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id=client_id or CLIENT_ID,
+                                  protocol=mqtt.MQTTv5, manual_ack=True)
+        self.client.connect_timeout = CONNECT_TIMEOUT_SECONDS
+        if username:
+            self.client.username_pw_set(username, password)
+        if ca_file:
+            self.client.tls_set(ca_certs=ca_file, cert_reqs=ssl.CERT_REQUIRED,
+                                tls_version=ssl.PROTOCOL_TLSv1_2)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+
+        self.stats = PipelineStats()
+        self.flush_ms = Histogram()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+
+        self._bridge = None
+        self._pending = deque()        # (collection, data, delivery) waiting for a batch
+        self._deliveries = deque()     # received messages in order, for acking
+        self._first_pending = 0.0
+        self._inflight = set()
+        self._connection = 0
+        self._draining = False
+
+        # Counters, named as on the threaded Ingester for the metrics collector
+        self.routed = 0
+        self.unrouted = 0
+        self.decode_errors = 0
+        self.dropped = 0               # never: reading pauses instead
+        self.duplicates = 0
+        self.stored = 0
+        self.committed_docs = 0
+        self.acked = 0
+        self.retries = 0
+        self.failed = 0                # documents left unacked when the drain timed out
+        self.spilled = 0
+        self.reconnects = 0
+
+        # The collector reads router and writer counters; both live here
+        self.dispatcher = self
+        self.writer = self
+        self.spool = None
+
+    # ================= MQTT CALLBACKS =================
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            log.warning("MQTT connect refused", reason=str(reason_code))
+            return
+        self._connected.set()
+        log.info("Connected to MQTT", session_present=flags.session_present,
+                 connection=self._connection)
+        # Re-subscribing is harmless when the broker kept the session
+        client.subscribe(self.topic, qos=1)
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        level = log.warning if reason_code.is_failure else log.info
+        level("Disconnected from MQTT", reason=str(reason_code), unacked=len(self._deliveries))
+        self._disconnected.set()
+
+    def on_message(self, client, userdata, msg):
+        delivery = _Delivery(msg.mid, msg.qos, self._connection)
+        self._deliveries.append(delivery)
+        route = parse_topic(msg.topic)
+        if route is None:
+            self.unrouted += 1
+        else:
+            self.routed += 1
+            try:
+                self._accept(route, msg.payload, delivery)
+            except Exception as e:
+                # Never raise out of the paho callback; the message is acked once its
+                # documents (if any were queued) are committed
+                log.error("Message handling failed", room=route[0], kind=route[1], error=str(e),
+                          sample="accept")
+                self.decode_errors += 1
+        if delivery.remaining == 0:
+            self._ack_ready()
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        if len(self._pending) >= self.max_pending:
+            self._bridge.pause()
+
+    def _accept(self, route, payload, delivery):
+        try:
+            records = decode(*route, payload, datetime.utcnow().isoformat())
+        except DecodeError as e:
+            log.warning("Decode error", room=route[0], kind=route[1], error=str(e), sample="decode")
+            self.decode_errors += 1
+            return
+        if not self._pending:
+            self._first_pending = time.monotonic()
+        for record in records:
+            if not self.stats.accept(record):
+                self.duplicates += 1
+                continue
+            if self.changes is not None and not self.changes.keep(record):
+                continue
+            data = record.to_dict()
+            self._pending.append((record.collection, data, delivery))
+            delivery.remaining += 1
+            self.stored += 1
+            if self.rollups is not None:
+                self.rollups.add(record.collection, data)
+
+    def _ack_ready(self):
+        """Ack the leading messages whose documents are all committed"""
+        while self._deliveries and self._deliveries[0].remaining == 0:
+            delivery = self._deliveries.popleft()
+            # Message ids of an earlier connection mean nothing now; the broker redelivers those
+            if delivery.qos and delivery.connection == self._connection:
+                self.client.ack(delivery.mid, delivery.qos)
+                self.acked += 1
+
+    # ================= WRITES =================
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def queue_depths(self):
+        return [len(self._pending)]
+
+    def committed(self):
+        return self.committed_docs
+
+    async def _flush_loop(self):
+        while not (self._draining and not self._pending):
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.batch_age)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._pending and (len(self._pending) >= self.batch_size or self._draining
+                                     or time.monotonic() - self._first_pending >= self.batch_age):
+                await self._slots.acquire()
+                n = min(self.batch_size, len(self._pending))
+                batch = [self._pending.popleft() for _ in range(n)]
+                self._first_pending = time.monotonic()
+                task = asyncio.create_task(self._commit(batch))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+                if len(self._pending) < self.max_pending // 2 and not self._draining:
+                    self._bridge.resume()
+
+    async def _commit(self, batch):
+        try:
+            delay = COMMIT_RETRY_MIN_DELAY
+            while True:
+                started = time.perf_counter()
+                try:
+                    await self._create([(c, document_id(c, data), data) for c, data, _ in batch])
+                    break
+                except Exception as e:
+                    self.retries += 1
+                    log.warning("Commit failed, retrying", documents=len(batch), error=str(e),
+                                retry_in=delay, sample="commit")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, COMMIT_RETRY_MAX_DELAY)
+
+            self.flush_ms.observe((time.perf_counter() - started) * 1000)
+            self.batch_sizes.observe(len(batch))
+            self.committed_docs += len(batch)
+            self.stats.committed([data for _, data, _ in batch])
+            for _, _, delivery in batch:
+                delivery.remaining -= 1
+            self._ack_ready()
+        finally:
+            self._slots.release()
+
+    async def _create(self, docs):
+        """batch_writer.commit_new with the async client: redelivered documents keep their first version"""
+        write = self.db.batch()
+        for collection, doc_id, data in docs:
+            write.create(self.db.collection(collection).document(doc_id), stamped(self.db, data))
+        try:
+            await write.commit()
+            return
+        except Exception as e:
+            if not already_exists(e):
+                raise
+        for collection, doc_id, data in docs:
+            write = self.db.batch()
+            write.create(self.db.collection(collection).document(doc_id), stamped(self.db, data))
+            try:
+                await write.commit()
+            except Exception as e:
+                if not already_exists(e):
+                    raise
+
+    # ================= LIFECYCLE =================
+    def stop(self):
+        """Ask run() to drain and return; safe to call from a signal handler"""
+        self._stop.set()
+
+    async def run(self):
+        """Connect, ingest until stop() (SIGTERM/SIGINT), then drain and disconnect"""
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._connected = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._bridge = AsyncioBridge(loop, self.client)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # not the main thread, or Windows
+
+        flusher = asyncio.create_task(self._flush_loop())
+        delay = RECONNECT_MIN_DELAY
+        while not self._stop.is_set():
+            self._connection += 1
+            self._connected.clear()
+            self._disconnected.clear()
+            try:
+                # DNS, TCP and TLS handshakes block; keep them off the event loop
+                await loop.run_in_executor(None, functools.partial(
+                    self.client.connect, self.host, self.port, KEEPALIVE_SECONDS,
+                    clean_start=False, properties=self._connect_properties()))
+                await self._until(self._stop, self._disconnected)
+            except OSError as e:
+                log.warning("MQTT connect failed", host=self.host, error=str(e))
+
+            if self._stop.is_set():
+                break
+            if self._connected.is_set():
+                delay = RECONNECT_MIN_DELAY
+            # Full jitter keeps a fleet of ingesters from reconnecting in lockstep
+            wait = random.uniform(delay / 2, delay)
+            log.info("Reconnecting", in_seconds=round(wait, 1))
+            self.reconnects += 1
+            await self._until(self._stop, timeout=wait)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+        await self._drain(flusher)
+
+    async def _drain(self, flusher):
+        """Stop reading, commit everything received, ack it, then disconnect"""
+        log.info("Draining", pending=len(self._pending), inflight=len(self._inflight))
+        self._draining = True
+        self._bridge.pause()
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._finish_writes(flusher), self.drain_timeout)
+        except asyncio.TimeoutError:
+            # Unacked messages stay with the broker and are redelivered to the next run
+            self.failed = self.stored - self.committed_docs
+            log.warning("Drain timed out", pending=len(self._pending),
+                        inflight=len(self._inflight), unacked=len(self._deliveries))
+            flusher.cancel()
+            for task in list(self._inflight):
+                task.cancel()
+
+        if self._bridge.sock is not None:
+            # Queued PUBACKs go out before the DISCONNECT packet
+            self.client.disconnect()
+            await self._until(self._disconnected, timeout=5)
+        if self.rollups is not None:
+            self.rollups.stop()
+        log.info("Ingester stopped", committed=self.committed_docs, acked=self.acked,
+                 retries=self.retries, reconnects=self.reconnects,
+                 writes_avoided=self.changes.suppressed if self.changes is not None else 0,
+                 summary=self.stats.summary())
+
+    async def _finish_writes(self, flusher):
+        await flusher
+        while self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def _until(self, *events, timeout=None):
+        """Wait for the first of events to be set, or timeout"""
+        waiters = [asyncio.create_task(e.wait()) for e in events]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for w in waiters:
+                w.cancel()
+
+    def _connect_properties(self):
+        props = Properties(PacketTypes.CONNECT)
+        props.SessionExpiryInterval = SESSION_EXPIRY_SECONDS
+        props.ReceiveMaximum = self.receive_maximum
+        return props
+
+
+# ================= MAIN =================
+def connect_async_firestore():
+    if os.environ.get("FAKE_FIRESTORE") == "1":
+        from fake_firestore import FakeAsyncClient
+        return FakeAsyncClient()
+
+    from google.cloud import firestore
+    from google.oauth2 import service_account
+    from mqtt_to_firestore import SERVICE_ACCOUNT_FILE
+
+    credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE)
+    return firestore.AsyncClient(credentials=credentials)
+
+
+def main():
+    from mqtt_to_firestore import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_USER, MQTT_PASS,
+                                   CA_FILE, DEDUP_TELEMETRY, SHARE_GROUP, connect_firestore)
+    from rollups import RollupAggregator
+    from change_filter import ChangeFilter
+
+    enable_profiling()
+    # Rollups flush from their own thread with the synchronous client; a replica
+    # on a shared subscription leaves them to rollups.py
+    sync_db, increment = connect_firestore()
+    ingester = AsyncIngester(
+        connect_async_firestore(),
+        MQTT_BROKER.strip(),
+        MQTT_PORT,
+        topic=MQTT_TOPIC,
+        username=MQTT_USER,
+        password=MQTT_PASS,
+        ca_file=CA_FILE,
+        rollups=None if SHARE_GROUP else RollupAggregator(sync_db, increment=increment).start(),
+        changes=ChangeFilter() if DEDUP_TELEMETRY else None
+    )
+    start_metrics_server(ingester)
+    asyncio.run(ingester.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import queue
+import threading
+import time
+from observability import get_logger
+from pipeline_stats import Histogram, BATCH_SIZE_BUCKETS
+from router import document_id
+
+log = get_logger(__name__)
+
+# ================= DEFAULTS =================
+MAX_BATCH_SIZE = 500        # Firestore limit for one WriteBatch
+MAX_BATCH_AGE = 0.2         # seconds an item may wait before a flush
+MAX_QUEUE_SIZE = 20000
+BLOCK_TIMEOUT = 0.05        # max time on_message may block under "block"
+COMMIT_RETRIES = 3
+
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest", "spill")
+
+# Firestore commit time of each stored document: readers resume after the
+# newest one they have seen, which a late commit cannot fall behind the way
+# it can fall behind the ingest timestamp
+COMMITTED = "committed"
+
+
+def already_exists(error):
+    """True for Firestore's ALREADY_EXISTS (google.api_core AlreadyExists, or the fake's)"""
+    return type(error).__name__ in ("AlreadyExists", "Conflict")
+
+
+def server_timestamp(db):
+    """db's commit-time sentinel (google.cloud.firestore.SERVER_TIMESTAMP, or the fake's)"""
+    sentinel = getattr(db, "SERVER_TIMESTAMP", None)
+    if sentinel is None:
+        from google.cloud.firestore import SERVER_TIMESTAMP as sentinel
+    return sentinel
+
+
+def stamped(db, data):
+    """data with the COMMITTED field Firestore fills in at commit"""
+    return {**data, COMMITTED: server_timestamp(db)}
+
+
+def commit_new(db, docs):
+    """Create (collection, doc_id, data) documents in one WriteBatch, keeping existing ones.
+
+    A redelivered or replayed message maps to the id it was first stored
+    under (router.document_id); creating rather than overwriting keeps
+    that first version, ingest timestamp included. A batch with such a
+    document fails as a whole, so its documents are then created one by one.
+    """
+    wb = db.batch()
+    for collection, doc_id, data in docs:
+        wb.create(db.collection(collection).document(doc_id), stamped(db, data))
+    try:
+        wb.commit()
+        return
+    except Exception as e:
+        if not already_exists(e):
+            raise
+    for collection, doc_id, data in docs:
+        try:
+            db.collection(collection).document(doc_id).create(stamped(db, data))
+        except Exception as e:
+            if not already_exists(e):
+                raise
+
+
+def commit_batch(db, docs, merge=False):
+    """Write (collection, doc_id, data) tuples in one WriteBatch; doc_id None = auto id"""
+    wb = db.batch()
+    for collection, doc_id, data in docs:
+        wb.set(db.collection(collection).document(doc_id), data, merge=merge)
+    wb.commit()
+
+
+class BatchWriter:
+    """Queue documents in memory and commit them to Firestore in batches"""
+
+    def __init__(self, db, max_batch_size=MAX_BATCH_SIZE, max_batch_age=MAX_BATCH_AGE,
+                 max_queue_size=MAX_QUEUE_SIZE, overflow_policy="block",
+                 block_timeout=BLOCK_TIMEOUT, spill=None, on_commit=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        if overflow_policy == "spill" and spill is None:
+            raise ValueError("The spill policy needs a spill callback")
+
+        self.db = db
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_SIZE)
+        self.max_batch_age = max_batch_age
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.spill = spill
+        self.on_commit = on_commit     # called with the committed documents
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.committed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.flush_ms = Histogram()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+
+    # ================= PRODUCER SIDE =================
+    def submit(self, collection, data):
+        """Queue a document for writing; never blocks longer than block_timeout"""
+        item = (time.monotonic(), collection, data)
+        self._count("submitted")
+
+        try:
+            if self.overflow_policy == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == "drop_oldest":
+            try:
+                self._queue.get_nowait()
+                self._count("dropped")
+                self._queue.put_nowait(item)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+        elif self.overflow_policy == "spill":
+            self._spill([item])
+            return False
+
+        self._count("dropped")
+        return False
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Snapshot of the writer counters"""
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "submitted": self.submitted,
+                "committed": self.committed,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "failed": self.failed,
+                "batches": self.batches,
+                "last_flush_latency": self.last_flush_latency,
+                "avg_flush_latency": self.total_flush_latency / self.batches if self.batches else 0,
+                "max_flush_latency": self.max_flush_latency,
+            }
+
+    # ================= LIFECYCLE =================
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        """Flush whatever is queued and stop the writer thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ================= WRITER SIDE =================
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._commit(batch)
+
+    def _collect(self):
+        """Wait for the first item, then fill the batch until it is full or too old"""
+        try:
+            first = self._queue.get(timeout=self.max_batch_age)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = first[0] + self.max_batch_age
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                # Drain without waiting once the age limit is hit or on shutdown
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        started = time.monotonic()
+        delay = 0.1
+        for attempt in range(COMMIT_RETRIES):
+            try:
+                commit_new(self.db, [(c, document_id(c, d), d) for _, c, d in batch])
+                break
+            except Exception as e:
+                log.warning("Batch commit failed", attempt=attempt + 1, size=len(batch), error=str(e))
+                if attempt == COMMIT_RETRIES - 1:
+                    if self.spill is not None:
+                        self._spill(batch)
+                    else:
+                        self._count("failed", len(batch))
+                    return
+                time.sleep(delay)
+                delay *= 2
+
+        latency = time.monotonic() - started
+        with self._lock:
+            self.committed += len(batch)
+            self.batches += 1
+            self.last_flush_latency = latency
+            self.total_flush_latency += latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.flush_ms.observe(latency * 1000)
+        self.batch_sizes.observe(len(batch))
+        if self.on_commit is not None:
+            self.on_commit([d for _, _, d in batch])
+
+    def _spill(self, items):
+        try:
+            for _, collection, data in items:
+                self.spill(collection, data)
+            self._count("spilled", len(items))
+        except Exception as e:
+            log.error("Spill failed", size=len(items), error=str(e))
+            self._count("failed", len(items))
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
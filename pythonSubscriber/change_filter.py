@@ -0,0 +1,68 @@
+import os
+import threading
+from pipeline_stats import iso_to_epoch
+
+# ================= DEFAULTS =================
+STATE_FIELDS = ("occupied", "fan", "led", "fan_override", "led_override")
+
+# An unchanged state is still stored once per interval as a heartbeat carrying
+# the number of repeats it stands for, so a quiet room stays distinguishable
+# from a dead device (0 = never store repeats)
+HEARTBEAT_SECONDS = int(os.environ.get("DEDUP_HEARTBEAT_SECONDS", 300))
+
+
+class ChangeFilter:
+    """Per-room last telemetry state, so repeats of it are not stored.
+
+    The firmware republishes the full state on every button press and
+    timeout. Transitions and events always pass; a repeat is only dropped when
+    it directly follows the last state by seq (or neither has a seq), so a
+    replica seeing a share of a room's messages never drops a change it missed.
+    """
+
+    def __init__(self, heartbeat_seconds=HEARTBEAT_SECONDS):
+        self.heartbeat_seconds = heartbeat_seconds
+        self._last = {}        # device_id -> [state, seq, stored at (epoch s), repeats since]
+        self._lock = threading.Lock()
+
+        self.kept = 0
+        self.suppressed = 0
+        self.heartbeats = 0
+
+    def keep(self, record):
+        """True if record should be stored; a heartbeat gets its repeats field set"""
+        if record.collection != "room_telemetry":
+            return True
+        state = tuple(getattr(record, field) for field in STATE_FIELDS)
+        t = iso_to_epoch(record.device_timestamp or record.timestamp)
+        with self._lock:
+            last = self._last.get(record.device_id)
+            if last is None or last[0] != state or not _follows(last[1], record.seq):
+                self._last[record.device_id] = [state, record.seq, t, 0]
+                self.kept += 1
+                return True
+
+            last[1] = record.seq
+            if self.heartbeat_seconds and t - last[2] >= self.heartbeat_seconds:
+                record.repeats = last[3]
+                last[2], last[3] = t, 0
+                self.heartbeats += 1
+                return True
+            last[3] += 1
+            self.suppressed += 1
+            return False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "kept": self.kept,
+                "suppressed": self.suppressed,
+                "heartbeats": self.heartbeats,
+                "rooms": len(self._last),
+            }
+
+
+def _follows(last_seq, seq):
+    if last_seq is None or seq is None:
+        return last_seq is None and seq is None
+    return seq == last_seq + 1
@@ -0,0 +1,313 @@
+"""In-memory stand-in for google.cloud.firestore.Client used for local runs and benchmarks"""
+import asyncio
+import json
+import operator
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+# Firestore's limit on one document
+MAX_DOCUMENT_BYTES = 1_048_576
+
+
+def _check_document(data):
+    """Reject what Firestore rejects: non-string map keys and documents over 1 MiB"""
+    nested = False
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for key in value:
+                if not isinstance(key, str):
+                    raise TypeError(f"Firestore map keys must be strings, got {key!r}")
+            stack.extend(value.values())
+            nested = nested or value is not data
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+            nested = True
+    # Flat documents of scalars stay far below the limit; only measure the others
+    if nested and len(json.dumps(data, default=str)) > MAX_DOCUMENT_BYTES:
+        raise ValueError(f"Document exceeds {MAX_DOCUMENT_BYTES} bytes")
+
+
+class AlreadyExists(Exception):
+    """Stand-in for google.api_core.exceptions.AlreadyExists"""
+
+
+class Increment:
+    """Stand-in for google.cloud.firestore.Increment"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _ServerTimestamp:
+    """Stand-in for google.cloud.firestore.SERVER_TIMESTAMP"""
+
+    def __repr__(self):
+        return "SERVER_TIMESTAMP"
+
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        self._collection._client._round_trip()
+        self._collection._set(self.id, data, merge)
+
+    def create(self, data):
+        self._collection._client._round_trip()
+        self._collection._create(self.id, data)
+
+    def update(self, data):
+        self._collection._client._round_trip()
+        self._collection._set(self.id, data, True)
+
+    def delete(self):
+        self._collection._client._round_trip()
+        self._collection._delete(self.id)
+
+    def get(self):
+        self._collection._client._round_trip()
+        return FakeSnapshot(self.id, self._collection._docs.get(self.id))
+
+
+class FakeCollection:
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self._docs = {}
+
+    def document(self, doc_id=None):
+        return FakeDocument(self, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        doc = self.document()
+        doc.set(data)
+        return None, doc
+
+    def stream(self):
+        self._client._round_trip()
+        with self._client._lock:
+            items = list(self._docs.items())
+        for doc_id, data in items:
+            yield FakeSnapshot(doc_id, data)
+
+    def where(self, field, op, value):
+        return FakeQuery(self).where(field, op, value)
+
+    def order_by(self, field, direction="ASCENDING"):
+        return FakeQuery(self).order_by(field, direction)
+
+    def limit(self, count):
+        return FakeQuery(self).limit(count)
+
+    def _set(self, doc_id, data, merge):
+        _check_document(data)
+        with self._client._lock:
+            if merge and doc_id in self._docs:
+                self._docs[doc_id] = self._client._stamp(_merge(self._docs[doc_id], data))
+            else:
+                self._docs[doc_id] = self._client._stamp(_merge({}, data))
+
+    def _create(self, doc_id, data):
+        _check_document(data)
+        with self._client._lock:
+            if doc_id in self._docs:
+                raise AlreadyExists(f"Document already exists: {self.name}/{doc_id}")
+            self._docs[doc_id] = self._client._stamp(_merge({}, data))
+
+    def _delete(self, doc_id):
+        with self._client._lock:
+            self._docs.pop(doc_id, None)
+
+    def __len__(self):
+        return len(self._docs)
+
+
+OPERATORS = {
+    "==": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, options: value in options,
+}
+
+
+class FakeQuery:
+    """The where/order_by/limit/start_after subset of Query the dashboard uses"""
+
+    def __init__(self, collection, filters=(), orders=(), count=None, after=None):
+        self._collection = collection
+        self._filters = filters
+        self._orders = orders
+        self._count = count
+        self._after = after
+
+    def _copy(self, **changes):
+        args = dict(filters=self._filters, orders=self._orders, count=self._count, after=self._after)
+        args.update(changes)
+        return FakeQuery(self._collection, **args)
+
+    def where(self, field, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {op}")
+        return self._copy(filters=self._filters + ((field, OPERATORS[op], value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field, direction == "DESCENDING"),))
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    def stream(self):
+        client = self._collection._client
+        client._round_trip()
+        with client._lock:
+            items = [(doc_id, data) for doc_id, data in self._collection._docs.items()
+                     if all(field in data and op(data[field], value)
+                            for field, op, value in self._filters)]
+        # Firestore drops documents missing an order_by field and breaks ties by id
+        items = [item for item in items if all(f in item[1] for f, _ in self._orders)]
+        items.sort(key=lambda item: item[0])
+        for field, descending in reversed(self._orders):
+            items.sort(key=lambda item: item[1][field], reverse=descending)
+        if self._after is not None:
+            items = [item for item in items if self._is_after(item)]
+        if self._count is not None:
+            items = items[:self._count]
+        for doc_id, data in items:
+            yield FakeSnapshot(doc_id, data)
+
+    def get(self):
+        return list(self.stream())
+
+    def _is_after(self, item):
+        """True if item sorts strictly after the start_after snapshot"""
+        cursor = self._after.to_dict() or {}
+        for field, descending in self._orders:
+            a, b = item[1][field], cursor.get(field)
+            if a != b:
+                return (a < b) if descending else (a > b)
+        return item[0] > self._after.id
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, doc, data, merge=False):
+        self._ops.append((doc._collection._set, (doc.id, data, merge)))
+
+    def create(self, doc, data):
+        self._ops.append((doc._collection._create, (doc.id, data)))
+
+    def update(self, doc, data):
+        self._ops.append((doc._collection._set, (doc.id, data, True)))
+
+    def delete(self, doc):
+        self._ops.append((doc._collection._delete, (doc.id,)))
+
+    def commit(self):
+        self._check()
+        self._client._round_trip()
+        self._apply()
+
+    def _check(self):
+        if len(self._ops) > 500:
+            raise ValueError("A batch can contain at most 500 operations")
+        # Batches are atomic: one existing document fails every create in it
+        for op, args in self._ops:
+            if op.__name__ == "_create" and args[0] in op.__self__._docs:
+                raise AlreadyExists(f"Document already exists: {op.__self__.name}/{args[0]}")
+
+    def _apply(self):
+        for op, args in self._ops:
+            op(*args)
+        self._ops = []
+
+
+class FakeAsyncWriteBatch(FakeWriteBatch):
+    async def commit(self):
+        self._check()
+        self._client.round_trips += 1
+        if self._client.latency:
+            await asyncio.sleep(self._client.latency)
+        self._apply()
+
+
+class FakeClient:
+    """Thread-safe fake client; latency simulates one Firestore round-trip"""
+
+    SERVER_TIMESTAMP = SERVER_TIMESTAMP
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._last_commit = datetime.min.replace(tzinfo=timezone.utc)
+
+    def collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(self, name)
+            return self._collections[name]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def _stamp(self, doc):
+        """Replace SERVER_TIMESTAMP fields by a commit time, increasing like Firestore's (lock held)"""
+        for key, value in doc.items():
+            if value is SERVER_TIMESTAMP:
+                now = max(datetime.now(timezone.utc), self._last_commit + timedelta(microseconds=1))
+                self._last_commit = doc[key] = now
+        return doc
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeAsyncClient(FakeClient):
+    """FakeClient whose batches commit with await, like firestore.AsyncClient"""
+
+    def batch(self):
+        return FakeAsyncWriteBatch(self)
+
+
+def _merge(current, data):
+    merged = dict(current)
+    for key, value in data.items():
+        if type(value).__name__ == "Increment":
+            # Works for both this fake and the real Increment transform
+            merged[key] = merged.get(key, 0) + value.value
+        elif isinstance(value, dict):
+            merged[key] = _merge(merged.get(key) if isinstance(merged.get(key), dict) else {}, value)
+        else:
+            merged[key] = value
+    return merged
@@ -1,62 +1,245 @@
+import os
 import ssl
 import json
+import socket
+import threading
+import time
+from collections import deque
 from datetime import datetime
 import paho.mqtt.client as mqtt
-from google.cloud import firestore
-from google.oauth2 import service_account
+from paho.mqtt.enums import CallbackAPIVersion
+from batch_writer import BatchWriter
+from spool import Spool, Replayer
+from router import ShardedDispatcher, subscription
+from rollups import RollupAggregator
+from pipeline_stats import PipelineStats
+from change_filter import ChangeFilter
+from observability import get_logger, start_metrics_server, enable_profiling
+
+log = get_logger("ingester")
 
 # ================= FIRESTORE =================
 SERVICE_ACCOUNT_FILE = "firestore-key.json"
 
-credentials = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE
-)
+def connect_firestore():
+    """(client, Increment transform) for the configured backend"""
+    if os.environ.get("FAKE_FIRESTORE") == "1":
+        # Local runs without a GCP project
+        from fake_firestore import FakeClient, Increment
+        return FakeClient(), Increment
+
+    from google.cloud import firestore
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_file(
+        SERVICE_ACCOUNT_FILE
+    )
+    return firestore.Client(credentials=credentials), firestore.Increment
+
+# ================= WRITER =================
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "spool")
+OVERFLOW_POLICY = os.environ.get("OVERFLOW_POLICY", "spill")
+SPILL_FILE = "spill.jsonl"
+
+# Messages are decoded and stored on worker threads sharded by room
+NUM_WORKERS = int(os.environ.get("NUM_WORKERS", 4))
+
+# Repeated telemetry states are not stored (DEDUP_HEARTBEAT_SECONDS in change_filter.py)
+DEDUP_TELEMETRY = os.environ.get("DEDUP_TELEMETRY", "1") == "1"
+
+# Pipeline histograms are logged and written to pipeline_stats/<host> every interval
+STATS_INTERVAL_SECONDS = int(os.environ.get("STATS_INTERVAL_SECONDS", 60))
+STATS_COLLECTION = "pipeline_stats"
+
+def spill_to_file(collection, data):
+    with open(SPILL_FILE, "a") as f:
+        f.write(json.dumps({"collection": collection, "data": data}) + "\n")
+
+
+class _Delivery:
+    """One received message, acked once the workers have stored its records"""
+    __slots__ = ("mid", "qos", "connection", "done")
+
+    def __init__(self, mid, qos, connection):
+        self.mid = mid
+        self.qos = qos
+        self.connection = connection
+        self.done = False
+
+
+class Ingester:
+    """Everything behind on_message: routing, writer, rollups and pipeline stats.
+
+    With a spool (default) every decoded message goes to the local journal first
+    and a replayer drains it to Firestore, so cloud outages cost no data.
+    Without one, on_message only enqueues and a background thread commits in
+    batches so a slow Firestore round-trip never blocks the paho network thread.
+
+    QoS 1 messages are acked manually (the client needs manual_ack=True), in
+    receive order, once the workers have stored them: in the journal with a
+    spool, in the writer's queue without one. A crash before that leaves them
+    with the broker, which redelivers them.
+    """
+
+    def __init__(self, db, increment, spool_dir=SPOOL_DIR, num_workers=NUM_WORKERS,
+                 overflow_policy=OVERFLOW_POLICY, dedup=DEDUP_TELEMETRY, topic=None, rollups=True):
+        self.db = db
+        self.topic = topic
+        self._deliveries = deque()     # received messages in order, for acking
+        self._ack_lock = threading.Lock()
+        self._connection = 0
+        self.acked = 0
+        # Sequence checks and device -> ingest -> Firestore latency histograms
+        self.stats = PipelineStats()
+        self.changes = ChangeFilter() if dedup else None
 
-db = firestore.Client(credentials=credentials)
+        if spool_dir:
+            self.spool = Spool(spool_dir)
+            self.writer = Replayer(self.spool, db, on_commit=self.stats.committed).start()
+        else:
+            self.spool = None
+            self.writer = BatchWriter(
+                db,
+                max_batch_size=500,
+                max_batch_age=0.2,
+                overflow_policy=overflow_policy,
+                spill=spill_to_file,
+                on_commit=self.stats.committed
+            ).start()
+
+        # Minute/hour/day rollups per room, upserted every ROLLUP_FLUSH_SECONDS
+        self.rollups = RollupAggregator(db, increment=increment).start() if rollups else None
+        self.dispatcher = ShardedDispatcher(self.store, num_workers=num_workers,
+                                            stats=self.stats, changes=self.changes).start()
+
+    def store(self, collection, data):
+        if self.spool is not None:
+            self.spool.append({"collection": collection, "data": data})
+        else:
+            self.writer.submit(collection, data)
+        if self.rollups is not None:
+            self.rollups.add(collection, data)
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            log.warning("MQTT connect refused", reason=str(reason_code))
+            return
+        with self._ack_lock:
+            self._connection += 1
+        log.info("Connected to MQTT", session_present=flags.session_present, topic=self.topic)
+        client.subscribe(self.topic, qos=1)
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        level = log.warning if reason_code.is_failure else log.info
+        level("Disconnected from MQTT", reason=str(reason_code), unacked=len(self._deliveries))
+
+    def on_message(self, client, userdata, msg):
+        delivery = _Delivery(getattr(msg, "mid", 0), getattr(msg, "qos", 0), self._connection)
+        with self._ack_lock:
+            self._deliveries.append(delivery)
+        try:
+            self.dispatcher.dispatch(msg.topic, msg.payload, datetime.utcnow().isoformat(),
+                                     done=lambda: self._stored(client, delivery))
+        except Exception as e:
+            log.error("Dispatch failed", topic=msg.topic, error=str(e), sample="dispatch")
+            self._stored(client, delivery)
+
+    def _stored(self, client, delivery):
+        """Ack the leading messages whose records are all stored (runs on the workers)"""
+        with self._ack_lock:
+            delivery.done = True
+            while self._deliveries and self._deliveries[0].done:
+                delivery = self._deliveries.popleft()
+                # Message ids of an earlier connection mean nothing now; the broker redelivers those
+                if client is not None and delivery.qos and delivery.connection == self._connection:
+                    client.ack(delivery.mid, delivery.qos)
+                    self.acked += 1
+
+    def committed(self):
+        """Documents written to Firestore so far"""
+        return self.writer.replayed if self.spool is not None else self.writer.committed
+
+    def start_stats(self, interval=STATS_INTERVAL_SECONDS):
+        threading.Thread(target=self._publish_stats, args=(interval,),
+                         name="pipeline-stats", daemon=True).start()
+        return self
+
+    def _publish_stats(self, interval):
+        host = socket.gethostname()
+        while True:
+            time.sleep(interval)
+            snapshot = self.stats.snapshot()
+            if self.changes is not None:
+                snapshot["changes"] = self.changes.snapshot()
+            log.info("Pipeline stats", summary=self.stats.summary())
+            try:
+                self.db.collection(STATS_COLLECTION).document(host).set(snapshot)
+            except Exception as e:
+                log.warning("Stats publish failed", error=str(e))
+
+    def stop(self):
+        """Drain the workers, flush rollups and stop the writer"""
+        self.dispatcher.stop()
+        if self.rollups is not None:
+            self.rollups.stop()
+        self.writer.stop()
+        if self.spool is not None:
+            self.spool.close()
+            log.info("Spool closed", replayed=self.writer.replayed,
+                     pending_segments=self.writer.backlog_segments())
+        else:
+            log.info("Writer stopped", **self.writer.stats())
+        if self.changes is not None:
+            log.info("Unchanged states not stored", **self.changes.snapshot())
+        log.info("Pipeline stats", summary=self.stats.summary())
 
 # ================= MQTT =================
 MQTT_BROKER = " MQTT_BROKER_IP_ADDRESS"
 MQTT_PORT = 8883
-MQTT_TOPIC = "building/room1/#"
+# With SHARE_GROUP set, replicas in the group split building/+/+ between them
+# ($share/<group>/building/+/+) instead of each receiving every message. Each
+# then sees only part of a room's messages, so none of them writes rollups:
+# run python rollups.py from one place instead
+SHARE_GROUP = os.environ.get("SHARE_GROUP", "")
+MQTT_TOPIC = subscription(SHARE_GROUP)  # building/<room>/<kind> for every room
 
 MQTT_USER = "MQTT_USERNAME"
 MQTT_PASS = "MQTT_PASSWORD"
 
 CA_FILE = "/etc/mosquitto/certs/ca.crt"
 
-# ================= CALLBACKS =================
-def on_connect(client, userdata, flags, rc):
-    print("Connected to MQTT, rc =", rc)
-    client.subscribe(MQTT_TOPIC)
+# ================= CLIENT =================
+def main():
+    enable_profiling()
+    db, increment = connect_firestore()
+    ingester = Ingester(db, increment, topic=MQTT_TOPIC, rollups=not SHARE_GROUP).start_stats()
+    start_metrics_server(ingester)
+
+    # MQTT v5 for shared subscriptions; the ingester acks once a message is stored
+    client = mqtt.Client(CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5, manual_ack=True)
+    client.username_pw_set(MQTT_USER, MQTT_PASS)
 
-def on_message(client, userdata, msg):
+    client.tls_set(
+        ca_certs=CA_FILE,
+        cert_reqs=ssl.CERT_REQUIRED,
+        tls_version=ssl.PROTOCOL_TLSv1_2
+    )
+
+    client.on_connect = ingester.on_connect
+    client.on_disconnect = ingester.on_disconnect
+    client.on_message = ingester.on_message
+
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+
+    #  Start the MQTT loop
     try:
-        data = json.loads(msg.payload.decode())
-        data["timestamp"] = datetime.utcnow().isoformat()
+        client.loop_forever()
+    except KeyboardInterrupt:
+        log.info("Interrupted by user, exiting")
+        client.disconnect()
+    finally:
+        ingester.stop()
 
-        db.collection("room_telemetry").add(data)
-        print("Saved:", data)
-    except Exception as e:
-        print("Error:", e)
 
-# ================= CLIENT =================
-client = mqtt.Client()
-client.username_pw_set(MQTT_USER, MQTT_PASS)
-
-client.tls_set(
-    ca_certs=CA_FILE,
-    cert_reqs=ssl.CERT_REQUIRED,
-    tls_version=ssl.PROTOCOL_TLSv1_2
-)
-
-client.on_connect = on_connect
-client.on_message = on_message
-
-client.connect(MQTT_BROKER, MQTT_PORT, 60)
-
-#  Start the MQTT loop 
-try: 
-    client.loop_forever() 
-except KeyboardInterrupt: 
-    print("\nScript interrupted by user. Exiting...") 
-    client.disconnect() 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+# Logging and profiling are shared with the dashboard (common/diagnostics.py)
+import diagnostics  # noqa: E402
+from diagnostics import StructuredLogger, configure_logging, dump_profile  # noqa: E402,F401
+
+# ================= CONFIG =================
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))         # 0 disables /metrics
+PROFILE_OUTPUT = os.environ.get("PROFILE_OUTPUT", "ingester.prof")
+
+
+def get_logger(name):
+    configure_logging()
+    return StructuredLogger(logging.getLogger(name))
+
+
+# ================= METRICS =================
+def _histogram(family, histogram, scale=1.0, labels=()):
+    """Add a pipeline_stats.Histogram to a prometheus HistogramMetricFamily"""
+    counts, count, total = histogram.state()
+    buckets, seen = [], 0
+    for bound, n in zip(histogram.bounds, counts):
+        seen += n
+        buckets.append((repr(bound * scale), seen))
+    buckets.append(("+Inf", count))
+    family.add_metric(list(labels), buckets, total * scale)
+
+
+class IngesterCollector:
+    """Reads the ingester's own counters at scrape time, so the hot path pays nothing extra"""
+
+    def __init__(self, ingester):
+        self.ingester = ingester
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+        ing = self.ingester
+        router = ing.dispatcher
+        writer = ing.writer
+
+        messages = CounterMetricFamily("ingest_messages", "MQTT messages by routing result",
+                                       labels=["result"])
+        for result in ("routed", "unrouted", "dropped"):
+            messages.add_metric([result], getattr(router, result))
+        yield messages
+        yield CounterMetricFamily("ingest_decode_failures", "Payloads that failed to decode",
+                                  value=router.decode_errors)
+        yield CounterMetricFamily("ingest_records_stored", "Records handed to the writer",
+                                  value=router.stored)
+        yield CounterMetricFamily("ingest_duplicates", "Records dropped as duplicate sequence numbers",
+                                  value=router.duplicates)
+        if getattr(ing, "changes", None) is not None:
+            yield CounterMetricFamily("ingest_writes_avoided", "Unchanged telemetry states not stored",
+                                      value=ing.changes.suppressed)
+            yield CounterMetricFamily("ingest_heartbeats", "Unchanged states stored as heartbeats",
+                                      value=ing.changes.heartbeats)
+
+        seq = ing.stats.sequences.snapshot()
+        yield CounterMetricFamily("ingest_sequence_gaps", "Jumps in a device's sequence numbers",
+                                  value=seq["gaps"])
+        yield GaugeMetricFamily("ingest_missing_messages", "Sequence numbers never received",
+                                value=seq["missing"])
+
+        depth = GaugeMetricFamily("ingest_queue_depth", "Items waiting per stage", labels=["stage"])
+        depth.add_metric(["router"], sum(router.queue_depths()))
+        if ing.spool is not None:
+            depth.add_metric(["spool_segments"], writer.backlog_segments())
+        else:
+            depth.add_metric(["writer"], writer.queue_depth)
+        yield depth
+
+        yield CounterMetricFamily("ingest_documents_committed", "Documents written to Firestore",
+                                  value=ing.committed())
+        if ing.spool is not None:
+            yield CounterMetricFamily("ingest_commit_retries", "Failed replay commits, retried",
+                                      value=writer.retries)
+        else:
+            lost = CounterMetricFamily("ingest_writer_overflow", "Documents not written directly",
+                                       labels=["outcome"])
+            for outcome in ("dropped", "spilled", "failed"):
+                lost.add_metric([outcome], getattr(writer, outcome))
+            yield lost
+
+        latency = HistogramMetricFamily("ingest_write_latency_seconds", "Firestore commit latency")
+        _histogram(latency, writer.flush_ms, scale=0.001)
+        yield latency
+        sizes = HistogramMetricFamily("ingest_batch_size", "Documents per Firestore commit")
+        _histogram(sizes, writer.batch_sizes)
+        yield sizes
+
+        pipeline = HistogramMetricFamily("ingest_pipeline_latency_seconds",
+                                         "Device -> ingest -> Firestore latency", labels=["span"])
+        for span in ("device_to_ingest", "ingest_to_commit", "device_to_commit"):
+            _histogram(pipeline, getattr(ing.stats, span), scale=0.001, labels=[span])
+        yield pipeline
+
+
+def start_metrics_server(ingester, port=METRICS_PORT):
+    """Serve /metrics for this ingester on port (0 = disabled)"""
+    if not port:
+        return
+    from prometheus_client import REGISTRY, start_http_server
+    REGISTRY.register(IngesterCollector(ingester))
+    start_http_server(port)
+    get_logger(__name__).info("Metrics listening", port=port)
+
+
+# ================= PROFILING =================
+def enable_profiling():
+    """Profile every thread into PROFILE_OUTPUT, if PROFILE=1 (see diagnostics.enable_profiling)"""
+    diagnostics.enable_profiling(PROFILE_OUTPUT, get_logger(__name__))
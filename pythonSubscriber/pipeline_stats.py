@@ -0,0 +1,209 @@
+import bisect
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# ================= LATENCY =================
+# Upper bounds in ms; the last bucket catches everything slower
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# Documents per Firestore commit (500 is the WriteBatch limit)
+BATCH_SIZE_BUCKETS = (1, 10, 50, 100, 250, 500)
+
+# Seqs remembered per device for duplicate detection, and how far back a seq
+# may jump before it is taken as a device reboot (the counter restarts at 1)
+SEQ_WINDOW = 1024
+
+
+def iso_to_epoch(ts):
+    """Naive-UTC ISO string -> epoch seconds"""
+    return (datetime.fromisoformat(ts) - datetime(1970, 1, 1)).total_seconds()
+
+
+class Histogram:
+    """Fixed-bucket histogram; latencies are in milliseconds"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.negative = 0       # device clock ahead of ours; recorded as 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if value < 0:
+            with self._lock:
+                self.negative += 1
+            value = 0.0
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def state(self):
+        """(bucket counts, count, sum) read together, for exporters"""
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (max for the overflow bucket)"""
+        counts, count, _ = self.state()
+        if not count:
+            return 0.0
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= q * count and n:
+                return float(self.bounds[i]) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        counts, count, total = self.state()
+        buckets = {str(b): n for b, n in zip(self.bounds, counts)}
+        buckets["inf"] = counts[-1]
+        return {
+            "count": count,
+            "avg": total / count if count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "negative": self.negative,
+            "buckets": buckets,
+        }
+
+
+# ================= SEQUENCE NUMBERS =================
+class SequenceTracker:
+    """Gap, duplicate and reorder detection on the firmware's publish counter.
+
+    Each (device, collection) pair is tracked on its own, since a status and
+    its event carry the same seq. A message is identified by its seq and
+    device time (NTP time, or millis() since boot before the clock syncs),
+    like router.document_id: the counter restarts at 1 after a reboot, so
+    the seq alone would take every reading after it for a duplicate. A seq
+    going back with a newer NTP time is taken as a reboot.
+    """
+
+    def __init__(self, window=SEQ_WINDOW):
+        self.window = window
+        self._last = {}      # key -> (highest seq, its device time)
+        self._seen = {}      # key -> (deque of (seq, device time), set of them)
+        self._lock = threading.Lock()
+
+        self.received = 0
+        self.gaps = 0
+        self.missing = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.resets = 0
+
+    def check(self, device_id, collection, seq, device_time=None):
+        """Record seq; returns False if it is a duplicate that should not be stored"""
+        key = (device_id, collection)
+        message = (seq, device_time)
+        with self._lock:
+            self.received += 1
+            last = self._last.get(key)
+            if last is None or seq < last[0] - self.window or (
+                    seq < last[0] and _rebooted(last[1], device_time)):
+                if last is not None:
+                    self.resets += 1
+                self._last[key] = message
+                self._seen[key] = (deque([message]), {message})
+                return True
+
+            order, seen = self._seen[key]
+            if message in seen:
+                self.duplicates += 1
+                return False
+            last_seq = last[0]
+            if seq > last_seq + 1:
+                self.gaps += 1
+                self.missing += seq - last_seq - 1
+            elif seq < last_seq:
+                # A late message fills a gap counted earlier
+                self.reordered += 1
+                self.missing = max(0, self.missing - 1)
+            if seq > last_seq:
+                self._last[key] = message
+            order.append(message)
+            seen.add(message)
+            if len(order) > self.window:
+                seen.discard(order.popleft())
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "received": self.received,
+                "gaps": self.gaps,
+                "missing": self.missing,
+                "duplicates": self.duplicates,
+                "reordered": self.reordered,
+                "resets": self.resets,
+                "devices": len({device for device, _ in self._last}),
+            }
+
+
+def _rebooted(last_time, device_time):
+    """True if device_time is a newer NTP time than last_time (naive-UTC ISO strings)"""
+    return isinstance(last_time, str) and isinstance(device_time, str) and device_time > last_time
+
+
+# ================= PIPELINE =================
+class PipelineStats:
+    """End-to-end latency (device -> ingest -> Firestore) and sequence checks.
+
+    accept() runs on the router workers for every decoded record, committed()
+    on the writer thread after each successful Firestore commit.
+    """
+
+    def __init__(self):
+        self.sequences = SequenceTracker()
+        self.device_to_ingest = Histogram()
+        self.ingest_to_commit = Histogram()
+        self.device_to_commit = Histogram()
+
+    def accept(self, record):
+        device_time = record.device_timestamp or record.device_ms
+        if record.seq is not None and not self.sequences.check(
+                record.device_id, record.collection, record.seq, device_time):
+            return False
+        if record.device_timestamp:
+            ms = (iso_to_epoch(record.timestamp) - iso_to_epoch(record.device_timestamp)) * 1000
+            self.device_to_ingest.observe(ms)
+        return True
+
+    def committed(self, docs, now=None):
+        now = time.time() if now is None else now
+        for data in docs:
+            ts = data.get("timestamp")
+            if not ts:
+                continue
+            self.ingest_to_commit.observe((now - iso_to_epoch(ts)) * 1000)
+            device_ts = data.get("device_timestamp")
+            if device_ts:
+                self.device_to_commit.observe((now - iso_to_epoch(device_ts)) * 1000)
+
+    def snapshot(self):
+        return {
+            "updated": datetime.utcnow().isoformat(),
+            "sequences": self.sequences.snapshot(),
+            "device_to_ingest": self.device_to_ingest.snapshot(),
+            "ingest_to_commit": self.ingest_to_commit.snapshot(),
+            "device_to_commit": self.device_to_commit.snapshot(),
+        }
+
+    def summary(self):
+        seq = self.sequences.snapshot()
+        parts = [f"{name} p50={h.quantile(0.5):.0f}ms p99={h.quantile(0.99):.0f}ms"
+                 for name, h in (("device->ingest", self.device_to_ingest),
+                                 ("ingest->firestore", self.ingest_to_commit),
+                                 ("device->firestore", self.device_to_commit))]
+        parts.append(f"gaps={seq['gaps']} missing={seq['missing']} "
+                     f"duplicates={seq['duplicates']} reordered={seq['reordered']}")
+        return " | ".join(parts)
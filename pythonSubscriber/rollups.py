@@ -0,0 +1,259 @@
+import argparse
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from batch_writer import commit_batch, MAX_BATCH_SIZE
+from observability import get_logger
+
+log = get_logger(__name__)
+
+# ================= ROLLUPS =================
+# Per-room totals at minute/hour/day granularity, kept in room_rollups as
+# <device_id>_<granularity>_<bucket>. Bucket boundaries are in UTC, like the
+# timestamps. Device time is used when the firmware sent it.
+ROLLUP_COLLECTION = "room_rollups"
+ROLLUP_FLUSH_SECONDS = 10
+# rebuild() also reads this much before its range, for the state each room was in
+REBUILD_LOOKBACK = timedelta(hours=1)
+
+GRANULARITIES = {
+    "minute": (60, "%Y-%m-%dT%H:%M"),
+    "hour": (3600, "%Y-%m-%dT%H"),
+    "day": (86400, "%Y-%m-%d"),
+}
+
+# Telemetry field -> rollup counter of seconds spent in state 1
+ON_SECONDS = {
+    "occupied": "occupied_seconds",
+    "fan": "fan_on_seconds",
+    "led": "led_on_seconds",
+}
+
+
+def record_time(record):
+    """Device timestamp if the message carried one, else the ingest timestamp"""
+    return record.get("device_timestamp") or record["timestamp"]
+
+
+def epoch_seconds(timestamp):
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def bucket_start(t, granularity):
+    size = GRANULARITIES[granularity][0]
+    return t - t % size
+
+
+def bucket_key(t, granularity):
+    fmt = GRANULARITIES[granularity][1]
+    return datetime.fromtimestamp(bucket_start(t, granularity), timezone.utc).strftime(fmt)
+
+
+class RollupAggregator:
+    """Accumulate rollup deltas from ingested records and upsert them in batches.
+
+    Deltas are written with Firestore Increment transforms, so flushes from
+    several ingester runs add up instead of overwriting each other. On-time
+    accrues between consecutive states of a room, so the aggregator must see
+    all of a room's messages: replicas on a shared subscription leave rollups
+    to rebuild() instead.
+    """
+
+    def __init__(self, db, increment=None, flush_seconds=ROLLUP_FLUSH_SECONDS):
+        if increment is None:
+            from google.cloud.firestore import Increment as increment
+        self.db = db
+        self.increment = increment
+        self.flush_seconds = flush_seconds
+
+        self._last = {}        # device_id -> (epoch seconds, telemetry record)
+        self._pending = {}     # doc id -> delta document
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.flushes = 0
+        self.docs_written = 0
+
+    # ================= INPUT =================
+    def add(self, collection, data):
+        """Hook for the router's store callback"""
+        device_id = data.get("device_id")
+        if not device_id or "timestamp" not in data:
+            return
+        if collection == "room_telemetry":
+            self.add_telemetry(device_id, data)
+        elif collection == "room_events":
+            self.add_event(device_id, data)
+
+    def add_telemetry(self, device_id, record):
+        t = epoch_seconds(record_time(record))
+        with self._lock:
+            prev_t, prev = self._last.get(device_id, (None, None))
+            if prev is not None and t > prev_t:
+                for field, counter in ON_SECONDS.items():
+                    if prev.get(field, 0) == 1:
+                        self._accrue(device_id, counter, prev_t, t)
+
+            prev_occupied = prev.get("occupied", 0) if prev is not None else 0
+            if prev_occupied == 0 and record.get("occupied", 0) == 1:
+                hour = datetime.fromtimestamp(t, timezone.utc).hour
+                for granularity in GRANULARITIES:
+                    delta = self._delta(device_id, granularity, t)
+                    delta["entries"] += 1
+                    delta["hour_histogram"][str(hour)] += 1
+
+            if prev is None or t >= prev_t:
+                self._last[device_id] = (t, record)
+
+    def add_event(self, device_id, record):
+        if not record.get("event", "").startswith("MANUAL_"):
+            return
+        t = epoch_seconds(record_time(record))
+        with self._lock:
+            for granularity in GRANULARITIES:
+                self._delta(device_id, granularity, t)["manual_overrides"] += 1
+
+    def _accrue(self, device_id, counter, start, end):
+        """Add the seconds of [start, end) to every bucket they overlap"""
+        for granularity, (size, _) in GRANULARITIES.items():
+            t = start
+            while t < end:
+                next_t = min(bucket_start(t, granularity) + size, end)
+                self._delta(device_id, granularity, t)[counter] += next_t - t
+                t = next_t
+
+    def _delta(self, device_id, granularity, t):
+        key = bucket_key(t, granularity)
+        doc_id = f"{device_id}_{granularity}_{key}"
+        if doc_id not in self._pending:
+            self._pending[doc_id] = {
+                "device_id": device_id,
+                "granularity": granularity,
+                "bucket": key,
+                "occupied_seconds": 0,
+                "fan_on_seconds": 0,
+                "led_on_seconds": 0,
+                "entries": 0,
+                "manual_overrides": 0,
+                "hour_histogram": defaultdict(int),
+            }
+        return self._pending[doc_id]
+
+    # ================= OUTPUT =================
+    def flush(self):
+        """Upsert all pending deltas; on failure they are kept for the next flush"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        for i in range(0, len(items), MAX_BATCH_SIZE):
+            chunk = items[i:i + MAX_BATCH_SIZE]
+            try:
+                commit_batch(self.db, [(ROLLUP_COLLECTION, doc_id, self._as_upsert(delta))
+                                       for doc_id, delta in chunk], merge=True)
+            except Exception as e:
+                log.warning("Rollup flush failed", pending=len(items) - i, error=str(e), sample="flush")
+                with self._lock:
+                    for doc_id, delta in items[i:]:
+                        self._restore(doc_id, delta)
+                return self.docs_written
+            self.docs_written += len(chunk)
+        self.flushes += 1
+        return self.docs_written
+
+    def _as_upsert(self, delta):
+        doc = {}
+        for key, value in delta.items():
+            if key == "hour_histogram":
+                if value:
+                    doc[key] = {h: self.increment(n) for h, n in value.items()}
+            elif isinstance(value, str):
+                doc[key] = value
+            else:
+                doc[key] = self.increment(value)
+        return doc
+
+    def _restore(self, doc_id, delta):
+        if doc_id not in self._pending:
+            self._pending[doc_id] = delta
+            return
+        current = self._pending[doc_id]
+        for key, value in delta.items():
+            if key == "hour_histogram":
+                for h, n in value.items():
+                    current[key][h] += n
+            elif not isinstance(value, str):
+                current[key] += value
+
+    # ================= LIFECYCLE =================
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rollup-flusher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+
+# ================= REBUILD =================
+def rebuild(db, start, end):
+    """Recompute the rollup buckets starting in [start, end) from the stored documents.
+
+    start and end are naive-UTC datetimes. Every room's telemetry and events
+    are read in device time order and the buckets are overwritten, not
+    incremented, so a rebuild can run again over the same range. Returns the
+    number of rollup documents written.
+    """
+    aggregator = RollupAggregator(db, increment=lambda n: n)
+    since = (start - REBUILD_LOOKBACK).isoformat()
+    for collection in ("room_telemetry", "room_events"):
+        query = db.collection(collection).where("timestamp", ">=", since) \
+                  .where("timestamp", "<", end.isoformat())
+        docs = [d.to_dict() for d in query.stream()]
+        docs.sort(key=lambda d: (d.get("device_id") or "", record_time(d)))
+        for data in docs:
+            aggregator.add(collection, data)
+
+    first, last = start.replace(tzinfo=timezone.utc).timestamp(), end.replace(tzinfo=timezone.utc).timestamp()
+    docs = []
+    for doc_id, delta in aggregator._pending.items():
+        # Buckets the lookback only saw part of are left alone
+        if first <= epoch_seconds(_bucket_time(delta)) < last:
+            docs.append((ROLLUP_COLLECTION, doc_id, aggregator._as_upsert(delta)))
+    for i in range(0, len(docs), MAX_BATCH_SIZE):
+        commit_batch(db, docs[i:i + MAX_BATCH_SIZE])
+    log.info("Rollups rebuilt", start=start.isoformat(), end=end.isoformat(), docs=len(docs))
+    return len(docs)
+
+
+def _bucket_time(delta):
+    """ISO start of a delta's bucket, from its bucket key"""
+    return datetime.strptime(delta["bucket"], GRANULARITIES[delta["granularity"]][1]).isoformat()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild room_rollups from the stored documents (for SHARE_GROUP replicas)")
+    parser.add_argument("--days", type=int, default=1,
+                        help="whole UTC days to rebuild, today included")
+    args = parser.parse_args()
+
+    from mqtt_to_firestore import connect_firestore
+    db, _ = connect_firestore()
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    rebuild(db, today - timedelta(days=args.days - 1), datetime.utcnow())
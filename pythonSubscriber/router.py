@@ -0,0 +1,381 @@
+import hashlib
+import json
+import queue
+import re
+import struct
+import threading
+import zlib
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from observability import get_logger
+
+log = get_logger(__name__)
+
+# ================= TOPICS =================
+# Firmware publishes to building/<room>/<kind>, e.g. building/room01/status
+TOPIC_PREFIX = "building"
+SUBSCRIBE_TOPIC = "building/+/+"
+
+COLLECTIONS = {
+    "status": "room_telemetry",
+    "event": "room_events",
+}
+
+# ================= BINARY FRAMES =================
+# Optional compact frame from the firmware (USE_BINARY_FRAMES), one message
+# per state change instead of a status JSON plus an event string:
+#   magic u8 | version u8 | device u16 | seq u32 | device time ms u64 | state u8 | event u8
+FRAME_MAGIC = 0xA5
+FRAME_VERSION = 1
+FRAME = struct.Struct("<BBHIQBB")
+
+STATE_BITS = {
+    "occupied": 0x01,
+    "fan": 0x02,
+    "led": 0x04,
+    "fan_override": 0x08,
+    "led_override": 0x10,
+}
+TIME_SYNCED_BIT = 0x80   # device time is NTP epoch ms rather than millis() since boot
+
+EVENT_CODES = {
+    1: "AUTO_ON",
+    2: "AUTO_OFF",
+    3: "MANUAL_FAN",
+    4: "MANUAL_LED",
+}
+
+WORKER_QUEUE_SIZE = 10000
+
+
+class DecodeError(ValueError):
+    pass
+
+
+EPOCH = datetime(1970, 1, 1)
+
+def device_timestamp(ms, synced=True):
+    """NTP epoch ms from the device -> naive-UTC ISO string like the ingest timestamp.
+
+    None until the device clock has synced, since millis() since boot says
+    nothing about wall time.
+    """
+    if ms is None or not synced:
+        return None
+    return (EPOCH + timedelta(milliseconds=int(ms))).isoformat()
+
+
+def _field(device_id, data, key, convert, default=None):
+    """data[key] through convert; a malformed value is a DecodeError, not a crash"""
+    value = data.get(key, default)
+    if value is None:
+        return None
+    try:
+        return convert(value)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise DecodeError(f"Bad {key!r} from {device_id}: {value!r} ({e})")
+
+
+def _sequence_fields(device_id, data):
+    synced = bool(data.get("synced", 1))
+    return {
+        "seq": _field(device_id, data, "seq", int),
+        "device_timestamp": _field(device_id, data, "ts", lambda ms: device_timestamp(ms, synced)),
+        "device_ms": None if synced else _field(device_id, data, "ts", int),
+    }
+
+
+def subscription(group=None):
+    """SUBSCRIBE_TOPIC, or an MQTT v5 shared subscription splitting it across a group.
+
+    Replicas subscribing with the same group each get a share of the
+    messages instead of every message.
+    """
+    return f"$share/{group}/{SUBSCRIBE_TOPIC}" if group else SUBSCRIBE_TOPIC
+
+
+def parse_topic(topic):
+    """Split building/<room>/<kind> into (room, kind); None if it does not match"""
+    parts = topic.split("/")
+    if len(parts) != 3 or parts[0] != TOPIC_PREFIX or not parts[1] or not parts[2]:
+        return None
+    return parts[1], parts[2]
+
+
+def device_id_for(room):
+    """Map the topic room segment to the dashboard's device id (room01 -> room_01)"""
+    match = re.fullmatch(r"room_?(\d+)", room)
+    return f"room_{match.group(1)}" if match else room
+
+
+# ================= RECORDS =================
+@dataclass
+class TelemetryRecord:
+    device_id: str
+    timestamp: str
+    occupied: int = 0
+    fan: int = 0
+    led: int = 0
+    fan_override: int = 0
+    led_override: int = 0
+    seq: int = None
+    device_timestamp: str = None
+    device_ms: int = None     # millis() since boot, while the device clock is not synced
+    repeats: int = None       # on heartbeats: unchanged states not stored since the last one
+
+    collection = COLLECTIONS["status"]
+
+    def to_dict(self):
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+
+@dataclass
+class EventRecord:
+    device_id: str
+    timestamp: str
+    event: str
+    seq: int = None
+    device_timestamp: str = None
+    device_ms: int = None
+
+    collection = COLLECTIONS["event"]
+
+    def to_dict(self):
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+
+def decode_status(device_id, payload, timestamp):
+    try:
+        data = json.loads(payload)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise DecodeError(f"Bad status payload from {device_id}: {e}")
+    if not isinstance(data, dict):
+        raise DecodeError(f"Status payload from {device_id} is not an object")
+    states = {}
+    for key in ("occupied", "fan", "led", "fan_override", "led_override"):
+        states[key] = _field(device_id, data, key, int, default=0)
+        if states[key] is None:
+            raise DecodeError(f"Bad {key!r} from {device_id}: null")
+    return TelemetryRecord(
+        device_id=device_id,
+        timestamp=timestamp,
+        **states,
+        **_sequence_fields(device_id, data)
+    )
+
+
+def decode_event(device_id, payload, timestamp):
+    """Events are JSON ({"event", "seq", "ts"}); older firmware sends a bare string (AUTO_ON)"""
+    try:
+        text = bytes(payload).decode().strip()
+    except UnicodeDecodeError as e:
+        raise DecodeError(f"Bad event payload from {device_id}: {e}")
+    fields = {}
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise DecodeError(f"Bad event payload from {device_id}: {e}")
+        if not isinstance(data, dict) or not isinstance(data.get("event", ""), str):
+            raise DecodeError(f"Event payload from {device_id} is not an object with a string event")
+        text = data.get("event", "")
+        fields = _sequence_fields(device_id, data)
+    if not text:
+        raise DecodeError(f"Empty event from {device_id}")
+    return EventRecord(device_id=device_id, timestamp=timestamp, event=text, **fields)
+
+
+def decode_frame(payload, timestamp):
+    """Unpack a binary frame in place into a telemetry record and, if set, an event"""
+    view = memoryview(payload)
+    if len(view) < FRAME.size:
+        raise DecodeError(f"Short frame ({len(view)} bytes)")
+    magic, version, device, seq, device_time_ms, state, event_code = FRAME.unpack_from(view)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise DecodeError(f"Unknown frame magic/version {magic:#x}/{version}")
+
+    device_id = f"room_{device:02d}"
+    device_ts = device_timestamp(device_time_ms, state & TIME_SYNCED_BIT)
+    device_ms = None if state & TIME_SYNCED_BIT else device_time_ms
+    records = [TelemetryRecord(
+        device_id=device_id,
+        timestamp=timestamp,
+        occupied=1 if state & STATE_BITS["occupied"] else 0,
+        fan=1 if state & STATE_BITS["fan"] else 0,
+        led=1 if state & STATE_BITS["led"] else 0,
+        fan_override=1 if state & STATE_BITS["fan_override"] else 0,
+        led_override=1 if state & STATE_BITS["led_override"] else 0,
+        seq=seq,
+        device_timestamp=device_ts,
+        device_ms=device_ms,
+    )]
+    if event_code:
+        records.append(EventRecord(
+            device_id=device_id,
+            timestamp=timestamp,
+            event=EVENT_CODES.get(event_code, f"EVENT_{event_code}"),
+            seq=seq,
+            device_timestamp=device_ts,
+            device_ms=device_ms,
+        ))
+    return records
+
+
+def is_frame(payload):
+    return len(payload) > 0 and payload[0] == FRAME_MAGIC
+
+
+DECODERS = {
+    "status": decode_status,
+    "event": decode_event,
+}
+
+
+def decode(room, kind, payload, timestamp):
+    """Decode one message into a list of records (empty for unknown kinds).
+
+    Binary frames are recognised by their magic byte on any topic kind;
+    JSON and bare-string payloads keep the per-kind decoders.
+    """
+    if is_frame(payload):
+        return decode_frame(payload, timestamp)
+    decoder = DECODERS.get(kind)
+    if decoder is None:
+        return []
+    return [decoder(device_id_for(room), payload, timestamp)]
+
+
+# ================= DOCUMENT IDS =================
+# Set per delivery or per replica, so left out of content-hashed ids
+VOLATILE_FIELDS = ("timestamp", "repeats")
+
+def document_id(collection, data, fallback=None):
+    """Deterministic Firestore id, so a redelivered message maps to its own document.
+
+    Records with a seq are keyed by device, device time and seq: the NTP
+    time once the clock has synced, else millis() since boot. That holds
+    even when another replica ingests the redelivery; the seq alone would
+    collide after a reboot. Anything else gets fallback, or a hash of the
+    fields a redelivery repeats, without the ingest timestamp or the
+    replica's heartbeat count. Only legacy messages with neither a seq nor
+    a device time hash the ingest timestamp too: nothing else tells two
+    identical readings apart, so a redelivery of those may still be stored twice.
+    """
+    seq, device_ts, device_id = data.get("seq"), data.get("device_timestamp"), data.get("device_id")
+    if seq is not None and device_ts and device_id:
+        ms = round((datetime.fromisoformat(device_ts) - EPOCH).total_seconds() * 1000)
+        return f"{device_id}-{ms}-{seq}"
+    if seq is not None and data.get("device_ms") is not None and device_id:
+        return f"{device_id}-boot{data['device_ms']}-{seq}"
+    if fallback is not None:
+        return fallback
+    identified = seq is not None or device_ts or data.get("device_ms") is not None
+    content = {k: v for k, v in data.items() if not (identified and k in VOLATILE_FIELDS)}
+    content = json.dumps([collection, content], sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()[:24]
+
+
+# ================= SHARDED WORKERS =================
+class ShardedDispatcher:
+    """Decode and store messages on N worker threads, sharded by room.
+
+    All messages of a room land on the same worker, so they keep their order
+    while different rooms are handled in parallel. A full shard queue blocks
+    dispatch() rather than dropping the message, so the MQTT thread stops
+    reading until the worker catches up. With a PipelineStats,
+    records are checked for sequence gaps and duplicates before storing; with
+    a ChangeFilter, unchanged telemetry states are not stored.
+    """
+
+    def __init__(self, store, num_workers=4, queue_size=WORKER_QUEUE_SIZE, stats=None,
+                 changes=None):
+        self.store = store
+        self.stats = stats
+        self.changes = changes
+        self.num_workers = num_workers
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(num_workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+
+        self.routed = 0
+        self.unrouted = 0
+        self.decode_errors = 0
+        self.dropped = 0           # never: dispatch() blocks instead
+        self.duplicates = 0
+        self.stored = 0
+
+    def shard_for(self, room):
+        return zlib.crc32(room.encode()) % self.num_workers
+
+    def dispatch(self, topic, payload, timestamp, done=None):
+        """Called from the MQTT thread; only routes and enqueues.
+
+        done(), if given, is called once the message's records are stored
+        (right away for a topic that routes nowhere).
+        """
+        route = parse_topic(topic)
+        if route is None:
+            self._count("unrouted")
+            if done is not None:
+                done()
+            return False
+        room, kind = route
+        self._queues[self.shard_for(room)].put((room, kind, payload, timestamp, done))
+        self._count("routed")
+        return True
+
+    def queue_depths(self):
+        return [q.qsize() for q in self._queues]
+
+    def start(self):
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._work, args=(q,), name=f"router-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=10):
+        """Process everything already queued, then stop the workers"""
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            room, kind, payload, timestamp, done = item
+            try:
+                self._handle(room, kind, payload, timestamp)
+            except Exception as e:
+                # One bad message must not stop this shard's worker
+                log.error("Worker error", room=room, kind=kind, error=str(e), sample="worker")
+                self._count("decode_errors")
+            if done is not None:
+                done()
+
+    def _handle(self, room, kind, payload, timestamp):
+        try:
+            records = decode(room, kind, payload, timestamp)
+        except DecodeError as e:
+            log.warning("Decode error", room=room, kind=kind, error=str(e), sample="decode")
+            self._count("decode_errors")
+            return
+        for record in records:
+            if self.stats is not None and not self.stats.accept(record):
+                self._count("duplicates")
+                continue
+            if self.changes is not None and not self.changes.keep(record):
+                continue
+            try:
+                self.store(record.collection, record.to_dict())
+                self._count("stored")
+            except Exception as e:
+                log.error("Store error", device_id=record.device_id, error=str(e), sample="store")
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+import uuid
+from batch_writer import commit_new, MAX_BATCH_SIZE
+from observability import get_logger
+from pipeline_stats import Histogram, BATCH_SIZE_BUCKETS
+from router import document_id
+
+log = get_logger(__name__)
+
+# ================= DEFAULTS =================
+SEGMENT_SIZE = 64 * 1024 * 1024   # rotate the journal every 64 MB
+FSYNC_INTERVAL = 0.05             # group fsyncs; at most 50 ms of writes at risk
+REPLAY_IDLE_WAIT = 0.2
+MAX_RETRY_DELAY = 30
+
+
+class Spool:
+    """Append-only, segment-rotated journal of decoded messages.
+
+    Each record is one JSON line. Segments are named segment-<n>.log and are
+    deleted by the replayer once everything in them has reached Firestore.
+    """
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, fsync_interval=FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self.spool_id = self._load_spool_id()
+        self._lock = threading.Lock()
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+        self.appended = 0
+
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        self._file = open(self.segment_path(self.segment), "ab")
+        self._truncate_partial_record()
+
+    # ================= WRITE SIDE =================
+    def append(self, record):
+        """Write one record; returns once it is in the journal (fsync is batched)"""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            if self._file.tell() + len(line) > self.segment_size and self._file.tell() > 0:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._dirty = True
+            self.appended += 1
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+
+    def sync(self):
+        with self._lock:
+            if self._dirty:
+                self._fsync()
+
+    def close(self):
+        with self._lock:
+            self._fsync()
+            self._file.close()
+
+    def _fsync(self):
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+
+    def _rotate(self):
+        self._fsync()
+        self._file.close()
+        self.segment += 1
+        self._file = open(self.segment_path(self.segment), "ab")
+
+    def _truncate_partial_record(self):
+        """Drop a half-written last line left behind by a crash"""
+        path = self.segment_path(self.segment)
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        with open(path, "rb") as f:
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            end = f.read().rfind(b"\n") + 1
+        self._file.truncate(end)
+        self._file.seek(end)
+
+    # ================= LAYOUT =================
+    def segments(self):
+        names = [n for n in os.listdir(self.directory)
+                 if n.startswith("segment-") and n.endswith(".log")]
+        return sorted(int(n[len("segment-"):-len(".log")]) for n in names)
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.log")
+
+    def _load_spool_id(self):
+        path = os.path.join(self.directory, "spool.id")
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(uuid.uuid4().hex[:12])
+        with open(path) as f:
+            return f.read().strip()
+
+
+class Replayer:
+    """Drain the spool to Firestore in batches, recording progress in a checkpoint file.
+
+    Document ids come from router.document_id, or from the journal position
+    for records without a device seq, so records replayed again after a crash
+    overwrite themselves instead of being duplicated.
+    """
+
+    def __init__(self, spool, db, batch_size=MAX_BATCH_SIZE, on_commit=None):
+        self.spool = spool
+        self.on_commit = on_commit     # called with the committed documents
+        self.db = db
+        self.batch_size = batch_size
+        self.checkpoint_path = os.path.join(spool.directory, "checkpoint.json")
+        self.segment, self.offset = self._load_checkpoint()
+
+        self._stop = threading.Event()
+        self._thread = None
+        self.replayed = 0
+        self.retries = 0
+        self.flush_ms = Histogram()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def backlog_segments(self):
+        return len([s for s in self.spool.segments() if s >= self.segment])
+
+    def _run(self):
+        delay = 0.5
+        while not self._stop.is_set():
+            batch, position = self._read_batch()
+            if not batch:
+                self._stop.wait(REPLAY_IDLE_WAIT)
+                continue
+            started = time.monotonic()
+            try:
+                commit_new(self.db, batch)
+            except Exception as e:
+                # Firestore is slow or down: keep the data on disk and retry
+                log.warning("Replay failed", retry_in=delay, size=len(batch), error=str(e),
+                            sample="replay")
+                self.retries += 1
+                self._stop.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            delay = 0.5
+            self.flush_ms.observe((time.monotonic() - started) * 1000)
+            self.batch_sizes.observe(len(batch))
+            self.replayed += len(batch)
+            self._save_checkpoint(*position)
+            if self.on_commit is not None:
+                self.on_commit([d for _, _, d in batch])
+
+    def _read_batch(self):
+        """Read up to batch_size complete records after the checkpoint"""
+        self.spool.sync()
+        batch = []
+        segment, offset = self.segment, self.offset
+
+        while len(batch) < self.batch_size:
+            path = self.spool.segment_path(segment)
+            if not os.path.exists(path):
+                break
+            # Checked before reading: the spool rotates only after the last
+            # append to this segment is flushed, so its EOF is then final
+            finished = segment < self.spool.segment
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while len(batch) < self.batch_size:
+                    start = offset
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break  # end of data or a record still being written
+                    offset += len(line)
+                    record = json.loads(line)
+                    position = f"{self.spool.spool_id}-{segment}-{start}"
+                    doc_id = document_id(record["collection"], record["data"], fallback=position)
+                    batch.append((record["collection"], doc_id, record["data"]))
+            if len(batch) < self.batch_size and finished:
+                segment, offset = segment + 1, 0
+            else:
+                break
+
+        return batch, (segment, offset)
+
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                cp = json.load(f)
+            return cp["segment"], cp["offset"]
+        segments = self.spool.segments()
+        return (segments[0] if segments else 1), 0
+
+    def _save_checkpoint(self, segment, offset):
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+        # Segments before the checkpoint are fully replayed
+        for old in self.spool.segments():
+            if old < segment:
+                os.remove(self.spool.segment_path(old))
+        self.segment, self.offset = segment, offset